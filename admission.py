@@ -0,0 +1,66 @@
+"""Connection admission control: session caps and per-IP connect rate limits."""
+
+import time
+
+MAX_TRACKED_IPS = 10000  # Rate limit buckets kept before full ones are pruned
+
+# Reasons a connection is refused, used as log fields and metric labels
+REJECT_FULL = 'server full'
+REJECT_IP_FULL = 'too many sessions from ip'
+REJECT_RATE = 'connect rate'
+
+
+class AdmissionControl:
+    """Decides whether a new connection may become a session.
+
+    A connection is refused when the server already holds `max_sessions`
+    sessions, when its IP already holds `max_per_ip`, or when its IP has
+    used up its token bucket: each IP may connect `burst` times at once
+    and regains `rate` connects per second. A limit of 0 turns that check
+    off. Current session counts come from the SessionRegistry.
+
+    admit() is called only from the thread or loop that accepts
+    connections, so the buckets need no lock.
+    """
+
+    def __init__(self, sessions, max_sessions=0, max_per_ip=0, rate=0.0, burst=1):
+        self.sessions = sessions
+        self.max_sessions = max_sessions
+        self.max_per_ip = max_per_ip
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # ip -> [tokens, last refill time]
+
+    def admit(self, ip, now=None):
+        """None if a connection from ip may be admitted, otherwise the reason it may not."""
+        if self.max_sessions and len(self.sessions) >= self.max_sessions:
+            return REJECT_FULL
+        if self.max_per_ip and self.sessions.count_from(ip) >= self.max_per_ip:
+            return REJECT_IP_FULL
+        if self.rate and not self._take_token(ip, time.monotonic() if now is None else now):
+            return REJECT_RATE
+        return None
+
+    def _take_token(self, ip, now):
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_IPS:
+                self._prune(now)
+            bucket = self.buckets[ip] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def _prune(self, now):
+        """Forget IPs whose bucket has refilled; a fresh bucket behaves the same."""
+        for ip, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[ip]
+        if len(self.buckets) >= MAX_TRACKED_IPS:
+            # Flooded from more IPs than we track: forget the oldest half
+            for ip in list(self.buckets)[:len(self.buckets) // 2]:
+                del self.buckets[ip]
@@ -0,0 +1,175 @@
+"""Append-only capture of what clients send, for replay.py.
+
+A capture file starts with MAGIC and holds one record per event:
+
+    kind (1 byte) | session id (4) | unix time (8, double) | length (4) | payload
+
+OPEN carries the peer address as 'ip:port', DATA the raw bytes received
+(Telnet commands included, exactly as read from the socket), OUTPUT only
+the length of a reply the server queued (so replay can compare latency
+with the recording without storing what was sent) and CLOSE nothing.
+All integers are little-endian.
+
+The server only appends a tuple to a deque on the serving path; a writer
+thread packs the queued records and appends them with one write per batch:
+
+    recorder = CaptureWriter('/var/tmp/telnet.cap')
+    recorder.record(DATA, session_id, data)
+    recorder.close()
+
+Batches only ever end between records, and each is appended with a single
+write to an O_APPEND descriptor, so two servers can record into the same
+file (the old and new server while a reload drains) without splitting
+each other's records.
+
+Captures hold everything clients typed, passwords included, so the file is
+created readable by its owner only.
+"""
+
+import collections
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PYTCAP1\n'
+RECORD = struct.Struct('<BIdI')
+
+OPEN, DATA, OUTPUT, CLOSE = 1, 2, 3, 4
+
+WRITE_BUFFER = 1 << 20   # Bytes of whole records packed into one write
+FLUSH_INTERVAL = 0.5     # Seconds between writer thread passes
+
+
+class CaptureWriter:
+    """Records session events to an append-only capture file from a background thread."""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size == 0:
+            self._append(MAGIC)
+        self.pending = collections.deque()
+        self.records = 0
+        self.stopping = threading.Event()
+        self.flush_interval = flush_interval
+        self.thread = threading.Thread(target=self._run, name='capture', daemon=True)
+        self.thread.start()
+
+    def record(self, kind, session_id, payload=b''):
+        """Queue one event; payload is bytes, or an int length for OUTPUT."""
+        self.pending.append((kind, session_id, time.time(), payload))
+
+    def _append(self, data):
+        """Append data to the file; one write unless the kernel takes less."""
+        with memoryview(data) as view:
+            while view:
+                view = view[os.write(self.fd, view):]
+
+    def _write_pending(self):
+        pending = self.pending
+        batch = bytearray()
+        while pending:
+            kind, session_id, timestamp, payload = pending.popleft()
+            if isinstance(payload, int):
+                batch += RECORD.pack(kind, session_id, timestamp, payload)
+            else:
+                batch += RECORD.pack(kind, session_id, timestamp, len(payload))
+                batch += payload
+            self.records += 1
+            if len(batch) >= WRITE_BUFFER:
+                self._append(batch)
+                batch = bytearray()
+        if batch:
+            self._append(batch)
+
+    def _run(self):
+        while not self.stopping.wait(self.flush_interval):
+            try:
+                self._write_pending()
+            except OSError:
+                pass  # Disk full or similar; keep serving and try again next pass
+
+    def close(self):
+        """Write what is still queued and close the file."""
+        self.stopping.set()
+        self.thread.join()
+        self._write_pending()
+        os.close(self.fd)
+
+
+def read_capture(path):
+    """Yield (kind, session id, time, payload) for every record in a capture file.
+
+    payload is bytes for OPEN and DATA and the reply length for OUTPUT. A
+    record cut short at the end of the file (the server was killed
+    mid-write) ends the iteration.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, session_id, timestamp, length = RECORD.unpack(header)
+            if kind in (OPEN, DATA):
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+            else:
+                payload = length
+            yield kind, session_id, timestamp, payload
+
+
+class CapturedSession:
+    """Everything one recorded connection sent, in order.
+
+    `inputs` holds (time, data, recorded latency) tuples: the latency is
+    the delay until the server's first reply to that input, or None when
+    the server answered nothing before the next input arrived. `greeted`
+    is set when the server sent something before the client's first input.
+    """
+
+    def __init__(self, key, addr, opened):
+        self.key = key
+        self.addr = addr
+        self.opened = opened
+        self.closed = None
+        self.inputs = []
+        self.output_bytes = 0
+        self.greeted = False
+
+
+def load_sessions(paths):
+    """Read capture files into CapturedSession objects ordered by start time."""
+    sessions = []
+    for path in paths:
+        open_sessions = {}
+        waiting = {}  # session id -> index of the input still waiting for a reply
+        for kind, session_id, timestamp, payload in read_capture(path):
+            if kind == OPEN:
+                session = CapturedSession((path, session_id), payload.decode(errors='replace'), timestamp)
+                open_sessions[session_id] = session
+                sessions.append(session)
+                continue
+            session = open_sessions.get(session_id)
+            if session is None:
+                continue  # Opened before the capture started
+            if kind == DATA:
+                session.inputs.append((timestamp, payload, None))
+                waiting[session_id] = len(session.inputs) - 1
+            elif kind == OUTPUT:
+                session.output_bytes += payload
+                if not session.inputs:
+                    session.greeted = True
+                index = waiting.pop(session_id, None)
+                if index is not None:
+                    sent, data, _ = session.inputs[index]
+                    session.inputs[index] = (sent, data, timestamp - sent)
+            elif kind == CLOSE:
+                session.closed = timestamp
+                del open_sessions[session_id]
+                waiting.pop(session_id, None)
+    sessions.sort(key=lambda session: session.opened)
+    return sessions
@@ -0,0 +1,131 @@
+"""Named publish/subscribe channels for the Telnet server.
+
+Each channel keeps the sessions subscribed to it, so publishing walks only
+that channel's audience instead of every connection, and a short history
+that is replayed to late joiners. A channel outlives its last subscriber
+so its history is still there for the next one, until MAX_CHANNELS
+forces empty channels out. Sessions keep the names of the channels
+they joined, so leaving all of them at disconnect is O(channels joined).
+"""
+
+import collections
+import re
+import threading
+
+HISTORY = 20              # Messages kept per channel for late joiners (0 = none)
+MAX_JOINED = 32           # Channels one session may be subscribed to
+MAX_CHANNELS = 1024       # Channels kept, including empty ones holding history
+
+# Channel names: letters, digits, '-' and '_', optionally written with a leading '#'
+CHANNEL_NAME = re.compile(r'#?([A-Za-z0-9_-]{1,32})')
+
+
+def channel_name(text):
+    """Normalized channel name for user input, or None if it is not a valid name."""
+    match = CHANNEL_NAME.fullmatch(text)
+    return match.group(1).lower() if match else None
+
+
+class Channel:
+    """One channel: its subscribers and recent history."""
+
+    __slots__ = ('name', 'subscribers', 'history')
+
+    def __init__(self, name, history=HISTORY):
+        self.name = name
+        self.subscribers = {}  # socket -> Session
+        self.history = collections.deque(maxlen=history)
+
+
+class ChannelRegistry:
+    """Channel name -> Channel, created on first join or publish.
+
+    Every change holds the registry lock; subscribers() returns a snapshot
+    so fan-out runs without it.
+    """
+
+    def __init__(self, history=HISTORY, max_joined=MAX_JOINED, max_channels=MAX_CHANNELS):
+        self.channels = {}
+        self.history = history
+        self.max_joined = max_joined
+        self.max_channels = max_channels
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.channels)
+
+    def _channel(self, name):
+        """The channel called name, created if needed; None when no more channels fit."""
+        channel = self.channels.get(name)
+        if channel is not None:
+            return channel
+        if len(self.channels) >= self.max_channels:
+            for other in [other for other, entry in self.channels.items() if not entry.subscribers]:
+                del self.channels[other]
+            if len(self.channels) >= self.max_channels:
+                return None
+        channel = self.channels[name] = Channel(name, self.history)
+        return channel
+
+    def join(self, name, session):
+        """Subscribe session to name; returns the channel's history (a list).
+
+        Returns None when the session has joined max_joined channels or no
+        more channels can be created.
+        """
+        with self.lock:
+            if session.channels is None:
+                session.channels = set()
+            if name not in session.channels and len(session.channels) >= self.max_joined:
+                return None
+            channel = self._channel(name)
+            if channel is None:
+                return None
+            channel.subscribers[session.sock] = session
+            session.channels.add(name)
+            return list(channel.history)
+
+    def leave(self, name, session):
+        """Unsubscribe session from name; False if it was not subscribed."""
+        with self.lock:
+            if not session.channels or name not in session.channels:
+                return False
+            session.channels.discard(name)
+            self._remove(name, session.sock)
+            return True
+
+    def leave_all(self, session):
+        """Unsubscribe a closing session from every channel it joined."""
+        if not session.channels:
+            return
+        with self.lock:
+            for name in session.channels:
+                self._remove(name, session.sock)
+            session.channels = None
+
+    def _remove(self, name, sock):
+        channel = self.channels.get(name)
+        if channel is not None:
+            channel.subscribers.pop(sock, None)
+            if not channel.subscribers and not channel.history:
+                del self.channels[name]
+
+    def subscribers(self, name):
+        """Snapshot of the sessions subscribed to name."""
+        with self.lock:
+            channel = self.channels.get(name)
+            return list(channel.subscribers.values()) if channel else []
+
+    def record(self, name, text):
+        """Add a message to the channel's history."""
+        if not self.history:
+            return
+        with self.lock:
+            channel = self._channel(name)
+            if channel is not None:
+                channel.history.append(text)
+
+    def listing(self):
+        """[(name, subscriber count), ...] sorted by name."""
+        with self.lock:
+            return sorted((name, len(channel.subscribers)) for name, channel in self.channels.items())
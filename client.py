@@ -1,46 +1,48 @@
 # Import necessary system and networking libraries
+import argparse
+import getpass
+import json
 import socket
 import sys
-import select
+import selectors
+import re
 import signal
 import termios
 import tty
 import os
 import time
+import functools
+
+from protocol import (IAC, DO, WILL, SB, SE, ECHO, SUPPRESS_GO_AHEAD,
+                      TERMINAL_TYPE, NAWS, BINARY, CR, LF, COMPRESS2, TTYPE_IS, TTYPE_SEND,
+                      LOCAL, OptionRegistry, OptionTable, TelnetParser)
 
 # Basic network configuration for the client
 HOST = 'localhost'  # Server address
 PORT = 2323         # Server port
-BUFFER_SIZE = 1024  # Size of data chunks for transmission
-
-# Telnet protocol control characters and options
-IAC = 255           # Interpret As Command
-DONT = 254          # Don't use option
-DO = 253           # Do use option
-WONT = 252         # Won't use option
-WILL = 251         # Will use option
-SB = 250           # Subnegotiation Begin
-SE = 240           # Subnegotiation End
-ECHO = 1           # Echo option
-SUPPRESS_GO_AHEAD = 3  # Suppress Go Ahead option
-TERMINAL_TYPE = 24     # Terminal type option
-NAWS = 31             # Negotiate About Window Size
-BINARY = 0            # Binary transmission option
-CR = 13              # Carriage Return
-LF = 10              # Line Feed
-NUL = 0              # Null character
+BUFFER_SIZE = 65536  # Bytes taken from the socket or stdin per read
+TIMEOUT = 10.0      # Seconds batch mode waits for the server
+
+# Prompts sent by the server
+LOGIN_PROMPT = 'login: '
+PASSWORD_PROMPT = 'Password: '
+PROMPT = '> '
+
+# Options offered to the server in one burst at connect
+NEGOTIATE = ((WILL, SUPPRESS_GO_AHEAD), (DO, SUPPRESS_GO_AHEAD), (WILL, BINARY), (DO, BINARY),
+             (WILL, NAWS), (WILL, TERMINAL_TYPE))
 
 # Global variables to track client state
 local_echo = True    # Controls whether client echoes input
+compression = True   # Accept MCCP2 compressed output from the server
 original_terminal_settings = None  # Stores original terminal configuration
 last_window_size = (0, 0)  # Tracks the last sent window dimensions
+parsers = {}  # Per-connection Telnet stream parsers (socket -> TelnetParser)
+negotiations = {}  # Per-connection option negotiation state (socket -> OptionTable)
+replies = {}  # Negotiation bytes waiting to go out in one write (socket -> bytearray)
 
-def send_option(client_socket, command, option):
-    """Send a Telnet option command to the server."""
-    try:
-        client_socket.send(bytes([IAC, command, option]))
-    except socket.error as e:
-        print(f"\rError sending option: {e}")
+# Keys that need handling while typing: Ctrl+D, Backspace, Delete and Enter
+SPECIAL_KEYS = re.compile(rb'[\x04\x08\x7f\r]')
 
 def send_suboption(client_socket, option, data):
     """Send a Telnet suboption with specific data."""
@@ -49,65 +51,109 @@ def send_suboption(client_socket, option, data):
     except socket.error as e:
         print(f"\rError sending suboption: {e}")
 
+def queue_option(client_socket, command, option):
+    """Add a Telnet option command to the next negotiation write."""
+    replies.setdefault(client_socket, bytearray()).extend((IAC, command, option))
+
+def queue_suboption(client_socket, option, data):
+    """Add a Telnet suboption to the next negotiation write."""
+    replies.setdefault(client_socket, bytearray()).extend(bytes([IAC, SB, option]) + data + bytes([IAC, SE]))
+
+def flush_replies(client_socket):
+    """Send everything negotiation queued since the last flush in one write."""
+    data = replies.pop(client_socket, None)
+    if data:
+        try:
+            client_socket.send(bytes(data))
+        except socket.error as e:
+            print(f"\rError sending option: {e}")
+
+def window_size_payload():
+    """NAWS payload for the terminal size last seen."""
+    width, height = last_window_size if last_window_size != (0, 0) else (80, 24)
+    return bytes([width >> 8, width & 0xFF, height >> 8, height & 0xFF])
+
+def option_table(client_socket):
+    """The connection's option table, created on first use."""
+    table = negotiations.get(client_socket)
+    if table is None:
+        table = negotiations[client_socket] = OptionTable(telnet_options, client_socket)
+    return table
+
+def start_negotiation(client_socket):
+    """Send every option the client wants in one write at connect.
+
+    The server sends its own burst at the same time; offers that cross
+    are taken as each other's answers, so nothing but the window size
+    needs a second trip.
+    """
+    table = option_table(client_socket)
+    for command, option in NEGOTIATE:
+        table.request(command, option)
+    flush_replies(client_socket)
+
+def handle_negotiation(client_socket, command, option):
+    """Apply one DO/DONT/WILL/WONT from the server through the option table."""
+    option_table(client_socket).receive(command, option)
+
+def handle_subnegotiation(client_socket, option, payload):
+    """Handle a complete IAC SB ... IAC SE block from the server."""
+    option_table(client_socket).subnegotiation(option, payload)
+
+def echo_changed(client_socket, side, enabled):
+    """The server asked us to echo: stop echoing locally while we do."""
+    global local_echo
+    if side == LOCAL:
+        local_echo = not enabled
+
+def window_size_changed(client_socket, side, enabled):
+    """Only now that the server agreed to NAWS may the window size be sent."""
+    if enabled:
+        queue_suboption(client_socket, NAWS, window_size_payload())
+
+def terminal_type_received(client_socket, payload):
+    """TERMINAL-TYPE subnegotiation: answer SEND."""
+    if payload[:1] == TTYPE_SEND:
+        queue_suboption(client_socket, TERMINAL_TYPE, TTYPE_IS + b'VT100')
+
+# Telnet options the client agrees to: local ones it performs itself when the
+# server asks, remote ones it lets the server perform
+telnet_options = OptionRegistry(queue_option)
+telnet_options.register(ECHO, local=True, remote=True, on_change=echo_changed)
+telnet_options.register(SUPPRESS_GO_AHEAD, local=True, remote=True)
+telnet_options.register(BINARY, local=True, remote=True)
+telnet_options.register(TERMINAL_TYPE, local=True, on_subnegotiation=terminal_type_received)
+telnet_options.register(NAWS, local=True, on_change=window_size_changed)
+telnet_options.register(COMPRESS2, remote=lambda: compression)
+
 def process_telnet_command(client_socket, data):
     """Process incoming Telnet commands and handle protocol negotiations."""
-    global local_echo
-    result = bytearray()
-    i = 0
-    while i < len(data):
-        if data[i] == IAC:
-            if i + 1 >= len(data):
-                break
-            if data[i + 1] == IAC:
-                result.append(data[i])
-                i += 2
-            elif data[i + 1] in (DO, DONT, WILL, WONT):
-                if i + 2 >= len(data):
-                    break
-                option = data[i + 2]
-                # Handle various Telnet options
-                if data[i + 1] == DO:
-                    if option == ECHO:
-                        local_echo = False
-                        send_option(client_socket, WILL, ECHO)
-                    elif option == SUPPRESS_GO_AHEAD:
-                        send_option(client_socket, WILL, SUPPRESS_GO_AHEAD)
-                    elif option == TERMINAL_TYPE:
-                        send_option(client_socket, WILL, TERMINAL_TYPE)
-                    elif option == NAWS:
-                        send_option(client_socket, WILL, NAWS)
-                        send_suboption(client_socket, NAWS, bytes([0, 80, 0, 24]))
-                    elif option == BINARY:
-                        send_option(client_socket, WILL, BINARY)
-                elif data[i + 1] == DONT:
-                    if option == ECHO:
-                        local_echo = True
-                        send_option(client_socket, WONT, ECHO)
-                    elif option == BINARY:
-                        send_option(client_socket, WONT, BINARY)
-                elif data[i + 1] == WILL:
-                    if option == BINARY:
-                        send_option(client_socket, DO, BINARY)
-                    elif option == ECHO:
-                        send_option(client_socket, DO, ECHO)
-                i += 3
-            elif data[i + 1] == SB:
-                j = i + 2
-                while j < len(data) and not (data[j] == IAC and j + 1 < len(data) and data[j + 1] == SE):
-                    j += 1
-                if j + 1 < len(data):
-                    suboption = data[i + 2:j]
-                    if suboption[0] == TERMINAL_TYPE and suboption[1] == 1:
-                        send_suboption(client_socket, TERMINAL_TYPE, b'\x00' + b'VT100')
-                    i = j + 2
-                else:
-                    break
-            else:
-                i += 2
-        else:
-            result.append(data[i])
-            i += 1
-    return bytes(result)
+    parser = parsers.get(client_socket)
+    if parser is None:
+        parser = parsers[client_socket] = TelnetParser(
+            on_negotiate=functools.partial(handle_negotiation, client_socket),
+            on_subnegotiation=functools.partial(handle_subnegotiation, client_socket),
+            decompress=True)
+    text = parser.feed(data)
+    # Answer everything this chunk asked for in one write
+    flush_replies(client_socket)
+    return text
+
+def forget_connection(client_socket):
+    """Drop the per-connection protocol state; returns the parser, if any."""
+    negotiations.pop(client_socket, None)
+    replies.pop(client_socket, None)
+    return parsers.pop(client_socket, None)
+
+def compression_summary(parser):
+    """One line describing how much MCCP2 saved on a connection, or None."""
+    if parser is None or not parser.wire_bytes:
+        return None
+    if not parser.stream_bytes:
+        # Only the start of the zlib stream arrived; there is no ratio yet
+        return f"Compression: {parser.wire_bytes} compressed bytes received, none inflated yet"
+    return (f"Compression: {parser.stream_bytes} bytes received as {parser.wire_bytes} "
+            f"({parser.wire_bytes / parser.stream_bytes:.1%})")
 
 def set_raw_mode():
     """Configure terminal for raw input mode."""
@@ -119,7 +165,6 @@ def set_raw_mode():
 
 def restore_terminal():
     """Restore terminal to its original settings."""
-    global original_terminal_settings
     if original_terminal_settings and sys.stdin.isatty():
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, original_terminal_settings)
         print("\rTerminal restored")
@@ -144,15 +189,282 @@ def handle_window_change(signum, frame):
     if 'client_socket' in globals():
         width, height = get_terminal_size()
         if (width, height) != last_window_size:
+            last_window_size = (width, height)
+            table = negotiations.get(client_socket)
+            if table is not None and table.enabled(NAWS, LOCAL):
+                send_suboption(client_socket, NAWS, window_size_payload())
+
+def handle_input(data, line, outgoing, screen):
+    """Apply a block of keystrokes to the line being edited.
+
+    Plain text is copied in bulk between special keys. Completed lines are
+    appended to `outgoing` and local echo to `screen`, so a whole paste
+    costs one send and one terminal write. Returns False on Ctrl+D.
+    """
+    pos = 0
+    for match in SPECIAL_KEYS.finditer(data):
+        text = data[pos:match.start()]
+        line += text
+        if local_echo:
+            screen += text
+        pos = match.end()
+        key = match.group()
+        if key == b'\x04':  # Ctrl+D (EOT)
+            return False
+        elif key == b'\r':  # Enter key
+            outgoing += line
+            outgoing += bytes([CR, LF])
+            line.clear()
+            if local_echo:
+                screen += b'\r\n'
+        elif line:  # Backspace or Delete, only if the line has content
+            del line[-1]
+            if local_echo:
+                screen += b'\b \b'
+    text = data[pos:]
+    line += text
+    if local_echo:
+        screen += text
+    return True
+
+def write_screen(screen):
+    """Write everything gathered for the terminal in one go."""
+    if screen:
+        sys.stdout.buffer.write(screen)
+        sys.stdout.buffer.flush()
+        screen.clear()
+
+class LoginError(Exception):
+    """The server did not accept the login."""
+
+class ReplyMismatchError(Exception):
+    """Replies split on the prompt did not line up with the commands sent."""
+
+class BatchSession:
+    """Non-interactive session that logs in and pipelines whole command lists.
+
+    Option negotiation is answered by the same handlers as the interactive
+    client. Replies are split on the command prompt, or on marker lines
+    echoed after every command when the prompt may appear inside output.
+    """
+
+    def __init__(self, host=HOST, port=PORT, timeout=TIMEOUT, prompt=PROMPT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.prompt = prompt.encode()
+        self.sock = None
+        self.received = bytearray()  # Text (Telnet commands removed) not yet consumed
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setblocking(False)
+        start_negotiation(self.sock)
+
+    def close(self):
+        if self.sock is not None:
+            forget_connection(self.sock)
             try:
-                send_suboption(client_socket, NAWS, bytes([width >> 8, width & 0xFF, height >> 8, height & 0xFF]))
-                last_window_size = (width, height)
-            except:
+                self.sock.close()
+            except socket.error:
                 pass
+            self.sock = None
+
+    def _receive(self, selector):
+        """Wait for and take in one chunk from the server; False once it closed."""
+        if not selector.select(self.timeout):
+            raise TimeoutError(f"no reply from {self.host}:{self.port} within {self.timeout}s")
+        try:
+            data = self.sock.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        self.received += process_telnet_command(self.sock, data)
+        return True
+
+    def read_until(self, *tokens):
+        """Return the text before the first of tokens to arrive, consuming both.
+
+        With several tokens the result is a (text, token) pair.
+        """
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ)
+            while True:
+                found = [(self.received.find(token), token) for token in tokens]
+                found = [entry for entry in found if entry[0] >= 0]
+                if found:
+                    end, token = min(found)
+                    text = bytes(self.received[:end])
+                    del self.received[:end + len(token)]
+                    return text if len(tokens) == 1 else (text, token)
+                if not self._receive(selector):
+                    raise ConnectionError("connection closed by server")
+
+    def login(self, username, password, login_prompt=LOGIN_PROMPT, password_prompt=PASSWORD_PROMPT):
+        """Answer the login and password prompts and wait for the command prompt."""
+        self.read_until(login_prompt.encode())
+        self.sock.sendall(username.encode() + bytes([CR, LF]))
+        self.read_until(password_prompt.encode())
+        self.sock.sendall(password.encode() + bytes([CR, LF]))
+        text, token = self.read_until(self.prompt, login_prompt.encode())
+        if token != self.prompt:
+            # Asked to log in again: the server said why on the line before
+            reason = decode_reply(text).strip().splitlines()
+            raise LoginError(reason[-1] if reason else "login failed")
+
+    def run(self, commands, marker=None):
+        """Send every command at once and return their replies in order.
+
+        Input is written while replies are read, so neither side's socket
+        buffer can fill up and stall the other. With a marker, an echo of
+        '<marker> <n>' follows command n and replies are split on those
+        lines. Otherwise one echoed end marker follows the last command and
+        everything before it is split on the prompt; if that does not give
+        one reply per command (output containing the prompt text), raises
+        ReplyMismatchError. A reply cut short by the server closing the
+        connection is returned as it stands.
+        """
+        outgoing = bytearray()
+        for index, command in enumerate(commands):
+            outgoing += command.encode() + bytes([CR, LF])
+            if marker:
+                outgoing += f"echo {marker} {index}".encode() + bytes([CR, LF])
+        if not marker:
+            end_marker = f"--end-{os.urandom(4).hex()}--"
+            outgoing += f"echo {end_marker}".encode() + bytes([CR, LF])
+            end_line = f"{end_marker}\r\n".encode()
+        replies = []
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            while len(replies) < len(commands):
+                separator = f"{marker} {len(replies)}\r\n".encode() if marker else end_line
+                end = self.received.find(separator)
+                if end >= 0:
+                    reply = bytes(self.received[:end])
+                    del self.received[:end + len(separator)]
+                    if not marker:
+                        return self._split_on_prompt(reply, len(commands))
+                    replies.append(self._strip_prompts(reply))
+                    continue
+                if outgoing:
+                    try:
+                        sent = self.sock.send(outgoing)
+                        del outgoing[:sent]
+                    except BlockingIOError:
+                        pass
+                    if not outgoing:
+                        selector.modify(self.sock, selectors.EVENT_READ)
+                if not self._receive(selector):
+                    if self.received:
+                        reply = bytes(self.received)
+                        self.received.clear()
+                        if marker:
+                            replies.append(self._strip_prompts(reply))
+                        else:
+                            replies = reply.split(self.prompt)[:len(commands)]
+                    break
+        return replies
+
+    def _split_on_prompt(self, text, count):
+        """Split the replies to count commands (and the end marker's echo) on the prompt."""
+        replies = text.split(self.prompt)
+        # One prompt follows every command, the end marker's output comes after the last
+        if len(replies) != count + 1 or replies[-1]:
+            raise ReplyMismatchError(f"{count} commands but {len(replies) - 1} prompts in their output; "
+                                     "use --split marker if output can contain the prompt")
+        return replies[:-1]
+
+    def _strip_prompts(self, reply):
+        """Remove the prompts surrounding a reply split on a marker line."""
+        if reply.startswith(self.prompt):
+            reply = reply[len(self.prompt):]
+        if reply.endswith(self.prompt):
+            reply = reply[:-len(self.prompt)]
+        return reply
+
+def decode_reply(reply):
+    """Reply bytes as text with CR LF line endings turned into newlines."""
+    return reply.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r\0', '\r')
+
+def read_batch(path):
+    """Command lines from a file ('-' for stdin), skipping blanks and # comments."""
+    f = sys.stdin if path == '-' else open(path, 'r')
+    try:
+        return [line.rstrip('\r\n') for line in f
+                if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def run_batch(args):
+    """Log in, pipeline the batch file and print one result per command."""
+    commands = read_batch(args.batch)
+    password = args.password
+    if password is None:
+        password = os.environ.get('TELNET_PASSWORD') or getpass.getpass(f"Password for {args.user}: ")
+    marker = f"--batch-{os.urandom(4).hex()}--" if args.split == 'marker' else None
+    session = BatchSession(args.host, args.port, args.timeout, args.prompt)
+    started = time.perf_counter()
+    try:
+        session.connect()
+        session.login(args.user, password, args.login_prompt, args.password_prompt)
+        replies = session.run(commands, marker)
+    except (OSError, TimeoutError, LoginError, ReplyMismatchError) as e:
+        print(f"Batch failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+    elapsed = time.perf_counter() - started
+
+    out = sys.stdout
+    for index, command in enumerate(commands):
+        output = decode_reply(replies[index]) if index < len(replies) else None
+        if args.format == 'json':
+            out.write(json.dumps({'index': index, 'command': command, 'output': output}) + "\n")
+        else:
+            out.write(f"{args.prompt}{command}\n")
+            if output is None:
+                output = "(no reply)"
+            out.write(output if output.endswith("\n") else output + "\n")
+    out.flush()
+    print(f"{len(replies)}/{len(commands)} commands answered in {elapsed:.3f}s", file=sys.stderr)
+    return 0 if len(replies) == len(commands) else 1
+
+def parse_args(argv=None):
+    """Parse client command line options."""
+    parser = argparse.ArgumentParser(description="Telnet client")
+    parser.add_argument('--host', default=HOST, help="server address (default %(default)s)")
+    parser.add_argument('--port', type=int, default=PORT, help="server port (default %(default)s)")
+    parser.add_argument('--no-compression', action='store_true',
+                        help="refuse MCCP2 compressed output from the server")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument('--batch', metavar='FILE',
+                       help="run the commands in FILE ('-' for stdin) non-interactively")
+    batch.add_argument('--user', default=os.environ.get('TELNET_USER', 'guest'),
+                       help="username to log in with (default $TELNET_USER or guest)")
+    batch.add_argument('--password', default=None,
+                       help="password (default $TELNET_PASSWORD, otherwise asked for)")
+    batch.add_argument('--format', choices=('text', 'json'), default='text',
+                       help="plain text or one JSON object per command (default text)")
+    batch.add_argument('--split', choices=('prompt', 'marker'), default='prompt',
+                       help="split replies on the prompt or on echoed marker lines (default prompt)")
+    batch.add_argument('--prompt', default=PROMPT, help="command prompt (default %(default)r)")
+    batch.add_argument('--login-prompt', default=LOGIN_PROMPT)
+    batch.add_argument('--password-prompt', default=PASSWORD_PROMPT)
+    batch.add_argument('--timeout', type=float, default=TIMEOUT,
+                       help="seconds to wait for the server before giving up (default %(default)s)")
+    return parser.parse_args(argv)
 
 def main():
     """Main client function handling connection and communication."""
-    global client_socket, last_window_size
+    global client_socket, last_window_size, HOST, PORT, compression
+    args = parse_args()
+    compression = not args.no_compression
+    if args.batch:
+        sys.exit(run_batch(args))
+    HOST, PORT = args.host, args.port
+
     # Set up signal handlers for graceful termination
     signal.signal(signal.SIGINT, handle_interrupt)
     signal.signal(signal.SIGTERM, handle_interrupt)
@@ -170,83 +482,82 @@ def main():
         print(f"Connection failed: {e}")
         sys.exit(1)
 
+    stdin_fd = sys.stdin.fileno()
+    selector = selectors.DefaultSelector()
     try:
         # Set up terminal and window size
         set_raw_mode()
         width, height = get_terminal_size()
         last_window_size = (width, height)
 
-        # Send initial window size to server
-        try:
-            send_suboption(client_socket, NAWS, bytes([width >> 8, width & 0xFF, height >> 8, height & 0xFF]))
-        except:
-            pass
+        # Offer our options; the window size follows once the server agrees to NAWS
+        start_negotiation(client_socket)
 
-        # Set up input monitoring
-        inputs = [client_socket, sys.stdin]
-        buffer = bytearray()
+        # Wait on both inputs without a timeout; nothing happens between events.
+        # stdin stays blocking: on a tty it shares its file description with
+        # stdout, which must block so output is never lost to EAGAIN. One
+        # read per readiness event returns what is there without waiting.
+        selector.register(client_socket, selectors.EVENT_READ)
+        selector.register(stdin_fd, selectors.EVENT_READ)
+        line = bytearray()      # Line being typed
+        outgoing = bytearray()  # Completed lines not yet accepted by the socket
+        screen = bytearray()    # Terminal output gathered during one loop pass
+        waiting_to_write = False  # Whether the selector also watches for writability
 
         # Main communication loop
         while True:
-            readable, _, _ = select.select(inputs, [], [], 0.1)
-
-            for s in readable:
-                if s == client_socket:
-                    try:
-                        data = client_socket.recv(BUFFER_SIZE)
-                        if not data:
+            for key, events in selector.select():
+                if key.fileobj is client_socket:
+                    if events & selectors.EVENT_READ:
+                        try:
+                            data = client_socket.recv(BUFFER_SIZE)
+                        except BlockingIOError:
+                            data = None
+                        except socket.error as e:
+                            write_screen(screen)
+                            print(f"\r\nSocket error: {e}")
+                            return
+                        if data == b'':
+                            write_screen(screen)
                             print("\r\nConnection closed by server")
                             return
-
-                        processed_data = process_telnet_command(client_socket, data)
-                        if processed_data:
-                            sys.stdout.buffer.write(processed_data)
-                            sys.stdout.buffer.flush()
-                    except socket.error as e:
-                        print(f"\r\nSocket error: {e}")
+                        if data:
+                            screen += process_telnet_command(client_socket, data)
+                else:
+                    data = os.read(stdin_fd, BUFFER_SIZE)
+                    if not data or not handle_input(data, line, outgoing, screen):  # EOF or Ctrl+D
+                        write_screen(screen)
                         return
 
-                elif s == sys.stdin:
-                    try:
-                        char = sys.stdin.buffer.read(1)
-                        if not char:  # EOF
-                            return
+            # Send completed lines, waiting for writability if the socket is full
+            if outgoing:
+                try:
+                    sent = client_socket.send(outgoing)
+                    del outgoing[:sent]
+                except BlockingIOError:
+                    pass
+                except socket.error as e:
+                    write_screen(screen)
+                    print(f"\r\nSocket error: {e}")
+                    return
+            # Only touch the selector when outgoing turns empty or non-empty
+            if bool(outgoing) != waiting_to_write:
+                waiting_to_write = bool(outgoing)
+                selector.modify(client_socket, selectors.EVENT_READ | selectors.EVENT_WRITE
+                                if waiting_to_write else selectors.EVENT_READ)
 
-                        # Process special input characters
-                        if char == b'\x04':  # Ctrl+D (EOT)
-                            return
-                        elif char == b'\x7f' or char == b'\x08':  # Backspace or Delete
-                            if buffer:  # Only if buffer has content
-                                buffer.pop()  # Remove last character
-                                if local_echo:
-                                    sys.stdout.buffer.write(b'\b \b')
-                                    sys.stdout.buffer.flush()
-                        elif char == b'\r':  # Enter key
-                            if buffer:
-                                cmd = bytes(buffer)
-                                client_socket.send(cmd + bytes([CR, LF]))
-                            else:
-                                client_socket.send(bytes([CR, LF]))
-
-                            if local_echo:
-                                sys.stdout.buffer.write(b'\r\n')
-                                sys.stdout.buffer.flush()
-                            buffer.clear()
-                        else:
-                            buffer.append(ord(char))
-                            if local_echo:
-                                sys.stdout.buffer.write(char)
-                                sys.stdout.buffer.flush()
-                    except Exception as e:
-                        print(f"\r\nInput error: {e}")
-                        continue
+            write_screen(screen)
 
     except Exception as e:
         print(f"\r\nError: {e}")
     finally:
         # Cleanup and close connection
+        selector.close()
         restore_terminal()
         if client_socket:
+            summary = compression_summary(forget_connection(client_socket))
+            if summary:
+                print(f"\r\n{summary}", end="")
             try:
                 client_socket.close()
             except:
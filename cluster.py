@@ -0,0 +1,254 @@
+"""Shared session registry for the pre-fork worker mode.
+
+The supervisor process runs a Broker on a local unix socket. Every worker
+connects a BrokerClient to it and uses it to claim usernames (so a user can
+only be logged in once across all workers), to list the users logged in
+anywhere, and to relay broadcasts to the other workers.
+
+Messages are JSON objects, one per line. Requests that need an answer carry
+an 'id' that is echoed in the reply:
+
+    {"op": "claim", "id": 1, "user": "admin", "addr": ["10.0.0.5", 40000]}
+    {"op": "release", "user": "admin"}
+    {"op": "users", "id": 2}
+    {"op": "publish", "data": "<latin-1 text>", "channel": "news"}
+    {"op": "deliver", "data": "<latin-1 text>", "channel": "news"}
+
+A 'publish' is relayed to the other workers as 'deliver'; 'channel' is
+null for a broadcast to everyone.
+"""
+
+import itertools
+import json
+import os
+import selectors
+import socket
+import threading
+
+import eventlog
+
+REQUEST_TIMEOUT = 2.0  # Seconds a worker waits for the broker before acting alone
+
+
+class Broker:
+    """Session registry and broadcast relay hosted by the supervisor.
+
+    It is driven by poll() from the supervisor's main loop and starts no
+    threads, so the supervisor can keep forking workers safely.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.buffers = {}  # worker connection -> bytearray of unparsed input
+        self.owned = {}    # worker connection -> usernames it claimed
+        self.users = {}    # username -> (worker connection, addr)
+
+    def start(self):
+        """Create the unix socket workers connect to."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(64)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def close(self):
+        """Close every connection and remove the socket file."""
+        for conn in list(self.buffers):
+            self._drop(conn)
+        if self.listener is not None:
+            self.selector.unregister(self.listener)
+            self.listener.close()
+            self.listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def close_inherited(self):
+        """Release the broker's sockets in a freshly forked worker."""
+        for conn in list(self.buffers):
+            conn.close()
+        if self.listener is not None:
+            self.listener.close()
+        self.selector.close()
+
+    def poll(self, timeout):
+        """Handle broker traffic for up to `timeout` seconds."""
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                try:
+                    conn, _ = self.listener.accept()
+                except OSError:
+                    continue
+                conn.settimeout(REQUEST_TIMEOUT)
+                self.buffers[conn] = bytearray()
+                self.owned[conn] = set()
+                self.selector.register(conn, selectors.EVENT_READ)
+            else:
+                self._read(key.fileobj)
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(conn)
+            return
+        buffer = self.buffers[conn]
+        buffer += data
+        while True:
+            end = buffer.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(buffer[:end])
+            del buffer[:end + 1]
+            try:
+                self._handle(conn, json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                # Malformed JSON or a message of the wrong shape: skip the line
+                eventlog.warning("Bad broker message", rate_key='broker_bad_message', error=e)
+
+    def _handle(self, conn, message):
+        op = message['op']
+        if op == 'claim':
+            user = message['user']
+            ok = user not in self.users
+            if ok:
+                self.users[user] = (conn, tuple(message.get('addr') or ()))
+                self.owned[conn].add(user)
+            self._send(conn, {'id': message['id'], 'ok': ok})
+        elif op == 'release':
+            user = message['user']
+            owner = self.users.get(user)
+            if owner is not None and owner[0] is conn:
+                del self.users[user]
+                self.owned[conn].discard(user)
+        elif op == 'users':
+            listing = [[user, list(addr)] for user, (_, addr) in self.users.items()]
+            self._send(conn, {'id': message['id'], 'users': listing})
+        elif op == 'publish':
+            relay = {'op': 'deliver', 'data': message['data'], 'channel': message.get('channel')}
+            for other in list(self.buffers):
+                if other is not conn:
+                    self._send(other, relay)
+
+    def _send(self, conn, message):
+        try:
+            conn.sendall(json.dumps(message).encode() + b'\n')
+        except OSError:
+            self._drop(conn)
+
+    def _drop(self, conn):
+        """Forget a worker connection and every user it had claimed."""
+        if conn not in self.buffers:
+            return
+        self.selector.unregister(conn)
+        del self.buffers[conn]
+        for user in self.owned.pop(conn, ()):
+            self.users.pop(user, None)
+        conn.close()
+
+
+class BrokerClient:
+    """A worker's connection to the supervisor's Broker.
+
+    on_deliver(data, channel) is called from the reader thread with every
+    broadcast or channel message published by another worker. Requests return None when the broker cannot
+    be reached so callers can fall back to purely local state.
+    """
+
+    def __init__(self, path, on_deliver):
+        self.path = path
+        self.on_deliver = on_deliver
+        self.sock = None
+        self.ids = itertools.count(1)
+        self.pending = {}  # request id -> [threading.Event, reply]
+        self.send_lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        reader = threading.Thread(target=self._read_loop)
+        reader.daemon = True
+        reader.start()
+
+    def _read_loop(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                eventlog.error("Lost connection to the session broker")
+                for waiter in list(self.pending.values()):
+                    waiter[0].set()
+                self.sock = None
+                return
+            buffer += data
+            while True:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buffer[:end])
+                del buffer[:end + 1]
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as e:
+                    # Skip the line rather than lose the connection to the broker
+                    eventlog.warning("Bad message from the session broker", rate_key='broker_bad_message',
+                                     error=e)
+                    continue
+                if message.get('op') == 'deliver':
+                    self.on_deliver(message['data'].encode('latin-1'), message.get('channel'))
+                else:
+                    waiter = self.pending.get(message.get('id'))
+                    if waiter is not None:
+                        waiter[1] = message
+                        waiter[0].set()
+
+    def _send(self, message):
+        if self.sock is None:
+            return False
+        try:
+            with self.send_lock:
+                self.sock.sendall(json.dumps(message).encode() + b'\n')
+            return True
+        except OSError:
+            return False
+
+    def _request(self, message):
+        message['id'] = request_id = next(self.ids)
+        waiter = self.pending[request_id] = [threading.Event(), None]
+        try:
+            if not self._send(message) or not waiter[0].wait(REQUEST_TIMEOUT):
+                return None
+            return waiter[1]
+        finally:
+            del self.pending[request_id]
+
+    def claim(self, username, addr):
+        """Claim a username cluster-wide; None if the broker is unreachable."""
+        reply = self._request({'op': 'claim', 'user': username, 'addr': list(addr)})
+        return None if reply is None else reply['ok']
+
+    def release(self, username):
+        self._send({'op': 'release', 'user': username})
+
+    def users(self):
+        """[(username, (ip, port)), ...] across all workers, or None."""
+        reply = self._request({'op': 'users'})
+        if reply is None:
+            return None
+        return [(user, tuple(addr)) for user, addr in reply['users']]
+
+    def publish(self, data, channel=None):
+        """Relay an encoded broadcast (or channel message) to the other workers."""
+        self._send({'op': 'publish', 'data': data.decode('latin-1'), 'channel': channel})
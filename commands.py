@@ -0,0 +1,197 @@
+"""Command registry for the Telnet server.
+
+Commands are looked up by verb in a dict, so dispatch costs the same no
+matter how many commands exist. A handler receives the session state and
+its arguments and returns the reply text (or None for no reply):
+
+    from commands import command
+
+    @command('ping', help="Reply with pong")
+    def ping(session, args):
+        return "pong\n"
+
+`session` is the connection's sessions.Session (.addr, .username, ...).
+By default `args` is the list of whitespace/quote separated arguments;
+pass raw=True to receive the unparsed argument text instead. Commands
+registered with admin=True are refused to users who are not administrators.
+Replies that do not depend on the session can be reused: cache=SECONDS
+keeps the encoded reply for that long (cache=CACHE_FOREVER until the
+command table changes) in the registry's ResponseCache. Replies are keyed
+on the command and its parsed arguments; cache_key=function(args) narrows
+that to what the reply actually depends on, so arbitrary arguments cannot
+fill the cache with copies of one reply.
+Modules defining extra commands are loaded with
+`python3 server.py --command-module <module>`.
+"""
+
+import collections
+import importlib
+import shlex
+import threading
+import time
+
+CACHE_SIZE = 256               # Replies kept in the response cache
+CACHE_FOREVER = float('inf')   # cache= value for replies that never change
+
+
+class CommandError(Exception):
+    """Raised by a handler (or the parser) to reply with an error message."""
+
+
+class Command:
+    """One registered command and how to parse its arguments."""
+
+    __slots__ = ('name', 'handler', 'help', 'usage', 'aliases',
+                 'min_args', 'max_args', 'raw', 'disconnect', 'admin', 'cache', 'cache_key')
+
+    def __init__(self, name, handler, help='', usage=None, aliases=(),
+                 min_args=0, max_args=None, raw=False, disconnect=False, admin=False, cache=None,
+                 cache_key=None):
+        self.name = name
+        self.handler = handler
+        self.help = help
+        self.usage = usage or name
+        self.aliases = tuple(aliases)
+        self.min_args = min_args
+        self.max_args = max_args
+        self.raw = raw
+        self.disconnect = disconnect  # Close the session after replying
+        self.admin = admin  # Only administrators may run it
+        self.cache = cache  # Seconds the reply may be reused for any session (None: never)
+        self.cache_key = cache_key  # args -> argument part of the cache key (may raise CommandError)
+
+    def parse(self, text):
+        """Turn the text after the verb into handler arguments."""
+        if self.raw:
+            return text
+        try:
+            args = shlex.split(text)
+        except ValueError as e:
+            raise CommandError(f"Invalid arguments: {e}")
+        if len(args) < self.min_args or (self.max_args is not None and len(args) > self.max_args):
+            raise CommandError(f"Usage: {self.usage}")
+        return args
+
+    def run(self, session, text):
+        """Parse the arguments and run the handler, returning its reply."""
+        return self.handler(session, self.parse(text))
+
+    def key(self, args):
+        """Response cache key for parsed args."""
+        if self.cache_key is not None:
+            return self.name, self.cache_key(args)
+        return self.name, args if self.raw else tuple(args)
+
+
+class ResponseCache:
+    """Encoded command replies with a time to live, least recently used evicted first."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()  # key -> (expiry time, data)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The cached reply for key, or None if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, data, ttl):
+        """Keep data for ttl seconds, evicting the least recently used replies."""
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CommandRegistry:
+    """Verb -> Command table, including aliases."""
+
+    def __init__(self):
+        self.commands = {}
+        self.order = []  # Primary commands in registration order, for help
+        self.cache = ResponseCache()
+
+    def register(self, name, handler, **options):
+        """Register handler under name (and its aliases); returns the Command."""
+        spec = Command(name.lower(), handler, **options)
+        for verb in (spec.name,) + spec.aliases:
+            if verb.lower() in self.commands:
+                raise ValueError(f"Command '{verb}' is already registered")
+        self.order.append(spec)
+        for verb in (spec.name,) + spec.aliases:
+            self.commands[verb.lower()] = spec
+        self.cache.clear()  # Cached help text lists the commands
+        return spec
+
+    def command(self, name, **options):
+        """Decorator form of register()."""
+        def decorator(handler):
+            self.register(name, handler, **options)
+            return handler
+        return decorator
+
+    def lookup(self, verb):
+        """Return the Command for a verb, or None."""
+        return self.commands.get(verb.lower())
+
+    def split(self, line):
+        """Split a command line into its Command (or None), verb and argument text."""
+        verb, _, text = line.strip().partition(' ')
+        return self.commands.get(verb.lower()), verb, text.strip()
+
+    def help_topic(self, topic):
+        """Command name a help topic refers to ('' for the full listing)."""
+        if not topic:
+            return ''
+        spec = self.lookup(topic)
+        if spec is None:
+            raise CommandError(f"No help for unknown command: {topic}")
+        return spec.name
+
+    def help_text(self, topic=None):
+        """Build the help listing from the registered commands, or one command's help."""
+        if topic:
+            spec = self.commands[self.help_topic(topic)]
+            text = f"{spec.usage} - {spec.help}\n"
+            if spec.aliases:
+                text += f"Aliases: {', '.join(spec.aliases)}\n"
+            return text
+        entries = []
+        for spec in self.order:
+            entries.append((spec.usage, spec.help))
+            for alias in spec.aliases:
+                entries.append((alias, f"Same as {spec.name}"))
+        width = max((len(usage) for usage, _ in entries), default=0)
+        lines = ["", "Available commands:"]
+        lines.extend(f"  {usage:<{width}} - {text}" for usage, text in entries)
+        return "\n".join(lines) + "\n"
+
+
+# Registry used by the server
+registry = CommandRegistry()
+command = registry.command
+register_command = registry.register
+
+
+def load_command_modules(names):
+    """Import modules that register extra commands."""
+    for name in names:
+        importlib.import_module(name)
@@ -0,0 +1,316 @@
+"""Hashed credential storage and throttled password verification.
+
+Passwords are stored as salted scrypt hashes (PBKDF2-SHA256 where the
+interpreter's OpenSSL lacks scrypt) in one of:
+
+    MemoryCredentialStore   built at startup from a {username: password} dict
+    FileCredentialStore     text file, one 'username:hash' line per user
+    SQLiteCredentialStore   SQLite table keyed (and indexed) by username
+
+Verification runs in a small bounded thread pool (Authenticator), so a
+burst of logins cannot take over the threads or event loop serving session
+I/O. Recent successful verifications are cached for reconnect storms, and
+repeated failures are throttled per client IP and per username.
+
+Manage a store from the command line:
+
+    python3 credentials.py add users.db alice
+    python3 credentials.py remove users.db alice
+"""
+
+import base64
+import collections
+import concurrent.futures
+import getpass
+import hashlib
+import hmac
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Hash parameters
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 200000
+SALT_BYTES = 16
+
+# Verification limits
+AUTH_WORKERS = 2            # Threads hashing passwords
+MAX_PENDING_AUTH = 64       # Verifications queued before new ones are refused
+CACHE_TTL = 30.0            # Seconds a successful verification is remembered
+CACHE_SIZE = 4096           # Cached verifications kept at most
+FAILURE_WINDOW = 60.0       # Seconds over which failures are counted
+MAX_FAILURES_PER_IP = 10    # Failed attempts allowed per client IP per window
+MAX_FAILURES_PER_USER = 5   # Failed attempts allowed per username per window
+
+# Verification results
+AUTH_OK = 'ok'
+AUTH_FAILED = 'failed'
+AUTH_THROTTLED = 'throttled'   # The IP or username failed too often
+AUTH_BUSY = 'busy'             # Too many verifications already queued
+AUTH_ERROR = 'error'           # Verification raised (store error, pool shut down)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password, salt=None):
+    """Return a self-describing salted hash string for password."""
+    salt = salt or os.urandom(SALT_BYTES)
+    secret = password.encode('utf-8')
+    if hasattr(hashlib, 'scrypt'):
+        digest = hashlib.scrypt(secret, salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    digest = hashlib.pbkdf2_hmac('sha256', secret, salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+
+def check_password(password, stored):
+    """Constant-time check of password against a hash_password() string."""
+    parts = stored.split('$')
+    secret = password.encode('utf-8')
+    try:
+        if parts[0] == 'scrypt':
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+            digest = hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, dklen=len(expected))
+        elif parts[0] == 'pbkdf2_sha256':
+            iterations = int(parts[1])
+            salt, expected = base64.b64decode(parts[2]), base64.b64decode(parts[3])
+            digest = hashlib.pbkdf2_hmac('sha256', secret, salt, iterations, len(expected))
+        else:
+            return False
+    except (IndexError, ValueError):
+        return False
+    return hmac.compare_digest(digest, expected)
+
+
+class MemoryCredentialStore:
+    """Credentials held in a dict; plaintext passwords are hashed on load."""
+
+    def __init__(self, passwords=None):
+        self.hashes = {}
+        for username, password in (passwords or {}).items():
+            self.set_password(username, password)
+
+    def get(self, username):
+        """Stored hash for username, or None."""
+        return self.hashes.get(username)
+
+    def set_password(self, username, password):
+        self.hashes[username] = hash_password(password)
+
+    def remove(self, username):
+        self.hashes.pop(username, None)
+
+
+class FileCredentialStore(MemoryCredentialStore):
+    """Credentials in a text file of 'username:hash' lines, indexed in memory."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        username, _, stored = line.partition(':')
+                        self.hashes[username] = stored
+
+    def _save(self):
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            for username, stored in sorted(self.hashes.items()):
+                f.write(f"{username}:{stored}\n")
+        os.replace(temp, self.path)
+
+    def set_password(self, username, password):
+        super().set_password(username, password)
+        self._save()
+
+    def remove(self, username):
+        super().remove(username)
+        self._save()
+
+
+class SQLiteCredentialStore:
+    """Credentials in an SQLite table whose primary key indexes usernames."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS credentials ("
+                            "username TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+
+    def get(self, username):
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM credentials WHERE username = ?",
+                                  (username,)).fetchone()
+        return row[0] if row else None
+
+    def set_password(self, username, password):
+        stored = hash_password(password)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO credentials (username, hash) VALUES (?, ?)",
+                            (username, stored))
+
+    def remove(self, username):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM credentials WHERE username = ?", (username,))
+
+
+def open_store(path):
+    """Open a credential store, picking SQLite for .db/.sqlite files."""
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteCredentialStore(path)
+    return FileCredentialStore(path)
+
+
+class FailureCounter:
+    """Fixed-window failure counts per key (client IP or username)."""
+
+    def __init__(self, limit, window=FAILURE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.counts = {}  # key -> [window start, failures]
+
+    def blocked(self, key, now):
+        entry = self.counts.get(key)
+        return entry is not None and now - entry[0] < self.window and entry[1] >= self.limit
+
+    def record(self, key, now):
+        entry = self.counts.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            if len(self.counts) > 10000:
+                self.counts = {k: v for k, v in self.counts.items() if now - v[0] < self.window}
+            self.counts[key] = [now, 1]
+        else:
+            entry[1] += 1
+
+    def clear(self, key):
+        self.counts.pop(key, None)
+
+
+class Authenticator:
+    """Verifies passwords off the serving threads, with caching and throttling.
+
+    submit() returns a concurrent.futures.Future resolving to AUTH_OK,
+    AUTH_FAILED, AUTH_THROTTLED or AUTH_BUSY. Attempts are refused without
+    hashing when the IP or username has failed too often recently
+    (AUTH_THROTTLED) or when more than MAX_PENDING_AUTH verifications are
+    already queued (AUTH_BUSY), so the hashing cost of a login storm is
+    capped by the pool size. `stats` counts outcomes.
+    """
+
+    def __init__(self, store, workers=AUTH_WORKERS, max_pending=MAX_PENDING_AUTH):
+        self.store = store
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                          thread_name_prefix='auth')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.cache = collections.OrderedDict()  # (username, password digest) -> expiry
+        self.cache_key = os.urandom(16)
+        self.ip_failures = FailureCounter(MAX_FAILURES_PER_IP)
+        self.user_failures = FailureCounter(MAX_FAILURES_PER_USER)
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def _digest(self, username, password):
+        message = f"{username}\0{password}".encode('utf-8')
+        return hmac.new(self.cache_key, message, hashlib.sha256).digest()
+
+    def submit(self, username, password, ip=None):
+        """Start verifying a login attempt; returns a Future with the result."""
+        now = time.monotonic()
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.stats['attempts'] += 1
+            if (ip is not None and self.ip_failures.blocked(ip, now)) or \
+                    self.user_failures.blocked(username, now):
+                self.stats['throttled'] += 1
+                future.set_result(AUTH_THROTTLED)
+                return future
+            key = (username, self._digest(username, password))
+            expiry = self.cache.get(key)
+            if expiry is not None and expiry > now:
+                self.cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                self.stats['succeeded'] += 1
+                future.set_result(AUTH_OK)
+                return future
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.stats['busy'] += 1
+            future.set_result(AUTH_BUSY)
+            return future
+        return self.pool.submit(self._verify, username, password, ip, key)
+
+    def verify(self, username, password, ip=None):
+        """Blocking form of submit() for callers on their own thread."""
+        return self.submit(username, password, ip).result()
+
+    def _verify(self, username, password, ip, key):
+        with self.lock:
+            # Failures recorded while this attempt was queued may block it now
+            now = time.monotonic()
+            if (ip is not None and self.ip_failures.blocked(ip, now)) or \
+                    self.user_failures.blocked(username, now):
+                self.slots.release()
+                self.stats['throttled'] += 1
+                return AUTH_THROTTLED
+        try:
+            stored = self.store.get(username)
+            ok = check_password(password, stored) if stored else False
+            if not stored:
+                hash_password(password)  # Same cost for unknown users
+        finally:
+            self.slots.release()
+        now = time.monotonic()
+        with self.lock:
+            self.stats['verified'] += 1
+            if ok:
+                self.stats['succeeded'] += 1
+                self.cache[key] = now + CACHE_TTL
+                self.cache.move_to_end(key)
+                while len(self.cache) > CACHE_SIZE:
+                    self.cache.popitem(last=False)
+                self.user_failures.clear(username)
+                return AUTH_OK
+            self.stats['failed'] += 1
+            if ip is not None:
+                self.ip_failures.record(ip, now)
+            self.user_failures.record(username, now)
+            return AUTH_FAILED
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    """Add or remove users in a credential store file."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 3 or argv[0] not in ('add', 'remove'):
+        print("usage: python3 credentials.py add|remove <store path> <username>")
+        return 2
+    action, path, username = argv
+    store = open_store(path)
+    if action == 'add':
+        password = getpass.getpass(f"Password for {username}: ")
+        if password != getpass.getpass("Repeat password: "):
+            print("Passwords do not match")
+            return 1
+        store.set_password(username, password)
+        print(f"Stored credentials for {username}")
+    else:
+        store.remove(username)
+        print(f"Removed {username}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Non-blocking structured logging for the Telnet server.
+
+Records carry structured fields (addr, username, command, bytes, ...) and
+are handed to a bounded in-memory queue; a background listener thread does
+the formatting and the terminal/file I/O. When the queue is full records
+are dropped and counted instead of stalling the caller, and high-volume
+events can be rate limited per key:
+
+    eventlog.info("Connection opened", addr=addr, rate_key='connect')
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger('telnet')
+logger.addHandler(logging.NullHandler())
+
+LOG_QUEUE_SIZE = 10000   # Records buffered for the writer thread
+RATE_LIMIT = 20          # Records per second allowed for each rate_key
+RATE_BURST = 50          # Records a rate_key may emit in a burst
+
+# Log the content of messages and commands, not just their size (off by default)
+log_messages = False
+
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Append the record's structured fields as key=value pairs."""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={_format_value(value)}" for key, value in fields.items())
+        return text
+
+
+def _format_value(value):
+    if isinstance(value, tuple) and len(value) == 2:
+        return f"{value[0]}:{value[1]}"  # Socket address
+    text = str(value)
+    return repr(text) if (' ' in text or not text) else text
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per rate_key; suppressed records are counted and reported."""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # rate_key -> [tokens, last refill, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'rate_key', None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.fields = dict(record.fields or {}, suppressed=suppressed)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue is in-process, so the record does not need to be
+        # formatted or made picklable here; the writer thread formats it.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(level='INFO', log_file=None):
+    """Route the server's logger through a background writer thread."""
+    global _listener
+    stop()
+    if log_file:
+        target = logging.FileHandler(log_file)
+    else:
+        target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(StructuredFormatter('%(asctime)s %(levelname)s %(message)s'))
+
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(handler.queue, target)
+    _listener.start()
+
+
+def stop():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
+
+
+def dropped():
+    """Number of records dropped because the queue was full."""
+    return sum(getattr(handler, 'dropped', 0) for handler in logger.handlers)
+
+
+def _log(level, message, rate_key, fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': fields, 'rate_key': rate_key})
+
+
+def debug(message, rate_key=None, **fields):
+    _log(logging.DEBUG, message, rate_key, fields)
+
+
+def info(message, rate_key=None, **fields):
+    _log(logging.INFO, message, rate_key, fields)
+
+
+def warning(message, rate_key=None, **fields):
+    _log(logging.WARNING, message, rate_key, fields)
+
+
+def error(message, rate_key=None, **fields):
+    _log(logging.ERROR, message, rate_key, fields)
+
+
+def enabled(level=logging.DEBUG):
+    """Cheap check before building expensive log fields."""
+    return logger.isEnabledFor(level)
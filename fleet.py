@@ -0,0 +1,317 @@
+"""Run commands on many Telnet endpoints at once.
+
+Sessions are client.BatchSession objects, so negotiation, login and
+pipelined command runs behave exactly as in `client.py --batch`. A
+SessionPool keeps logged-in sessions per endpoint between jobs, so
+repeated fan-outs pay for connecting, negotiating and logging in only
+once per endpoint:
+
+    from fleet import Fleet
+
+    with Fleet('admin', 'secret', concurrency=64) as fleet:
+        results = fleet.run(['10.0.0.5', '10.0.0.6:2424'], ['uptime', 'users'])
+        for endpoint, replies in results.items():
+            ...
+
+or from the command line:
+
+    python3 fleet.py -H 10.0.0.5 -H 10.0.0.6:2424 --user admin -c uptime -c users
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import getpass
+import json
+import os
+import sys
+import threading
+import time
+
+import client
+
+CONCURRENCY = 32        # Endpoints worked on at the same time
+PER_ENDPOINT = 1        # Sessions kept per endpoint (a user may only log in once per server)
+IDLE_TIMEOUT = 60.0     # Seconds an unused session is kept before it is closed
+PROBE_AFTER = 15.0      # Idle seconds after which a session is probed before reuse
+
+
+def parse_endpoint(text, default_port=client.PORT):
+    """'host', 'host:port' or '[v6addr]:port' -> (host, port)."""
+    text = text.strip()
+    if text.startswith('['):
+        host, _, rest = text[1:].partition(']')
+        return host, int(rest[1:]) if rest.startswith(':') else default_port
+    if text.count(':') == 1:
+        host, port = text.split(':')
+        return host, int(port)
+    return text, default_port
+
+
+class SessionPool:
+    """Logged-in sessions per endpoint, reused across jobs.
+
+    acquire() hands out an idle session that passes a health check, or
+    connects and logs in a new one while the endpoint has fewer than
+    `per_endpoint` sessions; otherwise it waits for one to be released.
+    Sessions idle longer than `idle_timeout` are closed by evict_idle().
+    `stats` counts connects, reuses, failed health checks and evictions.
+    """
+
+    def __init__(self, username, password, per_endpoint=PER_ENDPOINT, idle_timeout=IDLE_TIMEOUT,
+                 probe_after=PROBE_AFTER, timeout=client.TIMEOUT, prompt=client.PROMPT):
+        self.username = username
+        self.password = password
+        self.per_endpoint = per_endpoint
+        self.idle_timeout = idle_timeout
+        self.probe_after = probe_after
+        self.timeout = timeout
+        self.prompt = prompt
+        self.idle = collections.defaultdict(list)  # endpoint -> [(session, released at)]
+        self.open = collections.Counter()          # endpoint -> sessions open (idle or in use)
+        self.cond = threading.Condition()
+        self.stats = collections.Counter()
+
+    def acquire(self, endpoint):
+        """A healthy logged-in session for endpoint (host, port)."""
+        while True:
+            with self.cond:
+                while not self.idle[endpoint] and self.open[endpoint] >= self.per_endpoint:
+                    self.cond.wait()
+                if self.idle[endpoint]:
+                    session, released = self.idle[endpoint].pop()
+                else:
+                    session, released = None, None
+                    self.open[endpoint] += 1
+            if session is None:
+                return self._connect(endpoint)
+            healthy = self._healthy(session, time.monotonic() - released)
+            with self.cond:
+                self.stats['reused' if healthy else 'unhealthy'] += 1
+            if healthy:
+                return session
+            self._discard(endpoint, session)
+
+    def release(self, endpoint, session, healthy=True):
+        """Give a session back; unhealthy ones are closed instead of kept."""
+        if not healthy:
+            self._discard(endpoint, session)
+            return
+        with self.cond:
+            self.idle[endpoint].append((session, time.monotonic()))
+            self.cond.notify()
+
+    def evict_idle(self):
+        """Close every session that has been idle longer than idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        with self.cond:
+            for endpoint, entries in self.idle.items():
+                keep = [entry for entry in entries if entry[1] >= cutoff]
+                expired.extend((endpoint, session) for session, released in entries if released < cutoff)
+                entries[:] = keep
+            self.stats['evicted'] += len(expired)
+        for endpoint, session in expired:
+            self._discard(endpoint, session)
+
+    def close(self):
+        """Close every idle session."""
+        with self.cond:
+            entries = [(endpoint, session) for endpoint, idle in self.idle.items()
+                       for session, _ in idle]
+            self.idle.clear()
+        for endpoint, session in entries:
+            self._discard(endpoint, session)
+
+    def _connect(self, endpoint):
+        session = client.BatchSession(endpoint[0], endpoint[1], self.timeout, self.prompt)
+        try:
+            session.connect()
+            session.login(self.username, self.password)
+        except Exception:
+            self._discard(endpoint, session)
+            raise
+        with self.cond:
+            self.stats['connected'] += 1
+        return session
+
+    def _discard(self, endpoint, session):
+        session.close()
+        with self.cond:
+            self.open[endpoint] -= 1
+            self.cond.notify()
+
+    def _healthy(self, session, idle_for):
+        """Check an idle session before handing it out again.
+
+        Output that arrived while it sat idle (broadcasts, notices) is
+        discarded so it cannot be mistaken for a reply. A session idle for
+        longer than probe_after must also answer an empty line with a prompt.
+        """
+        try:
+            while True:
+                data = session.sock.recv(client.BUFFER_SIZE)
+                if not data:
+                    return False  # Closed by the server (idle timeout, restart)
+                client.process_telnet_command(session.sock, data)
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+        session.received.clear()
+        if idle_for < self.probe_after:
+            return True
+        try:
+            return len(session.run([''])) == 1
+        except (OSError, TimeoutError, client.ReplyMismatchError):
+            return False
+
+
+class Fleet:
+    """Runs command lists on many endpoints concurrently over a SessionPool."""
+
+    def __init__(self, username, password, concurrency=CONCURRENCY, **pool_options):
+        self.pool = SessionPool(username, password, **pool_options)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                              thread_name_prefix='fleet')
+
+    def run_one(self, endpoint, commands, marker=None):
+        """Run commands on one endpoint; returns a list of reply texts."""
+        if isinstance(endpoint, str):
+            endpoint = parse_endpoint(endpoint)
+        session = self.pool.acquire(endpoint)
+        healthy = False
+        try:
+            replies = session.run(commands, marker)
+            healthy = len(replies) == len(commands)
+        finally:
+            self.pool.release(endpoint, session, healthy)
+        return [client.decode_reply(reply) for reply in replies]
+
+    def submit(self, endpoint, commands, marker=None):
+        """Start run_one() on the worker threads; returns a Future."""
+        return self.executor.submit(self.run_one, endpoint, commands, marker)
+
+    def run(self, endpoints, commands, marker=None):
+        """Run the same commands on every endpoint.
+
+        Returns {endpoint: [reply, ...] or the exception that stopped it}.
+        """
+        self.pool.evict_idle()
+        futures = {endpoint: self.submit(endpoint, commands, marker) for endpoint in endpoints}
+        results = {}
+        for endpoint, future in futures.items():
+            try:
+                results[endpoint] = future.result()
+            except Exception as e:
+                results[endpoint] = e
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_endpoints(args):
+    endpoints = list(args.host or [])
+    if args.hosts_file:
+        with open(args.hosts_file, 'r') as f:
+            endpoints += [line.strip() for line in f
+                          if line.strip() and not line.lstrip().startswith('#')]
+    return endpoints
+
+
+def print_results(results, commands, output_format, out=sys.stdout):
+    for endpoint, replies in results.items():
+        if output_format == 'json':
+            if isinstance(replies, Exception):
+                out.write(json.dumps({'endpoint': endpoint, 'error': str(replies) or type(replies).__name__}) + "\n")
+                continue
+            for index, command in enumerate(commands):
+                output = replies[index] if index < len(replies) else None
+                out.write(json.dumps({'endpoint': endpoint, 'index': index,
+                                      'command': command, 'output': output}) + "\n")
+        else:
+            out.write(f"== {endpoint} ==\n")
+            if isinstance(replies, Exception):
+                out.write(f"error: {replies or type(replies).__name__}\n")
+                continue
+            for index, command in enumerate(commands):
+                output = replies[index] if index < len(replies) else "(no reply)"
+                out.write(f"{client.PROMPT}{command}\n")
+                out.write(output if output.endswith("\n") else output + "\n")
+    out.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run Telnet commands on many endpoints at once")
+    parser.add_argument('-H', '--host', action='append', metavar='HOST[:PORT]',
+                        help="endpoint to run on (repeatable)")
+    parser.add_argument('--hosts-file', metavar='PATH', help="file with one HOST[:PORT] per line")
+    parser.add_argument('-c', '--command', action='append', help="command to run (repeatable)")
+    parser.add_argument('--batch', metavar='FILE', help="also run the commands in FILE ('-' for stdin)")
+    parser.add_argument('--user', default=os.environ.get('TELNET_USER', 'guest'))
+    parser.add_argument('--password', default=None,
+                        help="password (default $TELNET_PASSWORD, otherwise asked for)")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help="endpoints worked on at the same time (default %(default)s)")
+    parser.add_argument('--per-endpoint', type=int, default=PER_ENDPOINT,
+                        help="sessions kept open per endpoint (default %(default)s)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="seconds an unused session is kept open (default %(default)s)")
+    parser.add_argument('--timeout', type=float, default=client.TIMEOUT,
+                        help="seconds to wait for an endpoint (default %(default)s)")
+    parser.add_argument('--split', choices=('prompt', 'marker'), default='prompt')
+    parser.add_argument('--format', choices=('text', 'json'), default='text')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="run the commands this many times, reusing the sessions")
+    parser.add_argument('--interval', type=float, default=0.0, help="seconds between repeats")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = read_endpoints(args)
+    commands = list(args.command or [])
+    if args.batch:
+        commands += client.read_batch(args.batch)
+    if not endpoints or not commands:
+        print("Nothing to do: give endpoints with -H/--hosts-file and commands with -c/--batch",
+              file=sys.stderr)
+        return 2
+    password = args.password
+    if password is None:
+        password = os.environ.get('TELNET_PASSWORD') or getpass.getpass(f"Password for {args.user}: ")
+    marker = f"--batch-{os.urandom(4).hex()}--" if args.split == 'marker' else None
+
+    total_failed = 0  # Endpoint runs that failed, over every round
+    with Fleet(args.user, password, concurrency=args.concurrency, per_endpoint=args.per_endpoint,
+               idle_timeout=args.idle_timeout, timeout=args.timeout) as fleet:
+        for round_number in range(args.repeat):
+            if round_number and args.interval:
+                time.sleep(args.interval)
+            started = time.perf_counter()
+            results = fleet.run(endpoints, commands, marker)
+            elapsed = time.perf_counter() - started
+            print_results(results, commands, args.format)
+            failed = sum(isinstance(replies, Exception) for replies in results.values())
+            total_failed += failed
+            stats = fleet.pool.stats
+            print(f"{len(endpoints) - failed}/{len(endpoints)} endpoints in {elapsed:.3f}s "
+                  f"(connected {stats['connected']}, reused {stats['reused']}, "
+                  f"unhealthy {stats['unhealthy']}, evicted {stats['evicted']})", file=sys.stderr)
+    if args.repeat > 1:
+        runs = len(endpoints) * args.repeat
+        print(f"{runs - total_failed}/{runs} endpoint runs succeeded over {args.repeat} rounds",
+              file=sys.stderr)
+    return 1 if total_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Zero-downtime restarts: pass the listening socket to a new server process.
+
+The running server listens on a private unix socket, starts its successor
+with `--takeover PATH` and sends it the listening socket's descriptor
+(SCM_RIGHTS). The successor serves on that same kernel socket instead of
+binding its own, so connections that arrive during the switch wait in the
+shared backlog rather than being refused. Once it is accepting it writes
+READY, and only then does the old server stop accepting:
+
+    successor = handoff.hand_off(listener.fileno(), argv)     # old server
+    listener, channel = handoff.take_over(path)               # new server
+    ...
+    handoff.announce_ready(channel)
+"""
+
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+HANDOFF_TIMEOUT = 30.0   # Seconds the successor has to start accepting
+READY = b'ready\n'
+
+
+class HandoffError(Exception):
+    """The successor could not be started or did not take the socket over."""
+
+
+def successor_argv(argv, path):
+    """argv with any earlier --takeover replaced by one for path."""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--takeover':
+            skip = True
+        elif not arg.startswith('--takeover='):
+            args.append(arg)
+    return args + ['--takeover', path]
+
+
+def hand_off(listener_fd, argv, timeout=HANDOFF_TIMEOUT):
+    """Start argv as the successor and pass it listener_fd.
+
+    Returns the successor's Popen once it reports it is accepting. Raises
+    HandoffError, after killing the successor, if it exits early or is
+    not ready within timeout; the caller still owns the socket either way.
+    """
+    path = os.path.join(tempfile.gettempdir(), f"pytelnet-handoff-{os.getpid()}.sock")
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    deadline = time.monotonic() + timeout
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    successor = None
+    try:
+        channel.bind(path)
+        os.chmod(path, 0o600)
+        channel.listen(1)
+        channel.settimeout(0.5)
+        successor = subprocess.Popen(successor_argv(argv, path))
+        while True:
+            try:
+                conn, _ = channel.accept()
+                break
+            except socket.timeout:
+                if successor.poll() is not None:
+                    raise HandoffError(f"new server exited with status {successor.returncode}")
+                if time.monotonic() > deadline:
+                    raise HandoffError("new server did not connect in time")
+        with conn:
+            conn.settimeout(max(deadline - time.monotonic(), 0.1))
+            socket.send_fds(conn, [b'L'], [listener_fd])
+            reply = b''
+            while not reply.endswith(b'\n'):
+                chunk = conn.recv(64)
+                if not chunk:
+                    break
+                reply += chunk
+        if reply != READY:
+            raise HandoffError("new server closed the handoff before it was accepting")
+        return successor
+    except (OSError, HandoffError) as e:
+        if successor is not None and successor.poll() is None:
+            successor.kill()
+            successor.wait()
+        if isinstance(e, HandoffError):
+            raise
+        raise HandoffError(str(e) or "timed out") from e
+    finally:
+        channel.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def take_over(path):
+    """Receive the listening socket from the server at path.
+
+    Returns (listening socket, channel); pass the channel to
+    announce_ready() once the socket is being accepted from.
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        channel.connect(path)
+        _, fds, _, _ = socket.recv_fds(channel, 16, 1)
+    except OSError as e:
+        channel.close()
+        raise HandoffError(f"could not take over the listening socket: {e}") from e
+    if not fds:
+        channel.close()
+        raise HandoffError("no listening socket was passed")
+    return socket.socket(fileno=fds[0]), channel
+
+
+def announce_ready(channel):
+    """Tell the old server we are accepting; it stops accepting and drains."""
+    try:
+        channel.sendall(READY)
+    except OSError:
+        pass  # The old server gave up on us; we keep serving regardless
+    channel.close()
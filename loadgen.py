@@ -0,0 +1,420 @@
+"""Headless load generator and latency benchmark for server.py.
+
+Opens many concurrent sessions from one asyncio event loop, answers the
+server's option negotiation with the same handlers client.py uses, logs
+every session in and runs a weighted mix of commands, timing each one from
+the moment it is sent until the next prompt arrives. Results are printed
+as one JSON document so runs of different engines can be compared:
+
+    python3 loadgen.py --spawn --server-args "--engine threaded" > threaded.json
+    python3 loadgen.py --spawn --server-args "--engine asyncio" > asyncio.json
+
+Every session needs its own account because a user can only be logged in
+once. --user is a template formatted with the session number ('load{}' by
+default); with --spawn a temporary credential file holding those accounts
+is created for the server automatically. For a server started by hand,
+write one with --write-credentials and pass it to `server.py --credentials`.
+
+All sessions connect from one IP, so a spawned server runs with admission
+control off (--max-sessions 0 --max-sessions-per-ip 0 --connect-rate 0).
+Start a server by hand with the same flags to go past its per-IP limits;
+--server-args can turn them back on.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import client
+from credentials import hash_password
+from protocol import CR, LF, TelnetParser
+
+# Defaults
+HOST = 'localhost'
+PORT = 2323
+SESSIONS = 10
+COMMANDS = 100          # Commands run by each session
+TIMEOUT = 10.0          # Seconds to wait for any one prompt
+USER = 'load{}'
+PASSWORD = 'load'
+LOGIN_PROMPT = 'login: '
+PASSWORD_PROMPT = 'Password: '
+PROMPT = '> '
+RSS_INTERVAL = 0.5      # Seconds between server memory samples
+
+# Default command mix: command line -> relative weight
+DEFAULT_MIX = {
+    'help': 1,
+    'echo load test': 4,
+    'users': 1,
+    'say load test': 1,
+}
+
+
+class LoadSession(asyncio.Protocol):
+    """One headless Telnet session.
+
+    It exposes send() so client.handle_negotiation and
+    client.handle_subnegotiation can answer the server exactly as the
+    interactive client does, opening with the same option burst. Text
+    with the Telnet commands filtered out collects in `received` until
+    expect() finds the token it waits for. `negotiated` is the time the
+    server had answered every option we offered.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.parser = TelnetParser(
+            on_negotiate=functools.partial(client.handle_negotiation, self),
+            on_subnegotiation=functools.partial(client.handle_subnegotiation, self),
+            decompress=True)
+        self.received = bytearray()
+        self.waiting = None  # (token, future) while expect() is pending
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.negotiated = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        client.start_negotiation(self)
+
+    def data_received(self, data):
+        self.bytes_in += len(data)
+        text = self.parser.feed(data)
+        client.flush_replies(self)
+        if self.negotiated is None and not client.option_table(self).pending():
+            self.negotiated = time.perf_counter()
+        if not text:
+            return
+        self.received += text
+        if self.waiting is not None:
+            token, future = self.waiting
+            end = self.received.find(token)
+            if end >= 0 and not future.done():
+                del self.received[:end + len(token)]
+                self.waiting = None
+                future.set_result(None)
+
+    def connection_lost(self, exc):
+        if self.waiting is not None and not self.waiting[1].done():
+            self.waiting[1].set_exception(ConnectionResetError("connection closed by server"))
+
+    def send(self, data):
+        self.bytes_out += len(data)
+        self.transport.write(data)
+
+    def send_line(self, line):
+        self.send(line.encode() + bytes([CR, LF]))
+
+    async def expect(self, token, timeout):
+        """Wait until token arrives and discard everything up to its end."""
+        end = self.received.find(token)
+        if end >= 0:
+            del self.received[:end + len(token)]
+            return
+        if self.transport.is_closing():
+            raise ConnectionResetError("connection closed by server")
+        future = asyncio.get_running_loop().create_future()
+        self.waiting = (token, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            self.waiting = None
+
+    def close(self):
+        client.forget_connection(self)
+        if self.transport is not None:
+            self.transport.close()
+
+
+def percentiles(samples):
+    """Summary statistics of a list of durations, in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+        'min': round(ordered[0] * 1000, 3),
+        'p50': rank(50),
+        'p95': rank(95),
+        'p99': rank(99),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+
+def parse_mix(entries):
+    """Turn ['3:echo hi', 'help', ...] into ([command lines], [weights])."""
+    if not entries:
+        return list(DEFAULT_MIX), list(DEFAULT_MIX.values())
+    lines, weights = [], []
+    for entry in entries:
+        weight, sep, line = entry.partition(':')
+        if sep and weight.strip().isdigit():
+            weights.append(int(weight))
+            lines.append(line.strip())
+        else:
+            weights.append(1)
+            lines.append(entry.strip())
+    return lines, weights
+
+
+def process_rss_kb(pid):
+    """Resident memory of a process and all of its descendants, in KiB."""
+    total = 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+                    break
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                for child in f.read().split():
+                    total += process_rss_kb(int(child)) or 0
+    except (OSError, ValueError):
+        return None
+    return total
+
+
+async def sample_rss(pid, samples, stop):
+    """Record the server's memory use until stop is set."""
+    while not stop.is_set():
+        rss = process_rss_kb(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_session(index, args, lines, weights, stats):
+    """Connect, log in and run the command mix for one session."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed + index)
+    if args.ramp:
+        await asyncio.sleep(args.ramp * index / args.sessions)
+    started = time.perf_counter()
+    try:
+        _, session = await asyncio.wait_for(
+            loop.create_connection(LoadSession, args.host, args.port), args.timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        stats['errors'].append(f"connect: {e or 'timed out'}")
+        return
+    stats['connect'].append(time.perf_counter() - started)
+    prompt = args.prompt.encode()
+    try:
+        await session.expect(prompt if args.no_login else args.login_prompt.encode(), args.timeout)
+        stats['first_prompt'].append(time.perf_counter() - started)
+        if not args.no_login:
+            session.send_line(args.user.format(index))
+            await session.expect(args.password_prompt.encode(), args.timeout)
+            session.send_line(args.password)
+            await session.expect(prompt, args.timeout)
+        stats['prompt'].append(time.perf_counter() - started)
+        for line in rng.choices(lines, weights, k=args.commands):
+            sent = time.perf_counter()
+            session.send_line(line)
+            await session.expect(prompt, args.timeout)
+            stats['latency'].append(time.perf_counter() - sent)
+    except asyncio.TimeoutError:
+        stats['errors'].append("timed out waiting for a prompt")
+    except ConnectionError as e:
+        stats['errors'].append(str(e))
+    finally:
+        if session.negotiated is not None:
+            stats['negotiation'].append(session.negotiated - started)
+        stats['stream_bytes_in'] += session.parser.stream_bytes
+        stats['compressed_bytes_in'] += session.parser.wire_bytes
+        stats['bytes_in'] += session.bytes_in
+        stats['bytes_out'] += session.bytes_out
+        session.close()
+
+
+async def run_load(args, server_pid=None):
+    """Run every session concurrently and return the results document."""
+    lines, weights = parse_mix(args.command)
+    stats = {'connect': [], 'first_prompt': [], 'negotiation': [], 'prompt': [], 'latency': [],
+             'errors': [], 'bytes_in': 0, 'bytes_out': 0, 'stream_bytes_in': 0, 'compressed_bytes_in': 0}
+    rss_samples = []
+    stop = asyncio.Event()
+    sampler = None
+    if server_pid is not None:
+        sampler = asyncio.ensure_future(sample_rss(server_pid, rss_samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(run_session(index, args, lines, weights, stats)
+                           for index in range(args.sessions)))
+    elapsed = time.perf_counter() - started
+    if sampler is not None:
+        stop.set()
+        await sampler
+    results = {
+        'label': args.label,
+        'host': args.host,
+        'port': args.port,
+        'sessions': args.sessions,
+        'commands_per_session': args.commands,
+        'mix': dict(zip(lines, weights)),
+        'elapsed': round(elapsed, 3),
+        'connect_ms': percentiles(stats['connect']),
+        'time_to_first_prompt_ms': percentiles(stats['first_prompt']),
+        'negotiation_ms': percentiles(stats['negotiation']),
+        'time_to_prompt_ms': percentiles(stats['prompt']),
+        'latency_ms': percentiles(stats['latency']),
+        'throughput': round(len(stats['latency']) / elapsed, 1) if elapsed else 0.0,
+        'bytes_in': stats['bytes_in'],
+        'bytes_out': stats['bytes_out'],
+        'compression': {
+            'enabled': client.compression,
+            'compressed_bytes': stats['compressed_bytes_in'],
+            'inflated_bytes': stats['stream_bytes_in'],
+        },
+        'errors': len(stats['errors']),
+        'error_samples': sorted(set(stats['errors']))[:10],
+    }
+    if rss_samples:
+        results['server_rss_kb'] = {'start': rss_samples[0], 'peak': max(rss_samples),
+                                    'end': rss_samples[-1]}
+    return results
+
+
+def write_credentials(path, args):
+    """Write a credential file holding the accounts the sessions log in with."""
+    # Every account has the same password, so one (salted) hash serves them all
+    stored = hash_password(args.password)
+    with open(path, 'w') as f:
+        for index in range(args.sessions):
+            f.write(f"{args.user.format(index)}:{stored}\n")
+
+
+def wait_for_port(host, port, timeout):
+    """Block until something accepts connections on host:port."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+
+
+def spawn_server(args, credentials_path):
+    """Start server.py from this directory on args.port with the benchmark's accounts.
+
+    Admission control is off because every session comes from this host;
+    flags in --server-args come later and override that.
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+               '--log-level', 'WARNING', '--port', str(args.port)]
+    # Every session comes from this one IP: admission control would refuse most of them
+    command += ['--max-sessions', '0', '--max-sessions-per-ip', '0', '--connect-rate', '0']
+    if credentials_path:
+        command += ['--credentials', credentials_path]
+    command += shlex.split(args.server_args)
+    # The server logs to stdout; keep that out of the JSON results
+    server = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=sys.stderr)
+    if not wait_for_port(args.host, args.port, args.timeout):
+        server.kill()
+        raise SystemExit(f"Server did not start listening on {args.host}:{args.port}")
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator and latency benchmark for server.py")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('-n', '--sessions', type=int, default=SESSIONS,
+                        help="concurrent sessions (default %(default)s)")
+    parser.add_argument('--commands', type=int, default=COMMANDS,
+                        help="commands run by each session (default %(default)s)")
+    parser.add_argument('-c', '--command', action='append', metavar='[WEIGHT:]LINE',
+                        help="add a command to the mix, e.g. '4:echo hi' (repeatable; "
+                             "default: help, echo, users and say)")
+    parser.add_argument('--user', default=USER,
+                        help="username template, formatted with the session number (default %(default)s)")
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--no-login', action='store_true',
+                        help="skip the login exchange and start at the first prompt")
+    parser.add_argument('--login-prompt', default=LOGIN_PROMPT)
+    parser.add_argument('--password-prompt', default=PASSWORD_PROMPT)
+    parser.add_argument('--prompt', default=PROMPT,
+                        help="text that ends every command reply (default %(default)r)")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help="seconds to wait for any one prompt (default %(default)s)")
+    parser.add_argument('--no-compression', action='store_true',
+                        help="refuse MCCP2 compressed output from the server")
+    parser.add_argument('--ramp', type=float, default=0.0,
+                        help="spread session start over this many seconds")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the command mix")
+    parser.add_argument('--label', default=None, help="label stored with the results")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="sample this server process's memory use")
+    parser.add_argument('--spawn', action='store_true',
+                        help="start server.py on --port for the run and stop it afterwards")
+    parser.add_argument('--server-args', default='',
+                        help="extra arguments for the spawned server, e.g. '--engine asyncio'")
+    parser.add_argument('--write-credentials', metavar='PATH',
+                        help="write the sessions' accounts to a credential file and exit")
+    parser.add_argument('-o', '--output', help="write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client.compression = not args.no_compression
+    if args.write_credentials:
+        write_credentials(args.write_credentials, args)
+        print(f"Wrote {args.sessions} accounts to {args.write_credentials}")
+        return 0
+    if args.label is None:
+        args.label = args.server_args or f"{args.host}:{args.port}"
+
+    server = None
+    credentials_path = None
+    try:
+        if args.spawn:
+            if not args.no_login:
+                fd, credentials_path = tempfile.mkstemp(prefix='loadgen-', suffix='.txt')
+                os.close(fd)
+                write_credentials(credentials_path, args)
+            server = spawn_server(args, credentials_path)
+            args.server_pid = server.pid
+        results = asyncio.run(run_load(args, args.server_pid))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)  # The server's own clean shutdown
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if credentials_path:
+            os.unlink(credentials_path)
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
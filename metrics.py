@@ -0,0 +1,245 @@
+"""Counters, gauges and latency histograms for the Telnet server.
+
+Metrics are declared once at import time and updated from the hot path
+with a dict lookup and an addition under a short lock:
+
+    accepted = metrics.counter('telnet_connections_accepted_total', "Connections accepted")
+    accepted.inc()
+
+    latency = metrics.histogram('telnet_command_seconds', "Command latency", ('command',))
+    latency.observe(elapsed, ('help',))
+
+Gauges are functions evaluated only when the metrics are read. render()
+produces the Prometheus text exposition format, served over HTTP by
+serve_http(), and summary() a compact listing for the `stats` command.
+"""
+
+import bisect
+import http.server
+import threading
+
+# Upper bounds (seconds) of the default latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics = []  # Every declared metric, in declaration order
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Monotonic count, optionally split by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values tuple -> count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self.values.get(labels, 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        if not items and not self.labels:
+            items = [((), 0)]
+        return [(self.name, labels, value) for labels, value in items]
+
+
+class Gauge:
+    """Current value read from a function when the metrics are collected."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.labels = ()
+        self.function = function
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [(self.name, (), value)]
+
+
+class Histogram:
+    """Observations counted into fixed buckets, optionally per label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values tuple -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self, labels=()):
+        """Copy of one series ([bucket counts..., +Inf count, sum]) to diff against later."""
+        with self.lock:
+            return list(self.series.get(labels) or [0] * (len(self.buckets) + 2))
+
+    def _series(self, labels, since):
+        series = self.series.get(labels)
+        if series is None or since is None:
+            return series
+        return [now - then for now, then in zip(series, since)]
+
+    def count(self, labels=(), since=None):
+        series = self._series(labels, since)
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, labels=(), since=None):
+        series = self._series(labels, since)
+        return series[-1] if series else 0
+
+    def quantile(self, q, labels=(), since=None):
+        """Estimate a quantile as the upper bound of the bucket it falls in.
+
+        With `since` (a snapshot()) only observations made after it count.
+        """
+        series = self._series(labels, since)
+        if not series or not any(series[:-1]):
+            return None
+        counts = series[:-1]
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self.lock:
+            items = sorted((labels, list(series)) for labels, series in self.series.items())
+        samples = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels, cumulative, (('le', _format_number(bound)),)))
+            samples.append((self.name + '_sum', labels, series[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+def _declare(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name, help, labels=()):
+    return _declare(Counter(name, help, labels))
+
+
+def gauge(name, help, function):
+    return _declare(Gauge(name, help, function))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _declare(Histogram(name, help, labels, buckets))
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample in metric.samples():
+            name, labels, value = sample[:3]
+            extra = sample[3] if len(sample) > 3 else ()
+            lines.append(f"{name}{_format_labels(metric.labels, labels, extra)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Human readable listing: counters and gauges, then histogram percentiles."""
+    lines = []
+    for metric in _metrics:
+        if isinstance(metric, Histogram):
+            for labels in sorted(metric.series):
+                name = metric.name + _format_labels(metric.labels, labels)
+                percentiles = ' '.join(
+                    f"p{int(q * 100)}<={_format_seconds(metric.quantile(q, labels))}"
+                    for q in (0.5, 0.95, 0.99))
+                lines.append(f"  {name} count={metric.count(labels)} {percentiles}")
+        else:
+            for name, labels, value in metric.samples():
+                lines.append(f"  {name}{_format_labels(metric.labels, labels)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_seconds(value):
+    if value is None:
+        return '-'
+    if value == float('inf'):
+        return 'inf'
+    return f"{value * 1000:g}ms"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+
+def serve_http(host, port):
+    """Serve /metrics from a background thread; returns the HTTP server."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    return server
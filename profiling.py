@@ -0,0 +1,165 @@
+"""On-demand profiling for the Telnet server.
+
+Profiling is switched on and off at runtime (the server wires it to
+SIGUSR2 and the admin `profile` command) and does two things while on:
+
+* Phase timing: the functions that make up the request path (recv, IAC
+  parsing, command dispatch, logging, send) are swapped in their module
+  for wrappers that time every call into the `telnet_phase_seconds`
+  histogram. Switching off puts the original functions back, so the
+  request path runs exactly the same code as without profiling.
+* Sampling: a background thread snapshots the stack of every thread
+  SAMPLE_INTERVAL seconds apart and counts identical stacks. stop()
+  writes them in the collapsed format read by flamegraph.pl, speedscope
+  and similar tools ("frame;frame;frame count" per line).
+
+    profiler = profiling.Profiler(directory='/tmp')
+    profiler.add_phase('command', globals(), 'handle_command')
+    profiler.start()
+    ...
+    path = profiler.stop()
+"""
+
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+SAMPLE_INTERVAL = 0.01   # Seconds between stack samples (100 Hz)
+MAX_DEPTH = 64           # Innermost frames kept per sample
+
+# Phases take microseconds, so the buckets start well below the latency defaults
+PHASE_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005) + metrics.LATENCY_BUCKETS
+
+phase_seconds = metrics.histogram('telnet_phase_seconds', "Time spent per request path phase while profiling",
+                                  ('phase',), PHASE_BUCKETS)
+
+
+def _frame_label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+def collapse(frame, depth=MAX_DEPTH):
+    """One stack as 'outer;...;inner', outermost frame first."""
+    labels = []
+    while frame is not None and len(labels) < depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class Profiler:
+    """Phase timing plus a stack sampler, started and stopped together."""
+
+    def __init__(self, directory=None, interval=SAMPLE_INTERVAL):
+        self.directory = directory or os.getcwd()
+        self.interval = interval
+        self.phases = []       # (phase, namespace, name, clock)
+        self.originals = []    # (namespace, name, original function) while running
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started = None    # time.time() of the running session, or None
+        self.baseline = {}     # phase -> phase_seconds snapshot taken at start()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def add_phase(self, phase, namespace, name, clock=time.perf_counter):
+        """Time calls to namespace[name] (a module's globals()) as `phase` while running.
+
+        Pass clock=time.thread_time for calls that block waiting on the
+        network, so that idle waiting is not counted as work.
+        """
+        self.phases.append((phase, namespace, name, clock))
+
+    def _wrap(self, phase, function, clock):
+        observe = phase_seconds.observe
+        labels = (phase,)
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(clock() - started, labels)
+        return timed
+
+    def start(self):
+        """Install the phase timers and start sampling; False if already running."""
+        with self.lock:
+            if self.running:
+                return False
+            for phase, namespace, name, clock in self.phases:
+                function = namespace[name]
+                self.originals.append((namespace, name, function))
+                namespace[name] = self._wrap(phase, function, clock)
+            self.baseline = {phase: phase_seconds.snapshot((phase,)) for phase, _, _, _ in self.phases}
+            self.stacks.clear()
+            self.samples = 0
+            self.started = time.time()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Put the original functions back, stop sampling and write the stacks.
+
+        Returns the path of the collapsed-stack file, or None if the
+        profiler was not running.
+        """
+        with self.lock:
+            if not self.running:
+                return None
+            for namespace, name, function in self.originals:
+                namespace[name] = function
+            self.originals.clear()
+            self.stopping.set()
+            self.thread.join()
+            path = os.path.join(self.directory, f"pytelnet-{os.getpid()}-{int(self.started * 1000)}.folded")
+            self.started = None
+            with open(path, 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            return path
+
+    def toggle(self):
+        """Start if stopped, stop if running; returns the stop() path or None."""
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[collapse(frame)] += 1
+            self.samples += 1
+
+    def phase_summary(self):
+        """Count, mean and p50/p99 per timed phase for the latest session."""
+        lines = []
+        for phase, _, _, _ in self.phases:
+            labels, since = (phase,), self.baseline.get(phase)
+            count = phase_seconds.count(labels, since)
+            if not count:
+                continue
+            total = phase_seconds.sum(labels, since)
+            lines.append(f"  {phase:<8} calls={count} total={total * 1000:.1f}ms "
+                         f"mean={total / count * 1e6:.1f}us "
+                         f"p50<={phase_seconds.quantile(0.5, labels, since) * 1e6:g}us "
+                         f"p99<={phase_seconds.quantile(0.99, labels, since) * 1e6:g}us")
+        return "\n".join(lines) + "\n" if lines else "  (no calls timed)\n"
@@ -0,0 +1,391 @@
+"""Telnet protocol pieces shared by server.py and client.py."""
+
+import time
+import zlib
+
+# Telnet protocol control characters and options
+IAC = 255           # Interpret As Command
+DONT = 254          # Don't use option
+DO = 253            # Do use option
+WONT = 252          # Won't use option
+WILL = 251          # Will use option
+SB = 250            # Subnegotiation Begin
+SE = 240            # Subnegotiation End
+ECHO = 1            # Echo option
+SUPPRESS_GO_AHEAD = 3  # Suppress Go Ahead option
+TERMINAL_TYPE = 24     # Terminal type option
+NAWS = 31              # Negotiate About Window Size
+BINARY = 0             # Binary transmission option
+CR = 13                # Carriage Return
+LF = 10                # Line Feed
+NUL = 0                # Null character
+COMPRESS2 = 86         # MUD Client Compression Protocol v2 (MCCP2)
+
+# TERMINAL-TYPE subnegotiation codes (RFC 1091)
+TTYPE_IS = b'\x00'
+TTYPE_SEND = b'\x01'
+
+# Names used in logs and metrics
+COMMAND_NAMES = {DO: 'DO', DONT: 'DONT', WILL: 'WILL', WONT: 'WONT'}
+OPTION_NAMES = {BINARY: 'BINARY', ECHO: 'ECHO', SUPPRESS_GO_AHEAD: 'SGA', TERMINAL_TYPE: 'TTYPE',
+                NAWS: 'NAWS', COMPRESS2: 'COMPRESS2'}
+
+IAC_BYTE = bytes([IAC])
+NEGOTIATION_COMMANDS = (DO, DONT, WILL, WONT)
+
+# Longest subnegotiation payload we buffer before discarding the rest
+MAX_SUBNEGOTIATION = 1024
+
+# Parser states
+_DATA = 0       # Plain application data
+_IAC = 1        # Seen IAC, waiting for the command byte
+_OPTION = 2     # Seen IAC DO/DONT/WILL/WONT, waiting for the option byte
+_SB = 3         # Inside IAC SB ... collecting the payload
+_SB_IAC = 4     # Seen IAC inside a subnegotiation
+
+
+# Sides of an option, as the bit offset of that side's state in OptionTable
+LOCAL = 0    # We perform the option (WILL/WONT from us, DO/DONT from the peer)
+REMOTE = 3   # The peer performs it (DO/DONT from us, WILL/WONT from the peer)
+
+# RFC 1143 ("Q method") states of one side of one option. A WANT state with
+# _OPPOSITE has the opposite request queued behind the one in flight.
+NO = 0
+YES = 1
+WANTNO = 2
+WANTNO_OPPOSITE = 3
+WANTYES = 4
+WANTYES_OPPOSITE = 5
+
+# What to send, as an index into _COMMANDS[side]
+_NOTHING, _AGREE, _REFUSE = 0, 1, 2
+_COMMANDS = {LOCAL: (None, WILL, WONT), REMOTE: (None, DO, DONT)}
+
+# Transition tables indexed by the current state: (new state, send, change),
+# where change is True/False when the option ends up switched on/off.
+# The peer asked for the option to be on (WILL/DO); NO is decided by policy.
+_RECEIVED_ON = (
+    None,
+    (YES, _NOTHING, None),            # YES: already on, nothing to answer
+    (NO, _NOTHING, False),            # WANTNO: our DONT/WONT answered wrongly; RFC 1143 says NO
+    (YES, _NOTHING, None),            # WANTNO_OPPOSITE: as wrong, but we wanted it back on anyway
+    (YES, _NOTHING, True),            # WANTYES: our request was accepted
+    (WANTNO, _REFUSE, True),          # WANTYES_OPPOSITE: accepted (on until our refusal is answered)
+)
+# The peer asked for the option to be off (WONT/DONT); this is never refused
+_RECEIVED_OFF = (
+    (NO, _NOTHING, None),             # NO: already off
+    (NO, _REFUSE, False),             # YES: agree to switch it off
+    (NO, _NOTHING, False),            # WANTNO: our request was accepted
+    (WANTYES, _AGREE, False),         # WANTNO_OPPOSITE: off, now ask for it again
+    (NO, _NOTHING, None),             # WANTYES: our request was refused
+    (NO, _NOTHING, None),             # WANTYES_OPPOSITE: refused, which we wanted by now
+)
+# We want the option on / off: (new state, send)
+_ASK_ON = ((WANTYES, _AGREE), (YES, _NOTHING), (WANTNO_OPPOSITE, _NOTHING),
+           (WANTNO_OPPOSITE, _NOTHING), (WANTYES, _NOTHING), (WANTYES, _NOTHING))
+_ASK_OFF = ((NO, _NOTHING), (WANTNO, _REFUSE), (WANTNO, _NOTHING),
+            (WANTNO, _NOTHING), (WANTYES_OPPOSITE, _NOTHING), (WANTYES_OPPOSITE, _NOTHING))
+
+
+class OptionRegistry:
+    """The options one program supports and the handlers run for them.
+
+    server.py and client.py each keep one, and every connection negotiates
+    through its own OptionTable over it, so supporting a new option is a
+    register() call rather than an edit to the negotiation code:
+
+        telnet_options = OptionRegistry(send_option)
+        telnet_options.register(NAWS, remote=True, on_subnegotiation=window_size_changed)
+
+    send_option(conn, command, option) sends or queues one command.
+    """
+
+    def __init__(self, send_option):
+        self.send_option = send_option
+        self.options = {}  # option -> (local, remote, on_change, on_subnegotiation)
+
+    def register(self, option, local=False, remote=False, on_change=None, on_subnegotiation=None):
+        """Support option, replacing any earlier registration.
+
+        local: agree when the peer asks us to perform it (DO -> WILL).
+        remote: agree when the peer offers to perform it (WILL -> DO).
+        Either may be a function, checked every time the peer asks, for
+        options a setting can turn off. Options never registered are refused.
+
+        on_change(conn, side, enabled) runs whenever a side of the option is
+        switched on or off; side is LOCAL or REMOTE.
+        on_subnegotiation(conn, payload) receives its IAC SB ... IAC SE payloads.
+        """
+        self.options[option] = (local, remote, on_change, on_subnegotiation)
+
+    def supports(self, option, side):
+        entry = self.options.get(option)
+        if entry is None:
+            return False
+        allowed = entry[0] if side == LOCAL else entry[1]
+        return bool(allowed() if callable(allowed) else allowed)
+
+
+class OptionTable:
+    """RFC 1143 option negotiation state of one connection.
+
+    Both sides of every option are kept in a single small int per option
+    (3 bits per side: the Q method state, queue bit included), and options
+    still NO on both sides are not stored at all. Every transition comes
+    from the tables above, so the table never answers a request for the
+    state an option is already in and two peers cannot loop, even when
+    both offer the same options at once.
+    """
+
+    __slots__ = ('registry', 'conn', 'states')
+
+    def __init__(self, registry, conn):
+        self.registry = registry
+        self.conn = conn
+        self.states = {}  # option -> LOCAL state | REMOTE state << 3
+
+    def state(self, option, side):
+        return self.states.get(option, 0) >> side & 7
+
+    def _set(self, option, side, state):
+        packed = self.states.get(option, 0) & ~(7 << side) | state << side
+        if packed:
+            self.states[option] = packed
+        else:
+            self.states.pop(option, None)
+
+    def enabled(self, option, side):
+        """True if the option is on for that side."""
+        return self.state(option, side) == YES
+
+    def pending(self):
+        """True while any request of ours is still unanswered."""
+        return any(self.state(option, LOCAL) >= WANTNO or self.state(option, REMOTE) >= WANTNO
+                   for option in self.states)
+
+    def request(self, command, option):
+        """Ask for an option change: WILL/WONT for our side, DO/DONT for the peer's.
+
+        Sends the command only if the Q method calls for it; returns True
+        if it was sent.
+        """
+        side = LOCAL if command in (WILL, WONT) else REMOTE
+        new, send = (_ASK_ON if command in (WILL, DO) else _ASK_OFF)[self.state(option, side)]
+        self._set(option, side, new)
+        if send:
+            self.registry.send_option(self.conn, _COMMANDS[side][send], option)
+        return bool(send)
+
+    def receive(self, command, option):
+        """Apply a DO/DONT/WILL/WONT from the peer, answer it if needed and run on_change."""
+        side = REMOTE if command in (WILL, WONT) else LOCAL
+        state = self.state(option, side)
+        if command in (WONT, DONT):
+            new, send, change = _RECEIVED_OFF[state]
+        elif state != NO:
+            new, send, change = _RECEIVED_ON[state]
+        elif self.registry.supports(option, side):
+            new, send, change = YES, _AGREE, True
+        else:
+            new, send, change = NO, _REFUSE, None
+        self._set(option, side, new)
+        if send:
+            self.registry.send_option(self.conn, _COMMANDS[side][send], option)
+        if change is not None:
+            entry = self.registry.options.get(option)
+            if entry is not None and entry[2] is not None:
+                entry[2](self.conn, side, change)
+
+    def subnegotiation(self, option, payload):
+        """Pass an IAC SB ... IAC SE payload to the option's handler."""
+        entry = self.registry.options.get(option)
+        if entry is not None and entry[3] is not None:
+            entry[3](self.conn, payload)
+
+
+class TelnetParser:
+    """Incremental Telnet stream parser that keeps its state between reads.
+
+    Feed it every chunk received from a connection. Application data is
+    returned with the IAC sequences removed; negotiation commands and
+    subnegotiations are reported through callbacks as soon as they are
+    complete, even when a sequence is split across several chunks:
+
+        on_negotiate(command, option)      IAC DO/DONT/WILL/WONT <option>
+        on_subnegotiation(option, payload) IAC SB <option> <payload> IAC SE
+        on_command(command)                any other two byte IAC command
+
+    Chunks without IAC bytes are returned as-is without a per-byte loop.
+
+    With decompress=True the parser also handles MCCP2: everything after an
+    IAC SB COMPRESS2 IAC SE from the peer is inflated before it is parsed,
+    until the peer ends the zlib stream. `wire_bytes` and `stream_bytes`
+    count what arrived compressed and what it inflated to.
+    """
+
+    __slots__ = ('on_negotiate', 'on_subnegotiation', 'on_command',
+                 'state', 'verb', 'sb_buffer', 'decompress', 'inflate',
+                 'wire_bytes', 'stream_bytes')
+
+    def __init__(self, on_negotiate=None, on_subnegotiation=None, on_command=None,
+                 decompress=False):
+        self.on_negotiate = on_negotiate
+        self.on_subnegotiation = on_subnegotiation
+        self.on_command = on_command
+        self.state = _DATA
+        self.verb = None
+        self.sb_buffer = None
+        self.decompress = decompress
+        self.inflate = None  # zlib decompressor while the peer's stream is compressed
+        self.wire_bytes = 0
+        self.stream_bytes = 0
+
+    def _inflate(self, data):
+        """Inflate compressed input; bytes after the end of the zlib stream pass through."""
+        self.wire_bytes += len(data)
+        inflated = self.inflate.decompress(data)
+        self.stream_bytes += len(inflated)
+        if self.inflate.eof:
+            rest = self.inflate.unused_data
+            self.wire_bytes -= len(rest)
+            self.inflate = None
+            inflated += rest
+        return inflated
+
+    def feed(self, data):
+        """Parse one chunk and return its application data as bytes."""
+        if self.inflate is not None:
+            data = self._inflate(data)
+
+        # Fast path: no pending sequence and nothing to interpret
+        if self.state == _DATA and IAC not in data:
+            return data
+
+        out = []
+        view = memoryview(data)
+        n = len(data)
+        i = 0
+        while i < n:
+            state = self.state
+            if state == _DATA:
+                j = data.find(IAC_BYTE, i)
+                if j < 0:
+                    out.append(view[i:])
+                    break
+                if j > i:
+                    out.append(view[i:j])
+                self.state = _IAC
+                i = j + 1
+            elif state == _IAC:
+                byte = data[i]
+                i += 1
+                if byte == IAC:
+                    out.append(IAC_BYTE)  # Escaped 0xFF data byte
+                    self.state = _DATA
+                elif byte in NEGOTIATION_COMMANDS:
+                    self.verb = byte
+                    self.state = _OPTION
+                elif byte == SB:
+                    self.sb_buffer = bytearray()
+                    self.state = _SB
+                else:
+                    self.state = _DATA
+                    if self.on_command:
+                        self.on_command(byte)
+            elif state == _OPTION:
+                option = data[i]
+                i += 1
+                self.state = _DATA
+                if self.on_negotiate:
+                    self.on_negotiate(self.verb, option)
+            elif state == _SB:
+                j = data.find(IAC_BYTE, i)
+                end = n if j < 0 else j
+                room = MAX_SUBNEGOTIATION - len(self.sb_buffer)
+                if room > 0:
+                    self.sb_buffer += view[i:min(end, i + room)]
+                if j < 0:
+                    break
+                self.state = _SB_IAC
+                i = j + 1
+            elif state == _SB_IAC:
+                byte = data[i]
+                if byte == IAC:
+                    # Escaped 0xFF inside the payload
+                    if len(self.sb_buffer) < MAX_SUBNEGOTIATION:
+                        self.sb_buffer.append(IAC)
+                    self.state = _SB
+                    i += 1
+                else:
+                    payload = bytes(self.sb_buffer)
+                    self.sb_buffer = None
+                    if byte == SE:
+                        self.state = _DATA
+                        i += 1
+                    else:
+                        # Unterminated subnegotiation: end it here and
+                        # interpret the byte as an ordinary IAC command
+                        self.state = _IAC
+                    if payload[:1] == bytes([COMPRESS2]) and self.decompress and self.inflate is None:
+                        # The rest of the input is one zlib stream
+                        self.inflate = zlib.decompressobj()
+                        data = self._inflate(bytes(view[i:]))
+                        view = memoryview(data)
+                        n = len(data)
+                        i = 0
+                    if payload and self.on_subnegotiation:
+                        self.on_subnegotiation(payload[0], payload[1:])
+
+        if len(out) == 1:
+            return bytes(out[0])
+        return b''.join(out)
+
+
+# zlib flush modes selectable for compressed output
+FLUSH_MODES = {
+    'sync': zlib.Z_SYNC_FLUSH,        # Byte-aligned flush, dictionary kept (best ratio)
+    'partial': zlib.Z_PARTIAL_FLUSH,  # Slightly smaller flushes, not byte-aligned
+    'full': zlib.Z_FULL_FLUSH,        # Resets the dictionary, so each flush decodes alone
+}
+
+
+class StreamCompressor:
+    """Outgoing half of an MCCP2 stream.
+
+    compress() deflates one batch of output and flushes it with the
+    configured flush mode, so each batch reaches the peer without waiting
+    for more data. `raw_bytes`, `wire_bytes` and `cpu_seconds` (thread CPU
+    time spent compressing) measure what compression costs and saves.
+    """
+
+    __slots__ = ('deflate', 'flush_mode', 'raw_bytes', 'wire_bytes', 'cpu_seconds')
+
+    def __init__(self, level=6, flush='sync'):
+        self.deflate = zlib.compressobj(level)
+        self.flush_mode = FLUSH_MODES[flush]
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_seconds = 0.0
+
+    @property
+    def active(self):
+        return self.deflate is not None
+
+    def compress(self, data):
+        started = time.thread_time()
+        out = self.deflate.compress(data) + self.deflate.flush(self.flush_mode)
+        self.cpu_seconds += time.thread_time() - started
+        self.raw_bytes += len(data)
+        self.wire_bytes += len(out)
+        return out
+
+    def finish(self, data=b''):
+        """Compress the last data and end the zlib stream."""
+        started = time.thread_time()
+        out = self.deflate.compress(data) + self.deflate.flush(zlib.Z_FINISH)
+        self.cpu_seconds += time.thread_time() - started
+        self.raw_bytes += len(data)
+        self.wire_bytes += len(out)
+        self.deflate = None
+        return out
@@ -0,0 +1,273 @@
+"""Replay captured sessions against a server and compare with the recording.
+
+Reads capture files written by `server.py --capture PATH` and plays every
+recorded session over its own connection, sending exactly the bytes the
+client sent (Telnet negotiation answers included) at the recorded pace:
+
+    python3 replay.py telnet.cap                 # original speed
+    python3 replay.py telnet.cap --speed 10      # 10x faster
+    python3 replay.py telnet.cap --speed 0       # as fast as the server answers
+
+As the user did, a session waits for the server to start answering an
+input before it sends the next one; the recorded think time between
+inputs is then divided by --speed. With --speed 0 there is no think time
+and sessions start together (limited by --concurrency). Latency is the
+time from sending an input to the first byte of the reply, and is only
+measured for inputs the server answered during the recording. Recorded latency is measured when the
+reply was queued on the server, so it does not include the network.
+Results are printed as one JSON document, like loadgen.py's, so runs
+against different engines or parser changes can be compared:
+
+    python3 replay.py telnet.cap --speed 0 --spawn --server-args "--engine asyncio --credentials users.db"
+"""
+
+import argparse
+import asyncio
+import collections
+import functools
+import json
+import signal
+import subprocess
+import sys
+import time
+
+import capture
+from loadgen import percentiles, spawn_server
+from protocol import TelnetParser
+
+# Defaults
+HOST = 'localhost'
+PORT = 2323
+SPEED = 1.0             # 1.0 replays at the recorded pace, 0 as fast as possible
+CONCURRENCY = 0         # Sessions replayed at once with --speed 0 (0 = all)
+TIMEOUT = 10.0          # Seconds to wait for a reply the recording says will come
+
+
+class ReplaySession(asyncio.Protocol):
+    """One connection replaying a captured session.
+
+    The server's negotiation is not answered here: the client's answers
+    are part of the captured input. Output is inflated (MCCP2 included)
+    only to count it; `pending` holds the send times of inputs waiting for
+    their first reply byte. With expect_greeting the connection itself
+    waits for one, timed from the moment it is opened.
+    """
+
+    def __init__(self, expect_greeting=False):
+        self.transport = None
+        self.parser = TelnetParser(decompress=True)
+        self.pending = collections.deque()
+        if expect_greeting:
+            self.pending.append(time.perf_counter())
+        self.latencies = []
+        self.replied = None  # Future set when the next reply starts to arrive
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        now = time.perf_counter()
+        self.bytes_in += len(self.parser.feed(data))
+        if self.pending:
+            self.latencies.append(now - self.pending.popleft())
+        if self.replied is not None and not self.replied.done():
+            self.replied.set_result(now)
+
+    def connection_lost(self, exc):
+        if self.replied is not None and not self.replied.done():
+            self.replied.set_exception(ConnectionResetError("connection closed by server"))
+
+    def send(self, data, expect_reply):
+        self.bytes_out += len(data)
+        if expect_reply:
+            self.pending.append(time.perf_counter())
+        self.transport.write(data)
+
+    async def wait_reply(self, timeout):
+        """Wait until the server starts answering the input sent last."""
+        if not self.pending:
+            return
+        if self.transport.is_closing():
+            raise ConnectionResetError("connection closed by server")
+        self.replied = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self.replied, timeout)
+        finally:
+            self.replied = None
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+async def replay_session(recorded, offset, args, stats, limit):
+    """Connect at `offset` seconds into the run and replay one recorded session."""
+    loop = asyncio.get_running_loop()
+    if offset:
+        await asyncio.sleep(offset)
+    async with limit:
+        try:
+            _, session = await asyncio.wait_for(
+                loop.create_connection(functools.partial(ReplaySession, recorded.greeted),
+                                       args.host, args.port), args.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            stats['errors'].append(f"connect: {e or 'timed out'}")
+            return
+        started = time.perf_counter()
+        try:
+            if recorded.greeted:
+                # The recorded client saw the greeting before it typed anything
+                await session.wait_reply(args.timeout)
+                stats['greeting'].append(session.latencies.pop(0))
+            for timestamp, data, recorded_latency in recorded.inputs:
+                if session.transport.is_closing():
+                    stats['errors'].append("connection closed before the recording ended")
+                    break
+                if args.speed:
+                    due = started + (timestamp - recorded.opened) / args.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                expect_reply = recorded_latency is not None
+                session.send(data, expect_reply)
+                stats['inputs'] += 1
+                if expect_reply:
+                    stats['recorded_latency'].append(recorded_latency)
+                    await session.wait_reply(args.timeout)
+        except asyncio.TimeoutError:
+            if session.pending:
+                stats['errors'].append("timed out waiting for a reply")
+        except ConnectionError as e:
+            stats['errors'].append(str(e))
+        finally:
+            stats['missing_replies'] += len(session.pending)
+            stats['latency'].extend(session.latencies)
+            stats['bytes_in'] += session.bytes_in
+            stats['bytes_out'] += session.bytes_out
+            session.close()
+
+
+async def run_replay(recordings, args):
+    """Replay every recorded session and return the results document."""
+    stats = {'latency': [], 'recorded_latency': [], 'greeting': [], 'errors': [], 'inputs': 0,
+             'missing_replies': 0, 'bytes_in': 0, 'bytes_out': 0}
+    first = recordings[0].opened
+    limit = asyncio.Semaphore(args.concurrency or len(recordings))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        replay_session(recorded, (recorded.opened - first) / args.speed if args.speed else 0,
+                       args, stats, limit)
+        for recorded in recordings))
+    elapsed = time.perf_counter() - started
+
+    recorded_inputs = sum(len(recorded.inputs) for recorded in recordings)
+    recorded_end = max(recorded.closed or (recorded.inputs[-1][0] if recorded.inputs else recorded.opened)
+                       for recorded in recordings)
+    recorded_elapsed = recorded_end - first
+    recorded_throughput = recorded_inputs / recorded_elapsed if recorded_elapsed else 0.0
+    throughput = stats['inputs'] / elapsed if elapsed else 0.0
+    recorded_ms = percentiles(stats['recorded_latency'])
+    replay_ms = percentiles(stats['latency'])
+    return {
+        'label': args.label,
+        'host': args.host,
+        'port': args.port,
+        'speed': args.speed or 'max',
+        'sessions': len(recordings),
+        'recorded': {
+            'elapsed': round(recorded_elapsed, 3),
+            'inputs': recorded_inputs,
+            'throughput': round(recorded_throughput, 1),
+            'output_bytes': sum(recorded.output_bytes for recorded in recordings),
+            'latency_ms': recorded_ms,
+        },
+        'replay': {
+            'elapsed': round(elapsed, 3),
+            'inputs': stats['inputs'],
+            'throughput': round(throughput, 1),
+            'bytes_out': stats['bytes_out'],
+            'output_bytes': stats['bytes_in'],
+            'latency_ms': replay_ms,
+            'time_to_greeting_ms': percentiles(stats['greeting']),
+            'missing_replies': stats['missing_replies'],
+        },
+        'difference': {
+            'throughput_ratio': round(throughput / recorded_throughput, 3) if recorded_throughput else None,
+            'p50_latency_ms': _difference(replay_ms, recorded_ms, 'p50'),
+            'p99_latency_ms': _difference(replay_ms, recorded_ms, 'p99'),
+        },
+        'errors': len(stats['errors']),
+        'error_samples': sorted(set(stats['errors']))[:10],
+    }
+
+
+def _difference(replay, recorded, key):
+    if key not in replay or key not in recorded:
+        return None
+    return round(replay[key] - recorded[key], 3)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured Telnet sessions against a server")
+    parser.add_argument('captures', nargs='+', metavar='CAPTURE',
+                        help="capture file written by server.py --capture (one per worker with --workers)")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--speed', type=float, default=SPEED,
+                        help="replay speed relative to the recording; 0 for as fast as possible "
+                             "(default %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help="sessions replayed at once with --speed 0 (default: all)")
+    parser.add_argument('--sessions', type=int, default=None,
+                        help="replay only the first N recorded sessions")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help="seconds to wait for a reply (default %(default)s)")
+    parser.add_argument('--label', default=None, help="label stored with the results")
+    parser.add_argument('--spawn', action='store_true',
+                        help="start server.py on --port for the run and stop it afterwards")
+    parser.add_argument('--server-args', default='',
+                        help="extra arguments for the spawned server, e.g. '--credentials users.db'")
+    parser.add_argument('-o', '--output', help="write the JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.speed < 0:
+        print("--speed must be 0 or more", file=sys.stderr)
+        return 2
+    recordings = [recorded for recorded in capture.load_sessions(args.captures) if recorded.inputs]
+    if args.sessions is not None:
+        recordings = recordings[:args.sessions]
+    if not recordings:
+        print("No sessions with input in the capture", file=sys.stderr)
+        return 2
+    if args.label is None:
+        args.label = args.server_args or f"{args.host}:{args.port}"
+
+    server = None
+    try:
+        if args.spawn:
+            server = spawn_server(args, None)
+        results = asyncio.run(run_replay(recordings, args))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,94 @@
 import socket
 import select
+import errno
 import time
 import os
 import sys
-import hashlib
 import threading
 import signal
 import queue
+import argparse
+import functools
+import asyncio
+import collections
+import concurrent.futures
+import selectors
+import itertools
+import re
+
+import admission
+import capture
+import eventlog
+import handoff
+import metrics
+import profiling
+from channels import ChannelRegistry, channel_name
+from commands import registry, command, CommandError, load_command_modules, CACHE_FOREVER
+from cluster import Broker, BrokerClient
+from credentials import (Authenticator, MemoryCredentialStore, open_store, AUTH_OK,
+                         AUTH_THROTTLED, AUTH_BUSY, AUTH_ERROR, AUTH_WORKERS)
+from sessions import Session, SessionRegistry, STATE_LOGIN, STATE_PASSWORD, STATE_COMMAND
+from timerwheel import TimerWheel
+from protocol import (IAC, DONT, DO, WILL, SB, SE, ECHO, SUPPRESS_GO_AHEAD,
+                      TERMINAL_TYPE, NAWS, BINARY, COMPRESS2, TelnetParser,
+                      StreamCompressor, FLUSH_MODES, COMMAND_NAMES, OPTION_NAMES, TTYPE_IS, TTYPE_SEND,
+                      REMOTE, OptionRegistry, OptionTable)
 
 # Server configuration
 HOST = '0.0.0.0'
 PORT = 2323
 BUFFER_SIZE = 1024
-TIMEOUT = 30  # 5 minutes idle timeout
-
-# Telnet protocol constants
-IAC = 255
-DONT = 254
-DO = 253
-WONT = 252
-WILL = 251
-SB = 250
-SE = 240
-ECHO = 1
-SUPPRESS_GO_AHEAD = 3
-TERMINAL_TYPE = 24
-NAWS = 31
-BINARY = 0
-CR = 13
-LF = 10
-NUL = 0
-
-# User authentication
+TIMEOUT = 300  # 5 minutes idle timeout once logged in
+LOGIN_TIMEOUT = 60  # Idle timeout while at the login/password prompts
+REAPER_TICK = 1.0  # Resolution of the idle timeout wheel in seconds
+WORKERS = 0  # Worker processes sharing PORT via SO_REUSEPORT (0 = single process)
+BROKER_PATH = '/tmp/pytelnet-broker.sock'  # Unix socket of the workers' shared session registry
+ENGINE = 'threaded'  # Serving engine: 'threaded' (thread per connection) or 'asyncio' (single event loop)
+LISTEN_BACKLOG = 128  # Pending connection queue length
+ACCEPT_BATCH = 64  # Connections accepted per wakeup of the threaded engine's accept loop
+MAX_SESSIONS = 4096  # Concurrent sessions per process before new connections are refused (0 = no limit)
+MAX_SESSIONS_PER_IP = 256  # Concurrent sessions from one IP (0 = no limit)
+CONNECT_RATE = 50.0  # Connects per second one IP regains (0 = no rate limit)
+CONNECT_BURST = 256  # Connects one IP may make at once
+SEND_QUEUE_LIMIT = 256  # Messages buffered per client before the slow-consumer policy applies
+SLOW_CONSUMER_POLICY = 'drop'  # 'drop' new messages, 'coalesce' the backlog or 'disconnect' the client
+OUTPUT_HIGH_WATER = 256 * 1024  # Unsent bytes queued for a client before we stop reading its input
+OUTPUT_LOW_WATER = 64 * 1024  # Unsent bytes below which reading resumes
+COMPRESSION = True  # Offer MCCP2 (zlib compressed output) to clients
+COMPRESSION_LEVEL = 6  # zlib level 1 (fastest) .. 9 (smallest)
+COMPRESSION_FLUSH = 'sync'  # zlib flush after every write: 'sync', 'partial' or 'full'
+MAX_LINE_LENGTH = 4096  # Longest input line accepted, in bytes
+MAX_LOGIN_ATTEMPTS = 3  # Failed logins before the connection is closed
+MAX_PENDING_INPUT = 65536  # Input held while a password is verified before the client is evicted
+
+# Options offered to every client in one burst at connect (MCCP2 is added when enabled)
+NEGOTIATE = ((WILL, SUPPRESS_GO_AHEAD), (DO, SUPPRESS_GO_AHEAD), (WILL, BINARY), (DO, BINARY),
+             (DO, NAWS), (DO, TERMINAL_TYPE))
+
+# Sent to connections refused by admission control, then the socket is closed
+BUSY_MESSAGE = b"Server busy, please try again later\r\n"
+
+# Sent to every session of a server that is draining after a reload
+DRAIN_NOTICE = ("\n*** The server is restarting. This session will be closed in {grace:g} seconds; "
+                "please reconnect. ***\n")
+
+# Prompts
+LOGIN_PROMPT = 'login: '
+PASSWORD_PROMPT = 'Password: '
+COMMAND_PROMPT = '> '
+
+# Users allowed to run administrative commands such as `stats`
+ADMIN_USERS = {'admin'}
+METRICS_ADDRESS = None  # (host, port) of the Prometheus /metrics endpoint; None disables it
+PROFILE_DIR = None  # Where profiling writes collapsed stacks; None is the working directory
+CAPTURE_PATH = None  # Record what clients send to this file for replay.py; None disables it
+DRAIN_GRACE = 30.0  # Seconds sessions may stay on an old server after a reload (SIGHUP)
+
+# Credential store file (.db/.sqlite for SQLite, anything else for a text file);
+# None falls back to the built-in accounts below, hashed at startup
+CREDENTIALS_PATH = None
+
+# Built-in accounts used when no credential store is configured
 users = {
     # username: password
     'admin': 'admin',
@@ -39,394 +96,1753 @@ users = {
     'user': '123456',
 }
 
-# Client states
-STATE_LOGIN = 0
-STATE_PASSWORD = 1
-STATE_COMMAND = 2
+# Client state: Session objects indexed by socket, fd, username and IP
+sessions = SessionRegistry()
 
-# Client state
-clients = {}  # {socket: {'addr': addr, 'buffer': b'', 'last_activity': timestamp, 'options': {}, 'state': int, 'username': str, 'prompt': str, 'window_size': (width, height)}}
+# Pub/sub channels: subscribers and recent history per channel name
+channels = ChannelRegistry()
 
-# Active users for tracking (username -> {socket, addr})
-active_users = {}  # username -> {socket: socket_obj, addr: (ip, port)}
-
-# Lock for thread safety
-lock = threading.Lock()
+# Session caps and per-IP connect rate limits applied before a session is created
+admission_control = admission.AdmissionControl(sessions, MAX_SESSIONS, MAX_SESSIONS_PER_IP,
+                                               CONNECT_RATE, CONNECT_BURST)
 
 # Global variables for server state
-message_queue = queue.Queue()  # Queue for broadcasting messages
+message_queue = queue.Queue()  # (channel or None for everyone, message, sender socket) to deliver
 running = True  # Server running state
+accepting = True  # Cleared once a reload has handed the listening socket on
+reloading = False  # A reload is in progress or done
+takeover = None  # (listening socket, channel) passed by the server this one replaces
+metrics_server = None  # HTTP server behind --metrics-address
+authenticator = None  # Verifies passwords off the serving threads (see setup_authentication)
+reuse_port = False  # Set in worker processes that share the listening port
+cluster = None  # BrokerClient for the shared session registry (worker mode only)
+profiler = profiling.Profiler()  # Phase timing and stack sampling, off until toggled
+recorder = None  # capture.CaptureWriter while --capture is on
+# Session ids in the capture file; seeded from the pid so a reloaded server appending
+# to the same file does not reuse the ids of sessions the old one is still draining
+capture_ids = itertools.count((os.getpid() & 0xffff) << 16 | 1)
 
-def send_option(client_socket, command, option):
-    """Send a Telnet option command."""
+# Reads from a client socket; a module global so the profiler can time it
+receive = socket.socket.recv
+compression_totals = collections.Counter()  # MCCP2 raw/wire bytes and CPU time of closed sessions
+
+# Metrics (see metrics.py); gauges are read only when the metrics are collected
+started_at = time.time()
+connections_accepted = metrics.counter('telnet_connections_accepted_total', "Connections accepted")
+connections_rejected = metrics.counter('telnet_connections_rejected_total',
+                                       "Connections refused or closed by the server", ('reason',))
+bytes_received = metrics.counter('telnet_received_bytes_total', "Bytes received from clients")
+bytes_sent = metrics.counter('telnet_sent_bytes_total', "Bytes sent to clients")
+iac_commands = metrics.counter('telnet_iac_commands_total', "Option negotiation commands received",
+                               ('command', 'option'))
+negotiation_settled_seconds = metrics.histogram('telnet_negotiation_settled_seconds',
+                                                "Time from the opening option burst until the client answered all of it")
+negotiation_seconds = metrics.histogram('telnet_negotiation_seconds',
+                                        "Round trip of options offered by the server", ('option',))
+auth_results = metrics.counter('telnet_auth_total', "Login attempts by result", ('result',))
+command_seconds = metrics.histogram('telnet_command_seconds', "Command handling time", ('command',))
+unknown_commands = metrics.counter('telnet_unknown_commands_total', "Lines that named no command")
+evictions = metrics.counter('telnet_evictions_total', "Sessions evicted by the server", ('reason',))
+cache_lookups = metrics.counter('telnet_response_cache_total', "Cached command reply lookups",
+                                ('result',))
+broadcasts = metrics.counter('telnet_broadcasts_total', "Broadcast and channel messages delivered")
+broadcast_recipients = metrics.counter('telnet_broadcast_recipients_total',
+                                       "Sessions a broadcast was queued for")
+
+# Sockets with queued output waiting to become writable (threaded engine)
+write_selector = selectors.DefaultSelector()
+write_selector_lock = threading.Lock()
+
+# Best effort non-blocking send flag for sockets served by blocking threads
+SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Most buffers handed to one sendmsg call (stays well below IOV_MAX)
+MAX_IOV = 64
+
+class OutputBuffer:
+    """Per-client output buffer flushed with vectored, non-blocking writes.
+
+    Everything a session produces (option replies, subnegotiations, messages
+    and broadcasts) is appended here and sent together in one sendmsg call
+    once the processing pass that produced it is over. Anything the socket
+    does not accept stays queued, with the offset into a partially sent
+    entry, until the socket is writable again.
+
+    Entries are shared bytes objects: a broadcast is encoded once and the
+    same object is queued for every recipient. Broadcasts are bounded; when
+    a client already has `limit` broadcasts waiting the slow-consumer
+    policy decides what happens to new ones:
+
+        drop        discard the new message
+        coalesce    replace the waiting broadcasts with a skip notice and keep the new message
+        disconnect  evict the client
+
+    `kinds` runs alongside `chunks` and marks the broadcast entries that may
+    still be dropped. The session's own output (write()) is never dropped
+    nor counted against the limit, and neither is a broadcast once part of
+    it was sent or it was turned into wire format. Instead the engines stop
+    reading a client whose `unsent` bytes pass OUTPUT_HIGH_WATER until
+    flush() brings them below OUTPUT_LOW_WATER and notifies `drained`.
+
+    Once MCCP2 is on, flush() deflates everything queued since the last
+    flush into one entry. The leading `ready` entries are already in wire
+    format (compressed, or queued before compression started).
+    """
+
+    def __init__(self, limit=None, policy=None):
+        self.limit = limit or SEND_QUEUE_LIMIT
+        self.policy = policy or SLOW_CONSUMER_POLICY
+        self.chunks = collections.deque()
+        self.kinds = collections.deque()  # True for each broadcast entry that may be dropped
+        self.broadcasts = 0  # True entries in kinds
+        self.size = 0    # Bytes in chunks
+        self.offset = 0  # Bytes of the head entry already sent
+        self.ready = 0   # Leading entries already in wire format
+        self.dropped = 0
+        self.compressor = None  # StreamCompressor once MCCP2 was negotiated
+        self.lock = threading.Lock()
+        self.drained = threading.Condition(self.lock)  # Notified when unsent falls to the low-water mark
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def unsent(self):
+        """Bytes queued and not yet accepted by the socket."""
+        return self.size - self.offset
+
+    def write(self, data):
+        """Queue the session's own output; it is never dropped."""
+        if data:
+            with self.lock:
+                self._append(data)
+
+    def _append(self, data, broadcast=False):
+        self.chunks.append(data)
+        self.kinds.append(broadcast)
+        self.size += len(data)
+
+    def put(self, data):
+        """Queue broadcast data; return False if the client should be disconnected."""
+        with self.lock:
+            if self.broadcasts >= self.limit:
+                if self.policy == 'disconnect':
+                    return False
+                if self.policy == 'coalesce':
+                    self._coalesce()
+                else:
+                    self.dropped += 1
+                    return True
+            self._put_broadcast(data)
+            return True
+
+    def _put_broadcast(self, data):
+        self._append(data, True)
+        self.broadcasts += 1
+
+    def _coalesce(self):
+        """Replace the waiting broadcasts with a skip notice; the session's own output stays."""
+        skipped = self.broadcasts
+        self.chunks = collections.deque(data for data, broadcast in zip(self.chunks, self.kinds)
+                                        if not broadcast)
+        self.kinds = collections.deque([False] * len(self.chunks))
+        self.size = sum(map(len, self.chunks))
+        self.broadcasts = 0
+        self.dropped += skipped
+        self._put_broadcast(f"[{skipped} messages skipped]\r\n".encode())
+
+    def _commit(self):
+        """Mark everything queued so far as wire format: it can no longer be dropped."""
+        self.ready = len(self.chunks)
+        self.kinds = collections.deque([False] * self.ready)
+        self.broadcasts = 0
+
+    def start_compression(self, compressor):
+        """Announce MCCP2 and compress everything queued after the announcement."""
+        with self.lock:
+            if self.compressor is not None:
+                return False
+            self._append(bytes([IAC, SB, COMPRESS2, IAC, SE]))
+            self._commit()
+            self.compressor = compressor
+            return True
+
+    def stop_compression(self):
+        """End the zlib stream; output queued afterwards goes out uncompressed."""
+        with self.lock:
+            if self.compressor is None or not self.compressor.active:
+                return
+            self._append(self.compressor.finish(self._take_pending()))
+            self._commit()
+
+    def _take_pending(self):
+        """Remove and join the entries queued after the wire-format ones."""
+        count = len(self.chunks) - self.ready
+        pending = [self.chunks.pop() for _ in range(count)]
+        for _ in range(count):
+            self.kinds.pop()
+        pending.reverse()
+        data = b''.join(pending)
+        self.size -= len(data)
+        return data
+
+    def flush(self, client_socket):
+        """Send as much queued data as the socket accepts without blocking.
+
+        Returns True once the buffer is empty.
+        """
+        with self.lock:
+            chunks = self.chunks
+            if self.compressor is not None and self.compressor.active and len(chunks) > self.ready:
+                self._append(self.compressor.compress(self._take_pending()))
+                self._commit()
+            while chunks:
+                buffers = [memoryview(chunks[0])[self.offset:]]
+                buffers.extend(itertools.islice(chunks, 1, MAX_IOV))
+                total = sum(map(len, buffers))
+                try:
+                    sent = client_socket.sendmsg(buffers, (), SEND_FLAGS)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                # Drop fully sent entries and remember how far into the next one we got
+                bytes_sent.inc(sent)
+                remaining = sent + self.offset
+                while chunks and remaining >= len(chunks[0]):
+                    remaining -= len(chunks[0])
+                    self.size -= len(chunks.popleft())
+                    if self.kinds.popleft():
+                        self.broadcasts -= 1
+                    if self.ready:
+                        self.ready -= 1
+                self.offset = remaining
+                if remaining and self.kinds[0]:
+                    # Partly sent: the rest must follow, so it is no longer droppable
+                    self.kinds[0] = False
+                    self.broadcasts -= 1
+                if self.size - self.offset <= OUTPUT_LOW_WATER:
+                    self.drained.notify_all()
+                if sent < total:
+                    return False
+            return True
+
+def watch_writable(client_socket):
+    """Have the output flusher finish sending a client's queue once writable."""
+    if not isinstance(client_socket, socket.socket):
+        return  # The asyncio engine resumes flushing from resume_writing
+    with write_selector_lock:
+        try:
+            write_selector.register(client_socket, selectors.EVENT_WRITE)
+        except (KeyError, ValueError):
+            pass  # Already watched or already closed
+
+def unwatch_writable(client_socket):
+    """Stop watching a client socket before it is closed."""
+    with write_selector_lock:
+        try:
+            write_selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+
+def flush_pending_output():
+    """Flush queued output for sockets that were too slow to take it at once."""
+    while running:
+        try:
+            events = write_selector.select(timeout=1.0)
+        except OSError:
+            time.sleep(0.1)  # A watched socket was closed under us
+            continue
+        for key, _ in events:
+            client_socket = key.fileobj
+            session = sessions.get(client_socket)
+            try:
+                if session is None or session.output.flush(client_socket):
+                    unwatch_writable(client_socket)
+            except socket.error:
+                unwatch_writable(client_socket)
+
+def evict_client(client_socket, reason, graceful=False):
+    """Forcibly disconnect a client; its session loop does the cleanup.
+
+    A graceful eviction lets output that is already buffered reach the client.
+    """
+    session = sessions.get(client_socket)
+    if session is None or session.closing:
+        return
+    session.closing = True
+    evictions.inc(1, (reason,))
+    eventlog.warning("Evicting client", addr=session.addr, username=session.username, reason=reason)
     try:
-        client_socket.send(bytes([IAC, command, option]))
-    except socket.error as e:
-        print(f"Error sending option to {clients[client_socket]['addr']}: {e}")
+        if graceful and isinstance(client_socket, AsyncioConnection):
+            client_socket.close()
+        else:
+            client_socket.shutdown(socket.SHUT_RDWR)
+    except (socket.error, AttributeError):
+        pass
+
+def queue_output(client_socket, data):
+    """Append data to the client's output buffer; flush_output sends it."""
+    session = sessions.get(client_socket)
+    if session is not None:
+        session.output.write(data)
+        if recorder is not None:
+            recorder.record(capture.OUTPUT, session.capture_id, len(data))
+
+def flush_output(client_socket):
+    """Write out everything buffered for a client, deferring what does not fit."""
+    session = sessions.get(client_socket)
+    if session is None:
+        return True
+    if session.output.flush(client_socket):
+        return True
+    watch_writable(client_socket)
+    return False
+
+def send_option(client_socket, command, option):
+    """Queue a Telnet option command."""
+    queue_output(client_socket, bytes([IAC, command, option]))
 
 def send_suboption(client_socket, option, data):
-    """Send a Telnet suboption."""
-    try:
-        client_socket.send(bytes([IAC, SB, option]) + data + bytes([IAC, SE]))
-    except socket.error as e:
-        print(f"Error sending suboption to {clients[client_socket]['addr']}: {e}")
+    """Queue a Telnet suboption."""
+    queue_output(client_socket, bytes([IAC, SB, option]) + data + bytes([IAC, SE]))
+
+def encode_message(message):
+    """Encode reply text for the wire with proper line endings."""
+    # Replace single \n with \r\n for proper Telnet line endings
+    return message.replace('\n', '\r\n').encode('utf-8', errors='replace')
+
+def send_data(client_socket, data):
+    """Queue an already encoded message to the client."""
+    if eventlog.log_messages and eventlog.enabled():
+        eventlog.debug("Sending message", rate_key='send', addr=sessions.get(client_socket).addr,
+                       bytes=len(data), content=data.decode('utf-8', errors='replace'))
+    queue_output(client_socket, data)
 
 def send_message(client_socket, message):
-    """Send a message to the client with proper line endings."""
-    try:
-        # Replace single \n with \r\n for proper Telnet line endings
-        message = message.replace('\n', '\r\n')
-        # Print full message to server log without truncation
-        if len(message) > 100:
-            print(f"Sending message to client ({len(message)} bytes): {message[:50]}...{message[-50:]}")
-        else:
-            print(f"Sending message to client ({len(message)} bytes): {message}")
-        client_socket.send(message.encode('utf-8', errors='replace'))
-    except socket.error as e:
-        print(f"Error sending message to {clients[client_socket]['addr']}: {e}")
+    """Queue a message to the client with proper line endings."""
+    send_data(client_socket, encode_message(message))
+
+def offer_option(client_socket, command, option):
+    """Ask for an option on our own and time the reply."""
+    session = sessions.get(client_socket)
+    if not session.options.request(command, option):
+        return  # Already in that state, or already asked for
+    if session.offers is None:
+        session.offers = {}
+    session.offers[command, option] = time.perf_counter()
+
+def handle_negotiation(client_socket, command, option):
+    """Apply one DO/DONT/WILL/WONT from the client through its option table."""
+    session = sessions.get(client_socket)
+    option_name = OPTION_NAMES.get(option, str(option))
+    iac_commands.inc(1, (COMMAND_NAMES[command], option_name))
+    offer = (WILL if command in (DO, DONT) else DO, option)
+    if session.offers and offer in session.offers:
+        negotiation_seconds.observe(time.perf_counter() - session.offers.pop(offer), (option_name,))
+        if not session.offers:
+            # The last answer to the opening burst: negotiation took this long in all
+            negotiation_settled_seconds.observe(time.perf_counter() - session.negotiation_started)
+    session.options.receive(command, option)
+
+def start_negotiation(client_socket):
+    """Queue every option the server wants as one burst at connect.
+
+    It goes out in the same write as the greeting and login prompt, and a
+    client doing the same has its offers taken as the answers, so the
+    session is set up after one round trip however many options there are.
+    """
+    sessions.get(client_socket).negotiation_started = time.perf_counter()
+    for verb, option in NEGOTIATE:
+        offer_option(client_socket, verb, option)
+    if COMPRESSION:
+        offer_option(client_socket, WILL, COMPRESS2)
+
+def compression_changed(client_socket, side, enabled):
+    """MCCP2: compress everything we send while the client has agreed to it."""
+    output = sessions.get(client_socket).output
+    if enabled:
+        output.start_compression(StreamCompressor(COMPRESSION_LEVEL, COMPRESSION_FLUSH))
+    else:
+        output.stop_compression()
+
+def terminal_type_changed(client_socket, side, enabled):
+    """Ask for the client's terminal type once it agrees to send it."""
+    if side == REMOTE and enabled:
+        send_suboption(client_socket, TERMINAL_TYPE, TTYPE_SEND)
+
+def terminal_type_received(client_socket, payload):
+    """TERMINAL-TYPE subnegotiation: answer SEND, log IS."""
+    if payload[:1] == TTYPE_SEND:
+        send_suboption(client_socket, TERMINAL_TYPE, TTYPE_IS + b'VT100')
+    elif payload[:1] == TTYPE_IS:
+        session = sessions.get(client_socket)
+        eventlog.debug("Terminal type", rate_key='ttype', addr=session.addr,
+                       terminal=payload[1:].decode('ascii', errors='replace'))
+
+def window_size_received(client_socket, payload):
+    """NAWS subnegotiation: remember the client's window size."""
+    if len(payload) < 4:
+        return
+    width = (payload[0] << 8) + payload[1]
+    height = (payload[2] << 8) + payload[3]
+
+    # Only log if window size actually changed
+    session = sessions.get(client_socket)
+    if session.window_size != (width, height):
+        eventlog.debug("Window size changed", rate_key='naws', addr=session.addr,
+                       width=width, height=height)
+
+    session.window_size = (width, height)
+
+# Telnet options the server agrees to: local ones it performs itself when the
+# client asks, remote ones it lets the client perform
+telnet_options = OptionRegistry(send_option)
+telnet_options.register(ECHO, remote=True)
+telnet_options.register(SUPPRESS_GO_AHEAD, local=True, remote=True)
+telnet_options.register(BINARY, local=True, remote=True)
+telnet_options.register(TERMINAL_TYPE, local=True, remote=True, on_change=terminal_type_changed,
+                        on_subnegotiation=terminal_type_received)
+telnet_options.register(NAWS, local=True, remote=True, on_subnegotiation=window_size_received)
+telnet_options.register(COMPRESS2, local=lambda: COMPRESSION, on_change=compression_changed)
 
 def process_telnet_command(client_socket, data):
     """Process Telnet IAC commands and return filtered data."""
-    result = bytearray()
-    i = 0
-    while i < len(data):
-        if data[i] == IAC:
-            if i + 1 >= len(data):
-                break
-            if data[i + 1] == IAC:
-                result.append(data[i])
-                i += 2
-            elif data[i + 1] in (DO, DONT, WILL, WONT):
-                if i + 2 >= len(data):
-                    break
-                option = data[i + 2]
-                if data[i + 1] == DO:
-                    if option == ECHO:
-                        send_option(client_socket, WONT, ECHO)  # Server controls echo
-                    elif option == SUPPRESS_GO_AHEAD:
-                        send_option(client_socket, WILL, SUPPRESS_GO_AHEAD)
-                        clients[client_socket]['options']['suppress_go_ahead'] = True
-                    elif option == TERMINAL_TYPE:
-                        send_option(client_socket, WILL, TERMINAL_TYPE)
-                    elif option == NAWS:
-                        send_option(client_socket, WILL, NAWS)
-                    elif option == BINARY:
-                        send_option(client_socket, WILL, BINARY)
-                        clients[client_socket]['options']['binary'] = True
-                elif data[i + 1] == WILL:
-                    if option == ECHO:
-                        send_option(client_socket, DO, ECHO)
-                        clients[client_socket]['options']['echo'] = True
-                    elif option in (SUPPRESS_GO_AHEAD, TERMINAL_TYPE, NAWS):
-                        send_option(client_socket, DO, option)
-                    elif option == BINARY:
-                        send_option(client_socket, DO, BINARY)
-                        clients[client_socket]['options']['binary'] = True
-                elif data[i + 1] == WONT:
-                    if option == BINARY:
-                        clients[client_socket]['options']['binary'] = False
-                elif data[i + 1] == DONT:
-                    if option == BINARY:
-                        clients[client_socket]['options']['binary'] = False
-                i += 3
-            elif data[i + 1] == SB:
-                j = i + 2
-                while j < len(data) and not (data[j] == IAC and j + 1 < len(data) and data[j + 1] == SE):
-                    j += 1
-                if j + 1 < len(data):
-                    suboption = data[i + 2:j]
-                    if suboption[0] == TERMINAL_TYPE and suboption[1] == 1:
-                        send_suboption(client_socket, TERMINAL_TYPE, b'\x00' + b'VT100')
-                    elif suboption[0] == NAWS and len(suboption) >= 5:
-                        width = (suboption[1] << 8) + suboption[2]
-                        height = (suboption[3] << 8) + suboption[4]
-                        
-                        # Only print if window size actually changed
-                        if 'window_size' not in clients[client_socket] or clients[client_socket]['window_size'] != (width, height):
-                            print(f"Client {clients[client_socket]['addr']} window size: {width}x{height}")
-                        
-                        clients[client_socket]['window_size'] = (width, height)
-                    i = j + 2
-                else:
-                    break
-            else:
-                i += 2
-        else:
-            result.append(data[i])
-            i += 1
-    return bytes(result)
-
-def authenticate_user(username, password):
-    """Authenticate user with username and password."""
-    print(f"Auth attempt: username='{username}', password='{password}'")
-    if username in users:
-        if password == users[username]:
-            print(f"Authentication successful for '{username}'")
-            return True
-        else:
-            print(f"Invalid password for '{username}'")
+    bytes_received.inc(len(data))
+    session = sessions.get(client_socket)
+    if recorder is not None:
+        recorder.record(capture.DATA, session.capture_id, data)
+    return session.parser.feed(data)
+
+def setup_authentication(path=None, workers=AUTH_WORKERS):
+    """Open the credential store and start the password verification pool."""
+    global authenticator
+    store = open_store(path) if path else MemoryCredentialStore(users)
+    authenticator = Authenticator(store, workers=workers)
+    return authenticator
+
+def log_auth_result(username, ip, result, error=None):
+    """Log the outcome of one login attempt (never the password)."""
+    auth_results.inc(1, (result,))
+    if result == AUTH_ERROR:
+        eventlog.error("Password verification failed", rate_key='auth_error', username=username, ip=ip,
+                       error=error)
+    elif result == AUTH_OK:
+        eventlog.info("Authentication successful", rate_key='auth', username=username, ip=ip)
+    elif result == AUTH_THROTTLED:
+        eventlog.warning("Authentication throttled", rate_key='auth_fail', username=username, ip=ip)
+    elif result == AUTH_BUSY:
+        eventlog.warning("Authentication refused, verification queue full", rate_key='auth_busy',
+                         username=username, ip=ip)
     else:
-        print(f"Username '{username}' not found")
-    return False
+        eventlog.warning("Authentication failed", rate_key='auth_fail', username=username, ip=ip)
 
-def handle_command(client_socket, command):
-    """Handle commands from authenticated users."""
-    username = clients[client_socket]['username']
+def check_login(username, password, ip=None):
+    """Start verifying a login in the auth pool; returns a Future with the result.
+
+    The Future never raises: if verification itself fails (credential store
+    error, pool shut down during a reload) it is logged and the result is
+    AUTH_ERROR, so callbacks always get to finish the login.
+    """
+    if authenticator is None:
+        setup_authentication(CREDENTIALS_PATH)
+    outcome = concurrent.futures.Future()
+    try:
+        future = authenticator.submit(username, password, ip)
+    except RuntimeError as e:  # Pool already shut down
+        future = concurrent.futures.Future()
+        future.set_exception(e)
+
+    def verified(f):
+        if f.cancelled():
+            result, error = AUTH_ERROR, "verification cancelled"
+        elif f.exception() is not None:
+            result, error = AUTH_ERROR, f.exception()
+        else:
+            result, error = f.result(), None
+        log_auth_result(username, ip, result, error)
+        outcome.set_result(result)
+
+    future.add_done_callback(verified)
+    return outcome
+
+def authenticate_user(username, password, ip=None):
+    """Authenticate user with username and password (blocks until verified)."""
+    return check_login(username, password, ip).result() == AUTH_OK
+
+def help_topic(args):
+    """Cache help by the command asked about, however it was spelled; unknown topics raise."""
+    return registry.help_topic(args[0] if args else None)
+
+@command('help', usage="help [command]", help="Show this help message, or help for one command",
+         max_args=1, cache=CACHE_FOREVER, cache_key=help_topic)
+def command_help(session, args):
+    return registry.help_text(args[0] if args else None)
+
+@command('whoami', help="Display your username", max_args=0)
+def command_whoami(session, args):
+    client_ip, client_port = session.addr
+    message = f"You are logged in as: {session.username}\n"
+    message += f"Connected from: {client_ip}:{client_port}\n"
+    return message
+
+@command('users', help="List connected users", max_args=0)
+def command_users(session, args):
+    connected = connected_users()
+    message = f"Connected users ({len(connected)}):\n"
+    for user, addr in sorted(connected):
+        marker = " (you)" if user == session.username else ""
+        message += f"  {user} from {addr[0]}:{addr[1]}{marker}\n"
+    return message
+
+@command('uptime', help="Show system uptime", max_args=0, cache=1.0)
+def command_uptime(session, args):
+    try:
+        with open('/proc/uptime', 'r') as f:
+            uptime_seconds = float(f.readline().split()[0])
+            days = int(uptime_seconds / 86400)
+            hours = int((uptime_seconds % 86400) / 3600)
+            minutes = int((uptime_seconds % 3600) / 60)
+            return f"System uptime: {days} days, {hours} hours, {minutes} minutes\n"
+    except:
+        return "System uptime information not available\n"
+
+@command('date', help="Show current date and time", max_args=0, cache=1.0)
+def command_date(session, args):
+    return f"Current date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+
+@command('hostname', help="Show system hostname", max_args=0, cache=300.0)
+def command_hostname(session, args):
+    try:
+        return f"Hostname: {socket.gethostname()}\n"
+    except:
+        return "Hostname information not available\n"
+
+@command('echo', usage="echo [msg]", help="Echo a message", raw=True)
+def command_echo(session, args):
+    return args + "\n"
+
+@command('say', aliases=('broadcast',), usage="say [msg]", help="Send a message to all users", raw=True)
+def command_say(session, args):
+    if not args:
+        raise CommandError("Usage: say [msg]")
+    message_queue.put((None, f"[{session.username}] {args}\n", session.sock))
+    return None
+
+@command('join', usage="join #channel", help="Subscribe to a channel and show its recent messages",
+         min_args=1, max_args=1)
+def command_join(session, args):
+    name = channel_name(args[0])
+    if name is None:
+        raise CommandError("Usage: join #channel (letters, digits, - and _)")
+    history = channels.join(name, session)
+    if history is None:
+        raise CommandError(f"Cannot join #{name}: too many channels")
+    message = f"Joined #{name}\n"
+    if history:
+        message += f"Last {len(history)} messages:\n" + "".join(history)
+    return message
+
+@command('leave', usage="leave #channel", help="Unsubscribe from a channel", min_args=1, max_args=1)
+def command_leave(session, args):
+    name = channel_name(args[0])
+    if name is None or not channels.leave(name, session):
+        raise CommandError(f"You are not in {args[0]}")
+    return f"Left #{name}\n"
+
+@command('publish', aliases=('pub',), usage="publish #channel msg", help="Send a message to a channel",
+         raw=True)
+def command_publish(session, args):
+    target, _, text = args.partition(' ')
+    name = channel_name(target)
+    text = text.strip()
+    if name is None or not text:
+        raise CommandError("Usage: publish #channel msg")
+    message_queue.put((name, f"[#{name}] {session.username}: {text}\n", session.sock))
+    return None
+
+@command('channels', help="List channels and their subscriber counts", max_args=0)
+def command_channels(session, args):
+    listing = channels.listing()
+    if not listing:
+        return "No channels\n"
+    joined = session.channels or ()
+    message = f"Channels ({len(listing)}):\n"
+    for name, count in listing:
+        marker = " (joined)" if name in joined else ""
+        message += f"  #{name} - {count} subscribers{marker}\n"
+    return message
+
+@command('stats', help="Show server statistics", max_args=0, admin=True)
+def command_stats(session, args):
+    return "Server statistics:\n" + metrics.summary()
+
+@command('profile', usage="profile [start|stop|status]", help="Toggle request path profiling",
+         max_args=1, admin=True)
+def command_profile(session, args):
+    action = args[0].lower() if args else 'status'
+    if action == 'start':
+        if not start_profiling():
+            return "Profiling is already running\n"
+        return f"Profiling started; 'profile stop' writes the stacks to {profiler.directory}\n"
+    if action == 'stop':
+        path = stop_profiling()
+        if path is None:
+            return "Profiling is not running\n"
+        return f"Profiling stopped, stacks written to {path}\nPhase timings:\n{profiler.phase_summary()}"
+    if action == 'status':
+        if not profiler.running:
+            return "Profiling is off\n"
+        elapsed = time.time() - profiler.started
+        return (f"Profiling for {elapsed:.0f}s, {profiler.samples} samples\n"
+                f"Phase timings:\n{profiler.phase_summary()}")
+    raise CommandError("Usage: profile [start|stop|status]")
+
+@command('exit', aliases=('logout',), help="Disconnect from the server", disconnect=True)
+def command_exit(session, args):
+    return "Goodbye!\n"
+
+def disconnect_client(client_socket):
+    """Flush pending output, forget the session and close its socket."""
+    session = sessions.get(client_socket)
+    eventlog.info("User disconnecting", addr=session.addr, username=session.username)
     
-    # Simple command handler
-    command = command.strip()
-    print(f"\n{'*'*20} COMMAND RECEIVED {'*'*20}")
-    print(f"USER: {username}")
-    print(f"COMMAND: '{command}'")
-    print(f"IP: {clients[client_socket]['addr'][0]}")
-    print(f"PORT: {clients[client_socket]['addr'][1]}")
-    print(f"{'*'*55}\n")
+    # First send whatever is still buffered (the goodbye message)
+    try:
+        flush_output(client_socket)
+    except:
+        pass
     
-    if command.lower() == 'exit' or command.lower() == 'logout':
-        print(f"\n{'#'*50}")
-        print(f"USER DISCONNECTING: {username} from {clients[client_socket]['addr']}")
-        print(f"{'#'*50}\n")
-        
-        # First remove from data structures
-        with lock:
-            if username in active_users:
-                del active_users[username]
-            if client_socket in clients:
-                del clients[client_socket]
-        
-        # Then send goodbye message
-        try:
-            send_message(client_socket, "Goodbye!\n")
-        except:
-            pass
-        
-        # Finally close the socket
-        try:
-            client_socket.close()
-            print(f"Socket closed successfully")
-        except:
-            pass
-        
-        return False  # Signal to close connection in main loop
+    # Then remove from data structures
+    unregister_client(client_socket)
     
-    elif command.lower() == 'help':
-        help_text = """
-Available commands:
-  help       - Show this help message
-  whoami     - Display your username
-  users      - List connected users
-  uptime     - Show system uptime
-  date       - Show current date and time
-  hostname   - Show system hostname
-  echo [msg] - Echo a message
-  exit       - Disconnect from the server
-  logout     - Same as exit
-"""
-        print(f"\nCOMMAND RESULT [help]: sending help text ({len(help_text)} bytes)\n")
-        send_message(client_socket, help_text)
+    # Finally close the socket
+    try:
+        client_socket.close()
+    except:
+        pass
+
+def handle_command(client_socket, command):
+    """Handle commands from authenticated users."""
+    session = sessions.get(client_socket)
+    username = session.username
     
-    elif command.lower() == 'whoami':
-        client_ip, client_port = clients[client_socket]['addr']
-        message = f"You are logged in as: {username}\n"
-        message += f"Connected from: {client_ip}:{client_port}\n"
-        print(f"\nCOMMAND RESULT [whoami]: {message.strip()}\n")
+    # Table-driven dispatch: one dict lookup on the verb
+    command = command.strip()
+    spec, verb, text = registry.split(command)
+    if eventlog.enabled():
+        eventlog.debug("Command received", rate_key='command', addr=session.addr, username=username,
+                       command=command if eventlog.log_messages else verb.lower())
+    if spec is None:
+        unknown_commands.inc()
+        message = f"Unknown command: {command}\n"
         send_message(client_socket, message)
+        return True
+    if spec.admin and username not in ADMIN_USERS:
+        send_message(client_socket, f"Permission denied: {spec.name} is for administrators\n")
+        return True
     
-    elif command.lower() == 'users':
-        print(f"\n{'='*50}")
-        print(f"USERS COMMAND from {username} at {clients[client_socket]['addr']}")
-        print(f"{'='*50}")
-        
-        # IMPORTANT: No locks used at all in this implementation to avoid hanging
-        
-        # Simple solution - just show the current user's information
-        # This avoids any potential issues with locks
-        current_ip, current_port = clients[client_socket]['addr']
-        
-        # Create a simple response that always works
-        message = f"You are connected as: {username} from {current_ip}:{current_port}\n"
-        message += "To see other users, check the server logs.\n"
-        
-        # Server-side log (no locks) - create a safe copy of client keys first
-        # to avoid dictionary changed during iteration errors
-        print("\n*** CONNECTED USERS LIST START ***")
-        try:
-            # Get a copy of client keys to safely iterate
-            client_sockets = list(clients.keys())
-            connected_count = 0
-            
-            for s in client_sockets:
-                try:
-                    if s in clients and 'username' in clients[s] and clients[s]['username'] and 'addr' in clients[s]:
-                        user = clients[s]['username']
-                        addr = clients[s]['addr']
-                        print(f"  USER: {user} | CONNECTION: {addr[0]}:{addr[1]}")
-                        connected_count += 1
-                except Exception as e:
-                    print(f"  Error processing client: {e}")
-            
-            if connected_count == 0:
-                print("  NO AUTHENTICATED USERS CONNECTED")
-            else:
-                print(f"  TOTAL USERS CONNECTED: {connected_count}")
-            
-        except Exception as e:
-            print(f"  ERROR LISTING USERS: {e}")
-        
-        print("*** CONNECTED USERS LIST END ***\n")
-        
-        # Send the response to client
-        print(f"Sending users response to client")
-        send_message(client_socket, message)
-        print(f"Users command completed successfully")
+    started = time.perf_counter()
+    try:
+        data = command_reply(spec, session, text)
+    except CommandError as e:
+        data = encode_message(f"{e}\n")
+    command_seconds.observe(time.perf_counter() - started, (spec.name,))
+    if data:
+        send_data(client_socket, data)
     
-    elif command.lower() == 'uptime':
+    if spec.disconnect:
+        disconnect_client(client_socket)
+        return False  # Signal to close connection in main loop
+    return True  # Continue connection
+
+def command_reply(spec, session, text):
+    """Run a command and return its reply encoded for the wire (or None).
+
+    Replies of commands registered with cache=SECONDS are reused from the
+    registry's response cache until they expire, skipping both the handler
+    and the encoding.
+    """
+    if spec.cache is None:
+        message = spec.run(session, text)
+        return encode_message(message) if message else None
+    # Bad arguments raise CommandError here, so their replies are never cached
+    args = spec.parse(text)
+    key = spec.key(args)
+    data = registry.cache.get(key)
+    if data is not None:
+        cache_lookups.inc(1, ('hit',))
+        return data
+    cache_lookups.inc(1, ('miss',))
+    message = spec.handler(session, args)
+    data = encode_message(message) if message else b''
+    registry.cache.put(key, data, spec.cache)
+    return data
+
+# Line terminators: CR LF, CR NUL or a bare LF. A CR at the very end of the
+# input stays buffered because its LF or NUL may arrive with the next read.
+LINE_END = re.compile(rb'\r\n|\r\0|\r(?=[^\n\0])|\n')
+
+def process_input(client_socket, data):
+    """Split received text into lines and run each through the session state machine.
+
+    Complete lines are handed over as memoryview slices of the received
+    data, so a read holding many pipelined lines is framed without copying
+    it; only an incomplete last line is kept in the session buffer for the
+    next read. Returns False once the session has ended.
+    """
+    session = sessions.get(client_socket)
+    if session is None:
+        return False
+    buffer = session.buffer
+    if session.auth_pending:
+        # Lines after the password wait until it has been verified
+        buffer += data
+        if len(buffer) > MAX_PENDING_INPUT:
+            evict_client(client_socket, "too much input while logging in")
+            return False
+        return True
+    if buffer:
+        buffer += data
+        text = buffer
+    else:
+        text = data
+
+    start = 0
+    with memoryview(text) as view:
+        while True:
+            match = LINE_END.search(text, start)
+            if match is None:
+                break
+            line = view[start:match.start()]
+            start = match.end()
+            try:
+                if session.discarding:
+                    session.discarding = False  # Rest of an overlong line
+                elif len(line) > MAX_LINE_LENGTH:
+                    reject_long_line(client_socket, session)
+                elif not handle_line(client_socket, session, line):
+                    break
+            finally:
+                line.release()
+
+    if sessions.get(client_socket) is not session or session.closing:
+        return False
+    # Keep whatever was not consumed for the next read
+    if text is buffer:
+        del buffer[:start]
+    elif start < len(text):
+        buffer += text[start:]
+    if len(buffer) > MAX_LINE_LENGTH and not session.auth_pending:
+        buffer.clear()
+        session.discarding = True
+        reject_long_line(client_socket, session)
+    return True
+
+def reject_long_line(client_socket, session):
+    """Tell the client its line was dropped for being too long."""
+    send_message(client_socket, f"Line too long (maximum {MAX_LINE_LENGTH} bytes)\n")
+    send_prompt(client_socket, session)
+
+def send_prompt(client_socket, session):
+    """Queue the prompt for the session's current state."""
+    queue_output(client_socket, session.prompt.encode())
+
+def handle_line(client_socket, session, line):
+    """Advance the login/password/command state machine by one input line.
+
+    Returns False when processing of further lines has to stop: the session
+    ended, or (asyncio engine) its password is being verified.
+    """
+    text = str(line, 'utf-8', 'replace')
+    if session.state == STATE_COMMAND:
+        if text.strip():
+            if not handle_command(client_socket, text):
+                return False
+        send_prompt(client_socket, session)
+        return True
+
+    if session.state == STATE_LOGIN:
+        username = text.strip()
+        if username:
+            session.login_name = username
+            session.state = STATE_PASSWORD
+            session.prompt = PASSWORD_PROMPT
+        send_prompt(client_socket, session)
+        return True
+
+    # STATE_PASSWORD
+    future = check_login(session.login_name, text, session.ip)
+    if isinstance(client_socket, AsyncioConnection):
+        # Never block the event loop on a password hash
+        session.auth_pending = True
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(
+            lambda f: loop.call_soon_threadsafe(client_socket.login_done, f.result()))
+        return False
+    return finish_login(client_socket, session, future.result())
+
+def finish_login(client_socket, session, result):
+    """Act on a verified password; returns False if the session was closed."""
+    username = session.login_name
+    session.login_name = None
+    if result == AUTH_OK:
+        if claim_user(username, client_socket):
+            session.state = STATE_COMMAND
+            session.prompt = COMMAND_PROMPT
+            session.login_attempts = 0
+            touch_client(client_socket)  # Logged in sessions get the longer idle timeout
+            send_message(client_socket, f"\nWelcome, {username}! Type 'help' for a list of commands.\n")
+            send_prompt(client_socket, session)
+            return True
+        send_message(client_socket, f"User {username} is already logged in\n")
+    elif result == AUTH_THROTTLED:
+        send_message(client_socket, "Too many failed login attempts, try again later\n")
+        connections_rejected.inc(1, ('login throttled',))
+        disconnect_client(client_socket)
+        return False
+    elif result == AUTH_BUSY:
+        send_message(client_socket, "Server busy, try again later\n")
+        connections_rejected.inc(1, ('login busy',))
+        disconnect_client(client_socket)
+        return False
+    elif result == AUTH_ERROR:
+        send_message(client_socket, "Could not verify the password, try again later\n")
+        connections_rejected.inc(1, ('login error',))
+        disconnect_client(client_socket)
+        return False
+    else:
+        send_message(client_socket, "Login incorrect\n")
+
+    session.login_attempts += 1
+    if session.login_attempts >= MAX_LOGIN_ATTEMPTS:
+        send_message(client_socket, "Too many failed login attempts\n")
+        connections_rejected.inc(1, ('login attempts',))
+        disconnect_client(client_socket)
+        return False
+    session.state = STATE_LOGIN
+    session.prompt = LOGIN_PROMPT
+    send_prompt(client_socket, session)
+    return True
+
+# Idle deadlines for every session
+idle_timers = TimerWheel(tick=REAPER_TICK)
+
+def session_timeout(session):
+    """Idle timeout that applies to a session in its current state."""
+    return TIMEOUT if session.state == STATE_COMMAND else LOGIN_TIMEOUT
+
+def touch_client(client_socket):
+    """Record real activity from a client and push its idle deadline back."""
+    session = sessions.get(client_socket)
+    if session is not None:
+        session.last_activity = time.time()
+        idle_timers.schedule(client_socket, session_timeout(session))
+
+def reap_idle_sessions():
+    """Say goodbye to and disconnect every session whose idle deadline passed."""
+    for client_socket in idle_timers.advance():
+        session = sessions.get(client_socket)
+        if session is None or session.closing:
+            continue
+        send_message(client_socket, "Idle timeout, goodbye!\n")
         try:
-            with open('/proc/uptime', 'r') as f:
-                uptime_seconds = float(f.readline().split()[0])
-                days = int(uptime_seconds / 86400)
-                hours = int((uptime_seconds % 86400) / 3600)
-                minutes = int((uptime_seconds % 3600) / 60)
-                message = f"System uptime: {days} days, {hours} hours, {minutes} minutes\n"
-        except:
-            message = f"System uptime information not available\n"
-        print(f"\nCOMMAND RESULT [uptime]: {message.strip()}\n")
-        send_message(client_socket, message)
-    
-    elif command.lower() == 'date':
-        message = f"Current date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        print(f"\nCOMMAND RESULT [date]: {message.strip()}\n")
-        send_message(client_socket, message)
-    
-    elif command.lower() == 'hostname':
+            flush_output(client_socket)
+        except socket.error:
+            pass
+        evict_client(client_socket, "idle timeout", graceful=True)
+
+def run_idle_reaper():
+    """Expire idle sessions once per wheel tick (threaded engine)."""
+    while running:
+        time.sleep(REAPER_TICK)
+        reap_idle_sessions()
+
+async def run_idle_reaper_async():
+    """Expire idle sessions once per wheel tick (asyncio engine)."""
+    while running:
+        await asyncio.sleep(REAPER_TICK)
+        reap_idle_sessions()
+
+def register_client(client_socket, client_address):
+    """Create the state entry for a newly accepted connection."""
+    eventlog.info("New connection", rate_key='connect', addr=client_address)
+    connections_accepted.inc()
+    options = OptionTable(telnet_options, client_socket)
+    session = Session(
+        client_socket, client_address,
+        output=OutputBuffer(),
+        parser=TelnetParser(
+            on_negotiate=functools.partial(handle_negotiation, client_socket),
+            on_subnegotiation=options.subnegotiation),
+        options=options)
+    if recorder is not None:
+        session.capture_id = next(capture_ids)
+        recorder.record(capture.OPEN, session.capture_id, f"{client_address[0]}:{client_address[1]}".encode())
+    sessions.add(session)
+    touch_client(client_socket)
+
+def unregister_client(client_socket):
+    """Forget a closed connection in every server table."""
+    idle_timers.cancel(client_socket)
+    unwatch_writable(client_socket)
+    session = sessions.remove(client_socket)
+    if session is None:
+        return
+    if recorder is not None:
+        recorder.record(capture.CLOSE, session.capture_id)
+    channels.leave_all(session)
+    if session.username and cluster is not None:
+        cluster.release(session.username)
+    if session.output.compressor is not None:
+        record_compression(session)
+
+def record_compression(session):
+    """Add a closed session's MCCP2 figures to the totals and log them."""
+    compressor = session.output.compressor
+    compression_totals['sessions'] += 1
+    compression_totals['raw_bytes'] += compressor.raw_bytes
+    compression_totals['wire_bytes'] += compressor.wire_bytes
+    compression_totals['cpu_seconds'] += compressor.cpu_seconds
+    if eventlog.enabled():
+        eventlog.debug("Compression", rate_key='compression', addr=session.addr,
+                       **compression_figures(compressor.raw_bytes, compressor.wire_bytes,
+                                             compressor.cpu_seconds))
+
+def compression_figures(raw_bytes, wire_bytes, cpu_seconds):
+    """Bytes saved by compression and what they cost in CPU time."""
+    megabytes = raw_bytes / 1048576
+    return {
+        'raw_bytes': raw_bytes,
+        'wire_bytes': wire_bytes,
+        'ratio': round(wire_bytes / raw_bytes, 3) if raw_bytes else None,
+        'cpu_ms_per_mb': round(cpu_seconds * 1000 / megabytes, 2) if megabytes else None,
+    }
+
+def start_capture(path):
+    """Record every session's input to path (see capture.py and replay.py)."""
+    global recorder
+    try:
+        recorder = capture.CaptureWriter(path)
+    except OSError as e:
+        eventlog.error("Could not open capture file", path=path, error=e)
+        return
+    eventlog.warning("Capturing client input", path=path)
+
+def stop_capture():
+    """Write out what is still buffered and close the capture file."""
+    global recorder
+    if recorder is None:
+        return
+    writer, recorder = recorder, None
+    writer.close()
+    eventlog.info("Capture closed", path=writer.path, records=writer.records)
+
+def log_compression_totals():
+    """Log the compression totals of every session closed so far."""
+    if compression_totals['sessions']:
+        eventlog.info("Compression totals", sessions=compression_totals['sessions'],
+                      **compression_figures(compression_totals['raw_bytes'],
+                                            compression_totals['wire_bytes'],
+                                            compression_totals['cpu_seconds']))
+
+def claim_user(username, client_socket):
+    """Log a session in as username; False if the user is already logged in (on any worker)."""
+    session = sessions.get(client_socket)
+    if session is None or not sessions.claim_username(session, username):
+        return False
+    if cluster is not None and cluster.claim(username, session.addr) is False:
+        sessions.release_username(session)
+        return False
+    return True
+
+def connected_users():
+    """[(username, addr), ...] for every logged in session, across workers."""
+    if cluster is not None:
+        listing = cluster.users()
+        if listing is not None:
+            return listing
+    return sessions.logged_in()
+
+def welcome_message(client_address):
+    """Build the greeting sent to every new connection."""
+    return f"Welcome to the Telnet server! Connected from {client_address}\r\n".encode()
+
+def refuse_connection(client_socket, client_address, reason):
+    """Tell a connection that was not admitted the server is busy and drop it."""
+    connections_rejected.inc(1, (reason,))
+    eventlog.warning("Connection refused", rate_key='refuse', addr=client_address, reason=reason)
+    try:
+        client_socket.send(BUSY_MESSAGE, socket.MSG_DONTWAIT)
+    except OSError:
+        pass
+    client_socket.close()
+
+def accept_connections(server_socket):
+    """Accept up to ACCEPT_BATCH waiting connections and start a thread for each admitted one."""
+    for _ in range(ACCEPT_BATCH):
         try:
-            message = f"Hostname: {socket.gethostname()}\n"
-        except:
-            message = "Hostname information not available\n"
-        print(f"\nCOMMAND RESULT [hostname]: {message.strip()}\n")
-        send_message(client_socket, message)
-    
-    elif command.lower().startswith('echo '):
-        message = command[5:] + "\n"  # Remove 'echo ' prefix
-        print(f"\nCOMMAND RESULT [echo]: {message.strip()}\n")
-        send_message(client_socket, message)
-    
-    else:
-        message = f"Unknown command: {command}\n"
-        print(f"Unknown command: {message.strip()}")
-        send_message(client_socket, message)
-    
-    return True  # Continue connection
+            client_socket, client_address = server_socket.accept()
+        except BlockingIOError:
+            return
+        except ConnectionAbortedError:
+            continue
+        except OSError as e:
+            if e.errno not in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                raise
+            # Out of descriptors or memory: leave the rest in the backlog while sessions close
+            eventlog.error("Cannot accept connections", rate_key='accept_error', error=e)
+            time.sleep(0.1)
+            return
+        reason = admission_control.admit(client_address[0])
+        if reason is not None:
+            refuse_connection(client_socket, client_address, reason)
+            continue
+        # Output is already coalesced per pass; don't let Nagle hold back the last segment
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Registered here so the next admit() in this batch counts it
+        register_client(client_socket, client_address)
+        client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
+        client_thread.daemon = True
+        try:
+            client_thread.start()
+        except RuntimeError as e:
+            eventlog.error("Cannot start a session thread", rate_key='thread_error', error=e)
+            unregister_client(client_socket)
+            refuse_connection(client_socket, client_address, admission.REJECT_FULL)
+
+def wait_for_output_room(client_socket):
+    """Stop reading a client (threaded engine) while its unsent output is above the high-water mark.
+
+    Blocks until the output flusher has sent it down to the low-water mark,
+    so a client that does not read its replies is slowed to the pace it
+    reads them. Returns False if the session ended while waiting.
+    """
+    session = sessions.get(client_socket)
+    if session is None:
+        return False
+    output = session.output
+    with output.lock:
+        if output.unsent <= OUTPUT_HIGH_WATER:
+            return True
+        while output.unsent > OUTPUT_LOW_WATER:
+            if not running or session.closing or sessions.get(client_socket) is not session:
+                return False
+            output.drained.wait(1.0)
+    return True
 
 def handle_client(client_socket, client_address):
     """Handle individual client connections and communication."""
-    print(f"New connection from {client_address}")
-    clients[client_socket] = {
-        'addr': client_address,
-        'buffer': b'',
-        'last_activity': time.time(),
-        'options': {},
-        'state': STATE_LOGIN,
-        'username': None,
-        'prompt': 'login: ',
-        'window_size': (80, 24)
-    }
-
     try:
-        # Send welcome message
-        welcome_msg = f"Welcome to the Telnet server! Connected from {client_address}\r\n"
-        client_socket.send(welcome_msg.encode())
+        # Offer options, then greet the client and ask it to log in
+        start_negotiation(client_socket)
+        queue_output(client_socket, welcome_message(client_address))
+        send_prompt(client_socket, sessions.get(client_socket))
+        flush_output(client_socket)
 
         while running:
             try:
-                data = client_socket.recv(BUFFER_SIZE)
+                data = receive(client_socket, BUFFER_SIZE)
                 if not data:
                     break
+                touch_client(client_socket)
 
-                # Process received data
+                # Process received data line by line
                 processed_data = process_telnet_command(client_socket, data)
-                if processed_data:
-                    # Broadcast message to all clients
-                    message = f"Client {client_address}: {processed_data.decode()}"
-                    message_queue.put(message)
+                if processed_data and not process_input(client_socket, processed_data):
+                    break
+
+                # Send everything this pass produced in one write
+                flush_output(client_socket)
+                if not wait_for_output_room(client_socket):
+                    break
 
             except socket.error as e:
-                print(f"Socket error with {client_address}: {e}")
+                eventlog.debug("Socket error", rate_key='socket_error', addr=client_address, error=e)
                 break
 
     except Exception as e:
-        print(f"Error handling client {client_address}: {e}")
+        eventlog.error("Error handling client", rate_key='client_error', addr=client_address, error=e)
     finally:
         # Clean up client connection
+        unregister_client(client_socket)
         client_socket.close()
-        del clients[client_socket]
-        print(f"Connection closed for {client_address}")
+        eventlog.info("Connection closed", rate_key='disconnect', addr=client_address)
+
+class AsyncioConnection(asyncio.Protocol):
+    """One Telnet session served from the shared asyncio event loop.
+
+    The instance stands in for the client socket: it is the key in `sessions`
+    and exposes the `sendmsg`/`shutdown`/`close` calls used by the output
+    buffer and the protocol helpers, so process_telnet_command and
+    handle_command work unchanged on both engines.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.addr = None
+        self.paused = False
+        self.reading_paused = False  # Input paused while our unsent output is above the high-water mark
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')[:2]
+        reason = admission_control.admit(self.addr[0])
+        if reason is not None:
+            connections_rejected.inc(1, (reason,))
+            eventlog.warning("Connection refused", rate_key='refuse', addr=self.addr, reason=reason)
+            transport.write(BUSY_MESSAGE)
+            transport.close()
+            return
+        register_client(self, self.addr)
+        start_negotiation(self)
+        queue_output(self, welcome_message(self.addr))
+        send_prompt(self, sessions.get(self))
+        flush_output(self)
+
+    def data_received(self, data):
+        if self not in sessions:
+            return
+        touch_client(self)
+        try:
+            processed_data = process_telnet_command(self, data)
+            if processed_data and not process_input(self, processed_data):
+                return
+            flush_output(self)
+            self.throttle_input()
+        except Exception as e:
+            eventlog.error("Error handling client", rate_key='client_error', addr=self.addr, error=e)
+            self.close()
+
+    def login_done(self, result):
+        """Finish a login verified in the auth pool and resume buffered input."""
+        session = sessions.get(self)
+        if session is None:
+            return
+        session.auth_pending = False
+        try:
+            if finish_login(self, session, result):
+                process_input(self, b'')
+            flush_output(self)
+            self.throttle_input()
+        except Exception as e:
+            eventlog.error("Error handling client", rate_key='client_error', addr=self.addr, error=e)
+            self.close()
+
+    def connection_lost(self, exc):
+        if self not in sessions:
+            return  # Refused by admission control
+        unregister_client(self)
+        eventlog.info("Connection closed", rate_key='disconnect', addr=self.addr)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        session = sessions.get(self)
+        if session is not None:
+            session.output.flush(self)
+            if self.reading_paused and session.output.unsent <= OUTPUT_LOW_WATER:
+                self.reading_paused = False
+                self.transport.resume_reading()
+
+    def throttle_input(self):
+        """Stop reading a client that does not read its replies; resume_writing resumes."""
+        session = sessions.get(self)
+        if session is not None and not self.reading_paused and session.output.unsent > OUTPUT_HIGH_WATER:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    def sendmsg(self, buffers, ancdata=(), flags=0):
+        """Hand buffered output to the transport, which handles partial writes.
+
+        While the transport is above its high-water mark the write is
+        refused so the backlog stays in the bounded OutputBuffer.
+        """
+        if self.transport.is_closing():
+            raise ConnectionResetError("connection is closing")
+        if self.paused:
+            raise BlockingIOError("transport write buffer is full")
+        self.transport.writelines(buffers)
+        return sum(map(len, buffers))
+
+    def shutdown(self, how):
+        self.transport.abort()
+
+    def fileno(self):
+        sock = self.transport.get_extra_info('socket')
+        return sock.fileno() if sock is not None else -1
+
+    def close(self):
+        self.transport.close()
+
+def fan_out(data, recipients, sender=None):
+    """Queue one encoded message for every recipient session except the sender."""
+    delivered = 0
+    for session in recipients:
+        if session.closing or session.sock is sender:
+            continue
+        delivered += 1
+        client_socket = session.sock
+        if not session.output.put(data):
+            evict_client(client_socket, "too slow to keep up with broadcasts")
+            continue
+        try:
+            flush_output(client_socket)
+        except socket.error:
+            pass  # The session loop notices the broken connection
+    broadcast_recipients.inc(delivered)
+
+def deliver_broadcast(entry):
+    """Deliver one message_queue entry: (channel, message, sender socket).
+
+    A channel of None reaches every logged in session, otherwise only the
+    channel's subscribers, whose messages are also kept in its history.
+    Text was published on this worker and is relayed to the others; bytes
+    were already encoded by another worker and relayed through the broker.
+    """
+    if not entry:
+        return
+    channel, message, sender = entry
+    broadcasts.inc()
+    if isinstance(message, bytes):
+        data = message
+    else:
+        # Encode once; every recipient queues the same bytes object
+        data = encode_message(message)
+        if cluster is not None:
+            cluster.publish(data, channel)
+    if channel is None:
+        recipients = sessions.authenticated()
+    else:
+        if isinstance(message, bytes):
+            message = data.decode('utf-8', errors='replace').replace('\r\n', '\n')
+        channels.record(channel, message)
+        recipients = channels.subscribers(channel)
+    fan_out(data, recipients, sender)
 
 def broadcast_messages():
     """Broadcast messages to all connected clients."""
     while running:
-        try:
-            message = message_queue.get()
-            if message:
-                for client in list(clients.keys()):
-                    try:
-                        client.send(message.encode())
-                    except:
-                        pass
-        except:
-            pass
+        deliver_broadcast(message_queue.get())
+
+async def broadcast_messages_async():
+    """Broadcast queued messages from inside the event loop."""
+    loop = asyncio.get_running_loop()
+    while running:
+        deliver_broadcast(await loop.run_in_executor(None, message_queue.get))
+
+def raise_fd_limit():
+    """Raise the open file soft limit to the hard limit for large session counts."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            eventlog.info("Raised open file limit", soft=soft, hard=hard)
+    except (ImportError, ValueError, OSError) as e:
+        eventlog.warning("Could not raise open file limit", error=e)
+
+async def serve_asyncio():
+    """Serve every session from a single asyncio event loop."""
+    global running
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    loop.add_signal_handler(signal.SIGUSR2, toggle_profiling)
+
+    if takeover is not None:
+        server = await loop.create_server(AsyncioConnection, sock=takeover[0], backlog=LISTEN_BACKLOG)
+    else:
+        server = await loop.create_server(AsyncioConnection, HOST, PORT, backlog=LISTEN_BACKLOG,
+                                          reuse_address=True, reuse_port=reuse_port or None)
+    eventlog.info(f"Server listening on {HOST}:{PORT}", engine='asyncio')
+    broadcaster = loop.create_task(broadcast_messages_async())
+    reaper = loop.create_task(run_idle_reaper_async())
+    announce_takeover()
+    if not reuse_port:
+        # Workers share the port through SO_REUSEPORT instead; there is no socket to hand off
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload_asyncio(server, stop)))
+
+    try:
+        await stop.wait()
+    finally:
+        eventlog.info("Shutting down server...")
+        running = False
+        server.close()
+        for client in sessions.sockets():
+            client.close()
+        message_queue.put(None)  # Wake the broadcast executor thread
+        broadcaster.cancel()
+        reaper.cancel()
+        await server.wait_closed()
+        log_compression_totals()
+        stop_capture()
+        eventlog.info("Server closed")
 
 def handle_interrupt(signum, frame):
     """Handle server shutdown signals."""
     global running
-    print("\nShutting down server...")
+    eventlog.info("Shutting down server...")
     running = False
-    for client in list(clients.keys()):
+    for client in sessions.sockets():
         try:
             client.close()
         except:
             pass
+    log_compression_totals()
+    stop_capture()
     sys.exit(0)
 
-def main():
-    """Main server function handling connections and client management."""
+def reload_server(listener_fd):
+    """Start a new server on the same listening socket; True once it is accepting.
+
+    Runs off the serving thread or loop, which keep accepting until the
+    new server is ready. On failure this server simply carries on.
+    """
+    global reloading
+    if reloading:
+        eventlog.warning("Reload already in progress")
+        return False
+    reloading = True
+    started = time.perf_counter()
+    eventlog.warning("Reloading: starting a new server", pid=os.getpid())
+    stop_metrics_server()  # The new server binds the same port
+    try:
+        successor = handoff.hand_off(listener_fd, [sys.executable] + sys.argv)
+    except handoff.HandoffError as e:
+        eventlog.error("Reload failed; still serving", error=e)
+        start_metrics_server()
+        reloading = False
+        return False
+    eventlog.warning("New server accepting; draining sessions", pid=successor.pid,
+                     handoff_ms=round((time.perf_counter() - started) * 1000, 1),
+                     sessions=len(sessions), grace=DRAIN_GRACE)
+    return True
+
+def notify_draining():
+    """Tell every session this server is going away."""
+    fan_out(encode_message(DRAIN_NOTICE.format(grace=DRAIN_GRACE)), list(sessions))
+
+def drain_sessions():
+    """Wait up to DRAIN_GRACE for sessions to leave, then evict the rest."""
+    notify_draining()
+    deadline = time.monotonic() + DRAIN_GRACE
+    while len(sessions) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    finish_draining()
+
+async def drain_sessions_async():
+    """drain_sessions() for the asyncio engine."""
+    notify_draining()
+    deadline = time.monotonic() + DRAIN_GRACE
+    while len(sessions) and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    finish_draining()
+
+def finish_draining():
+    """Evict the sessions still open when the grace period ends."""
+    left = sessions.sockets()
+    for client in left:
+        evict_client(client, "server reloaded", graceful=True)
+    eventlog.info("Drain finished", evicted=len(left))
+
+def request_reload(server_socket):
+    """SIGHUP on the threaded engine: hand off from a helper thread, then stop accepting."""
+    def reload():
+        global accepting
+        if reload_server(server_socket.fileno()):
+            accepting = False  # The accept loop exits and drains
+    threading.Thread(target=reload, name='reload', daemon=True).start()
+
+async def reload_asyncio(server, stop):
+    """SIGHUP on the asyncio engine: hand off, stop accepting, drain and stop."""
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, reload_server, server.sockets[0].fileno()):
+        return
+    # Stop accepting, and let connections accepted just before attach to the
+    # server: closing it while they are in flight would orphan them
+    for sock in server.sockets:
+        loop.remove_reader(sock.fileno())
+    await asyncio.sleep(0.1)
+    server.close()
+    await drain_sessions_async()
+    stop.set()
+
+def setup_profiling(directory=None):
+    """Register the request path phases the profiler times."""
+    profiler.directory = directory or os.getcwd()
+    namespace = globals()
+    # recv blocks until the client sends, so it is timed in CPU time
+    profiler.add_phase('recv', namespace, 'receive', clock=time.thread_time)
+    profiler.add_phase('telnet', namespace, 'process_telnet_command')
+    profiler.add_phase('command', namespace, 'handle_command')
+    profiler.add_phase('send', namespace, 'flush_output')
+    profiler.add_phase('log', vars(eventlog), '_log')
+
+def start_profiling():
+    """Start timing phases and sampling stacks; False if already running."""
+    if not profiler.start():
+        return False
+    eventlog.warning("Profiling started", directory=profiler.directory, pid=os.getpid())
+    return True
+
+def stop_profiling():
+    """Stop profiling and log where the stacks went; None if it was not running."""
+    path = profiler.stop()
+    if path is not None:
+        eventlog.warning("Profiling stopped", stacks=path, samples=profiler.samples)
+        eventlog.info("Phase timings\n" + profiler.phase_summary().rstrip())
+    return path
+
+def toggle_profiling():
+    """SIGUSR2: start profiling, or stop it and write the stacks."""
+    if profiler.running:
+        stop_profiling()
+    else:
+        start_profiling()
+
+def setup_metrics():
+    """Declare the gauges over live server state and serve /metrics if asked to."""
+    metrics.gauge('telnet_start_time_seconds', "Unix time the server started", lambda: started_at)
+    metrics.gauge('telnet_connections', "Open connections", lambda: len(sessions))
+    metrics.gauge('telnet_logged_in_sessions', "Sessions past the login prompt",
+                  lambda: len(sessions.by_username))
+    metrics.gauge('telnet_broadcast_queue_depth', "Broadcasts waiting to be fanned out",
+                  message_queue.qsize)
+    metrics.gauge('telnet_channels', "Pub/sub channels, including empty ones holding history",
+                  lambda: len(channels))
+    metrics.gauge('telnet_response_cache_entries', "Command replies in the response cache",
+                  lambda: len(registry.cache))
+
+def start_metrics_server(offset=0):
+    """Serve /metrics on METRICS_ADDRESS (port + offset); workers each get their own port."""
+    global metrics_server
+    if METRICS_ADDRESS is None:
+        return
+    host, port = METRICS_ADDRESS
+    try:
+        metrics_server = metrics.serve_http(host, port + offset)
+    except OSError as e:
+        eventlog.error("Could not serve metrics", port=port + offset, error=e)
+        return
+    eventlog.info(f"Metrics served on http://{host}:{port + offset}/metrics")
+
+def stop_metrics_server():
+    """Stop serving /metrics and free its port."""
+    global metrics_server
+    if metrics_server is not None:
+        server, metrics_server = metrics_server, None
+        server.shutdown()
+        server.server_close()
+
+def parse_address(text):
+    """'HOST:PORT' or 'PORT' -> (host, port)."""
+    host, _, port = text.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got {text!r}")
+
+def parse_args(argv=None):
+    """Parse server command line options."""
+    parser = argparse.ArgumentParser(description="Simple Telnet server")
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default=ENGINE,
+                        help="serving engine (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=PORT,
+                        help="TCP port to listen on (default: %(default)s)")
+    parser.add_argument('--send-queue-limit', type=int, default=SEND_QUEUE_LIMIT,
+                        help="messages buffered per client (default: %(default)s)")
+    parser.add_argument('--slow-consumer-policy', choices=('drop', 'coalesce', 'disconnect'),
+                        default=SLOW_CONSUMER_POLICY,
+                        help="what to do when a client falls behind (default: %(default)s)")
+    parser.add_argument('--idle-timeout', type=float, default=TIMEOUT,
+                        help="seconds a logged in session may stay idle (default: %(default)s)")
+    parser.add_argument('--login-timeout', type=float, default=LOGIN_TIMEOUT,
+                        help="seconds a session may stay idle before logging in (default: %(default)s)")
+    parser.add_argument('--credentials', default=CREDENTIALS_PATH, metavar='PATH',
+                        help="credential store (.db/.sqlite for SQLite, otherwise a text file); "
+                             "see credentials.py to manage it (default: built-in accounts)")
+    parser.add_argument('--auth-workers', type=int, default=AUTH_WORKERS,
+                        help="threads verifying passwords (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="pre-fork this many worker processes sharing the port (default: %(default)s)")
+    parser.add_argument('--broker-path', default=BROKER_PATH,
+                        help="unix socket for the workers' shared session registry (default: %(default)s)")
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG,
+                        help="pending connection queue length (default: %(default)s)")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS,
+                        help="concurrent sessions per process, 0 for no limit (default: %(default)s)")
+    parser.add_argument('--max-sessions-per-ip', type=int, default=MAX_SESSIONS_PER_IP,
+                        help="concurrent sessions from one IP, 0 for no limit (default: %(default)s)")
+    parser.add_argument('--connect-rate', type=float, default=CONNECT_RATE,
+                        help="connects per second allowed from one IP, 0 for no limit (default: %(default)s)")
+    parser.add_argument('--connect-burst', type=int, default=CONNECT_BURST,
+                        help="connects one IP may make at once (default: %(default)s)")
+    parser.add_argument('--max-line-length', type=int, default=MAX_LINE_LENGTH,
+                        help="longest input line accepted, in bytes (default: %(default)s)")
+    parser.add_argument('--no-compression', action='store_true',
+                        help="do not offer MCCP2 compressed output")
+    parser.add_argument('--compression-level', type=int, default=COMPRESSION_LEVEL, choices=range(1, 10),
+                        metavar='1-9', help="zlib compression level (default: %(default)s)")
+    parser.add_argument('--compression-flush', choices=tuple(FLUSH_MODES), default=COMPRESSION_FLUSH,
+                        help="zlib flush mode used after every write (default: %(default)s)")
+    parser.add_argument('--response-cache-size', type=int, default=registry.cache.size, metavar='N',
+                        help="command replies kept for reuse, 0 to disable (default: %(default)s)")
+    parser.add_argument('--admin', action='append', metavar='USER',
+                        help="user allowed to run administrative commands (repeatable; default: admin)")
+    parser.add_argument('--metrics-address', type=parse_address, metavar='[HOST:]PORT',
+                        help="serve Prometheus metrics over HTTP on this address (default: off)")
+    parser.add_argument('--capture', default=CAPTURE_PATH, metavar='PATH',
+                        help="append what clients send to a capture file for replay.py (default: off)")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, metavar='PATH',
+                        help="directory for profiling output (default: the working directory)")
+    parser.add_argument('--drain-grace', type=float, default=DRAIN_GRACE, metavar='SECONDS',
+                        help="seconds sessions may stay on the old server after a reload (default: %(default)s)")
+    parser.add_argument('--takeover', metavar='PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="minimum level written to the log (default: %(default)s)")
+    parser.add_argument('--log-file', help="write the log to a file instead of stdout")
+    parser.add_argument('--log-messages', action='store_true',
+                        help="include message and command content in debug logs")
+    parser.add_argument('--command-module', action='append', default=[], metavar='MODULE',
+                        help="import a module that registers extra commands (repeatable)")
+    return parser.parse_args(argv)
+
+def announce_takeover():
+    """Tell the server we replaced that we are accepting, so it can drain."""
+    global takeover
+    if takeover is not None:
+        handoff.announce_ready(takeover[1])
+        takeover = None
+        eventlog.info("Took over the listening socket", pid=os.getpid())
+
+def serve(engine):
+    """Run the chosen serving engine until shutdown."""
+    if engine == 'asyncio':
+        raise_fd_limit()
+        asyncio.run(serve_asyncio())
+    else:
+        serve_threaded()
+
+def serve_threaded():
+    """Serve each connection from its own thread."""
     # Set up signal handlers for graceful shutdown
     signal.signal(signal.SIGINT, handle_interrupt)
     signal.signal(signal.SIGTERM, handle_interrupt)
+    signal.signal(signal.SIGUSR2, lambda signum, frame: toggle_profiling())
 
-    # Create server socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Create server socket, or serve on the one handed over by the server we replace
+    if takeover is not None:
+        server_socket = takeover[0]
+    else:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     try:
         # Bind and start listening
-        server_socket.bind((HOST, PORT))
-        server_socket.listen(5)
-        print(f"Server listening on {HOST}:{PORT}")
+        if takeover is None:
+            server_socket.bind((HOST, PORT))
+        server_socket.listen(LISTEN_BACKLOG)
+        server_socket.setblocking(False)
+        eventlog.info(f"Server listening on {HOST}:{PORT}", engine='threaded')
 
         # Start broadcast thread
         broadcast_thread = threading.Thread(target=broadcast_messages)
         broadcast_thread.daemon = True
         broadcast_thread.start()
 
-        # Main server loop
-        while running:
+        # Start the thread that finishes sends to slow clients
+        flusher_thread = threading.Thread(target=flush_pending_output)
+        flusher_thread.daemon = True
+        flusher_thread.start()
+
+        # Start the idle session reaper
+        reaper_thread = threading.Thread(target=run_idle_reaper)
+        reaper_thread.daemon = True
+        reaper_thread.start()
+
+        announce_takeover()
+        if not reuse_port:
+            signal.signal(signal.SIGHUP, lambda signum, frame: request_reload(server_socket))
+
+        # Main server loop: wait for the listening socket, then drain a batch of connections
+        while running and accepting:
             try:
-                client_socket, client_address = server_socket.accept()
-                client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
-                client_thread.daemon = True
-                client_thread.start()
+                readable, _, _ = select.select([server_socket], [], [], 1.0)
+                if readable:
+                    accept_connections(server_socket)
             except socket.error as e:
                 if running:
-                    print(f"Error accepting connection: {e}")
+                    eventlog.error("Error accepting connection", rate_key='accept_error', error=e)
                 break
 
+        if not accepting:
+            # Reloaded: the new server accepts now, so finish with the sessions we hold
+            drain_sessions()
+            log_compression_totals()
+            stop_capture()
+
     except Exception as e:
-        print(f"Server error: {e}")
+        eventlog.error("Server error", error=e)
     finally:
         # Clean up server
         server_socket.close()
-        print("Server closed")
+        eventlog.info("Server closed")
+
+def run_worker(index, args):
+    """Body of a forked worker process: join the broker and serve PORT."""
+    global reuse_port, cluster
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)  # Until serve() installs the profiling toggle
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # Workers are not reloaded
+    eventlog.setup(args.log_level, args.log_file)
+    # Opened after the fork: SQLite connections and thread pools must not cross it
+    setup_authentication(args.credentials, args.auth_workers)
+    reuse_port = True
+    cluster = BrokerClient(args.broker_path,
+                           on_deliver=lambda data, channel: message_queue.put((channel, data, None)))
+    try:
+        cluster.connect()
+    except OSError as e:
+        eventlog.error("Could not reach the session broker; serving alone", error=e)
+        cluster = None
+    eventlog.info("Worker started", worker=index, pid=os.getpid())
+    start_metrics_server(offset=index)
+    if args.capture:
+        start_capture(f"{args.capture}.{index}")
+    serve(args.engine)
+
+def run_supervisor(args):
+    """Pre-fork WORKERS processes on PORT, restart any that die and host the broker."""
+    stopping = []
+    def request_stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    def forward_signal(signum, frame):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+    # Profiling is per process: toggle it in every worker
+    signal.signal(signal.SIGUSR2, forward_signal)
+    signal.signal(signal.SIGHUP, lambda signum, frame: eventlog.warning(
+        "Reload (SIGHUP) is only supported without --workers; ignored"))
+
+    broker = Broker(args.broker_path)
+    broker.start()
+    workers = {}  # pid -> worker index
+    started = {}  # worker index -> start time
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                broker.close_inherited()
+                run_worker(index, args)
+            except BaseException as e:
+                if not isinstance(e, SystemExit):
+                    eventlog.error("Worker crashed", worker=index, error=e)
+                    status = 1
+            finally:
+                eventlog.stop()
+                os._exit(status)
+        workers[pid] = index
+        started[index] = time.monotonic()
+
+    eventlog.info("Supervisor starting workers", workers=args.workers, port=PORT, pid=os.getpid())
+    for index in range(args.workers):
+        spawn(index)
+
+    restarts = []  # (restart time, worker index) for workers that died young
+    try:
+        while not stopping:
+            broker.poll(0.5)
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+                index = workers.pop(pid, None)
+                if index is None or stopping:
+                    continue
+                eventlog.warning("Worker exited; restarting", worker=index, pid=pid, status=status)
+                # Back off a little if the worker is crash-looping
+                delay = 1.0 if time.monotonic() - started[index] < 1.0 else 0.0
+                restarts.append((time.monotonic() + delay, index))
+            now = time.monotonic()
+            for due, index in [entry for entry in restarts if entry[0] <= now]:
+                restarts.remove((due, index))
+                spawn(index)
+    finally:
+        eventlog.info("Stopping workers...")
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        broker.close()
+        eventlog.info("Supervisor stopped")
+
+def main():
+    """Main server function handling connections and client management."""
+    global SEND_QUEUE_LIMIT, SLOW_CONSUMER_POLICY, TIMEOUT, LOGIN_TIMEOUT
+    global COMPRESSION, COMPRESSION_LEVEL, COMPRESSION_FLUSH, MAX_LINE_LENGTH
+    global ADMIN_USERS, METRICS_ADDRESS, LISTEN_BACKLOG, DRAIN_GRACE, PORT, takeover
+    args = parse_args()
+    PORT = args.port
+    DRAIN_GRACE = args.drain_grace
+    LISTEN_BACKLOG = args.backlog
+    admission_control.max_sessions = args.max_sessions
+    admission_control.max_per_ip = args.max_sessions_per_ip
+    admission_control.rate = args.connect_rate
+    admission_control.burst = args.connect_burst
+    if args.admin:
+        ADMIN_USERS = set(args.admin)
+    METRICS_ADDRESS = args.metrics_address
+    registry.cache.size = args.response_cache_size
+    MAX_LINE_LENGTH = args.max_line_length
+    COMPRESSION = not args.no_compression
+    COMPRESSION_LEVEL = args.compression_level
+    COMPRESSION_FLUSH = args.compression_flush
+    TIMEOUT = args.idle_timeout
+    LOGIN_TIMEOUT = args.login_timeout
+    SEND_QUEUE_LIMIT = args.send_queue_limit
+    SLOW_CONSUMER_POLICY = args.slow_consumer_policy
+    eventlog.setup(args.log_level, args.log_file)
+    eventlog.log_messages = args.log_messages
+    load_command_modules(args.command_module)
+    setup_metrics()
+    setup_profiling(args.profile_dir)
+    if args.workers > 0:
+        run_supervisor(args)
+    else:
+        setup_authentication(args.credentials, args.auth_workers)
+        start_metrics_server()
+        if args.capture:
+            start_capture(args.capture)
+        if args.takeover:
+            try:
+                takeover = handoff.take_over(args.takeover)
+            except handoff.HandoffError as e:
+                eventlog.error("Reload failed", error=e)
+                sys.exit(1)
+        serve(args.engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""Per-connection session objects and the indexed session registry."""
+
+import threading
+
+# Client states
+STATE_LOGIN = 0
+STATE_PASSWORD = 1
+STATE_COMMAND = 2
+
+
+class Session:
+    """State of one client connection.
+
+    `sock` is the client socket (or the asyncio connection standing in for
+    it). __slots__ keeps each instance small: no per-instance dict, and the
+    Telnet options live packed in an OptionTable rather than a nested dict,
+    which matters with tens of thousands of sessions.
+    """
+
+    __slots__ = ('sock', 'fd', 'addr', 'buffer', 'last_activity', 'state', 'username',
+                 'prompt', 'window_size', 'output', 'parser', 'closing', 'login_name',
+                 'login_attempts', 'auth_pending', 'discarding', 'options', 'offers', 'negotiation_started',
+                 'capture_id', 'channels')
+
+    def __init__(self, sock, addr, output=None, parser=None, options=None):
+        self.sock = sock
+        try:
+            self.fd = sock.fileno()
+        except (AttributeError, OSError):
+            self.fd = -1
+        self.addr = addr
+        self.buffer = bytearray()  # Received text not yet ending in a line break
+        self.last_activity = 0.0
+        self.state = STATE_LOGIN
+        self.username = None
+        self.prompt = 'login: '
+        self.window_size = (80, 24)
+        self.output = output
+        self.parser = parser
+        self.closing = False
+        self.login_name = None     # Username given at the login prompt
+        self.login_attempts = 0
+        self.auth_pending = False  # Password being verified; input waits in buffer
+        self.discarding = False    # Skipping the rest of an overlong line
+        self.options = options     # protocol.OptionTable: Telnet option states (RFC 1143)
+        self.offers = None         # {(command, option): time sent} for our offers, until answered
+        self.negotiation_started = 0.0  # When the opening option burst was queued
+        self.capture_id = None     # Session id in the capture file while recording
+        self.channels = None       # Names of the channels joined (a set, created on first join)
+
+    @property
+    def ip(self):
+        return self.addr[0]
+
+    def __repr__(self):
+        return f"<Session {self.addr[0]}:{self.addr[1]} user={self.username!r} state={self.state}>"
+
+
+class SessionRegistry:
+    """Sessions indexed by socket, file descriptor, username and remote IP.
+
+    Every change goes through a method holding the registry lock, so the
+    indexes always agree; single-key lookups are plain dict reads. Looking
+    a session up by username or counting the sessions of an IP is O(1) and
+    listing the sessions of one IP is O(k) in that IP's session count.
+    """
+
+    def __init__(self):
+        self.by_socket = {}
+        self.by_fd = {}
+        self.by_username = {}
+        self.by_ip = {}  # ip -> {socket: Session}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_socket)
+
+    def __contains__(self, sock):
+        return sock in self.by_socket
+
+    def __iter__(self):
+        """Iterate over a snapshot of the sessions."""
+        return iter(list(self.by_socket.values()))
+
+    def get(self, sock, default=None):
+        return self.by_socket.get(sock, default)
+
+    def get_fd(self, fd):
+        return self.by_fd.get(fd)
+
+    def sockets(self):
+        """Snapshot of every registered socket."""
+        return list(self.by_socket)
+
+    def add(self, session):
+        with self.lock:
+            self.by_socket[session.sock] = session
+            if session.fd >= 0:
+                self.by_fd[session.fd] = session
+            self.by_ip.setdefault(session.ip, {})[session.sock] = session
+
+    def remove(self, sock):
+        """Unregister a socket's session from every index; returns it (or None)."""
+        with self.lock:
+            session = self.by_socket.pop(sock, None)
+            if session is None:
+                return None
+            if self.by_fd.get(session.fd) is session:
+                del self.by_fd[session.fd]
+            peers = self.by_ip.get(session.ip)
+            if peers is not None:
+                peers.pop(sock, None)
+                if not peers:
+                    del self.by_ip[session.ip]
+            if session.username and self.by_username.get(session.username) is session:
+                del self.by_username[session.username]
+            return session
+
+    def claim_username(self, session, username):
+        """Log session in as username; False if another session already has it."""
+        with self.lock:
+            if username in self.by_username or session.sock not in self.by_socket:
+                return False
+            self.by_username[username] = session
+            session.username = username
+            return True
+
+    def release_username(self, session):
+        """Undo claim_username."""
+        with self.lock:
+            if session.username and self.by_username.get(session.username) is session:
+                del self.by_username[session.username]
+            session.username = None
+
+    def find_user(self, username):
+        return self.by_username.get(username)
+
+    def count_from(self, ip):
+        """Number of sessions connected from ip."""
+        peers = self.by_ip.get(ip)
+        return len(peers) if peers else 0
+
+    def from_ip(self, ip):
+        """Snapshot of the sessions connected from ip."""
+        with self.lock:
+            return list(self.by_ip.get(ip, {}).values())
+
+    def authenticated(self):
+        """Snapshot of every logged in session."""
+        with self.lock:
+            return list(self.by_username.values())
+
+    def logged_in(self):
+        """[(username, addr), ...] for every logged in session."""
+        with self.lock:
+            return [(username, session.addr) for username, session in self.by_username.items()]
@@ -0,0 +1,51 @@
+import admission
+from admission import REJECT_FULL, REJECT_IP_FULL, REJECT_RATE, AdmissionControl
+from sessions import Session, SessionRegistry
+
+
+def registry_with(*addresses):
+    registry = SessionRegistry()
+    for i, ip in enumerate(addresses):
+        registry.add(Session(f'sock{i}', (ip, 5000 + i)))
+    return registry
+
+
+def test_no_limits_admits_everything():
+    control = AdmissionControl(registry_with('10.0.0.1', '10.0.0.1'))
+    assert all(control.admit('10.0.0.1', now=0.0) is None for _ in range(100))
+
+
+def test_session_caps():
+    registry = registry_with('10.0.0.1', '10.0.0.1', '10.0.0.2')
+    assert AdmissionControl(registry, max_sessions=3).admit('10.0.0.3') == REJECT_FULL
+    control = AdmissionControl(registry, max_sessions=4, max_per_ip=2)
+    assert control.admit('10.0.0.1') == REJECT_IP_FULL
+    assert control.admit('10.0.0.2') is None
+
+
+def test_burst_then_refill():
+    control = AdmissionControl(SessionRegistry(), rate=2.0, burst=3)
+    assert [control.admit('10.0.0.1', now=0.0) for _ in range(4)] == [None, None, None, REJECT_RATE]
+    assert control.admit('10.0.0.1', now=0.25) == REJECT_RATE  # Half a token back
+    assert control.admit('10.0.0.1', now=0.5) is None
+    # Each IP has its own bucket
+    assert control.admit('10.0.0.2', now=0.5) is None
+
+
+def test_bucket_never_exceeds_burst():
+    control = AdmissionControl(SessionRegistry(), rate=1.0, burst=2)
+    control.admit('10.0.0.1', now=0.0)
+    results = [control.admit('10.0.0.1', now=1000.0) for _ in range(3)]
+    assert results == [None, None, REJECT_RATE]
+
+
+def test_prune_forgets_refilled_buckets(monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_TRACKED_IPS', 4)
+    control = AdmissionControl(SessionRegistry(), rate=1.0, burst=1)
+    for i in range(4):
+        control.admit(f'10.0.0.{i}', now=0.0)
+    control.admit('10.0.0.9', now=0.5)  # Nothing refilled yet: the oldest half goes
+    assert list(control.buckets) == ['10.0.0.2', '10.0.0.3', '10.0.0.9']
+    control.admit('10.0.1.1', now=1.0)
+    control.admit('10.0.1.2', now=5.0)  # Every earlier bucket has refilled
+    assert list(control.buckets) == ['10.0.1.2']
@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+import server
+from sessions import STATE_COMMAND
+
+ECHO_LINES = (b'echo ' + b'x' * 4000 + b'\r\n') * 4
+
+
+class FakeSocket:
+    """Accepts at most `capacity` bytes per sendmsg call."""
+
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+
+    def sendmsg(self, buffers, ancdata, flags):
+        sent = min(self.capacity, sum(map(len, buffers)))
+        if not sent:
+            raise BlockingIOError
+        return sent
+
+
+class FakeTransport:
+    """Transport of a client that stops reading after `window` bytes."""
+
+    def __init__(self, window):
+        self.window = window
+        self.written = 0
+        self.protocol = None
+        self.reading_paused = False
+
+    def writelines(self, buffers):
+        self.written += sum(map(len, buffers))
+        if self.written > self.window and not self.protocol.paused:
+            self.protocol.pause_writing()
+
+    def pause_reading(self):
+        self.reading_paused = True
+
+    def resume_reading(self):
+        self.reading_paused = False
+
+    def is_closing(self):
+        return False
+
+    def get_extra_info(self, name):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(server, 'sessions', server.SessionRegistry())
+
+
+def logged_in(sock):
+    server.register_client(sock, ('127.0.0.1', 4000))
+    session = server.sessions.get(sock)
+    session.state = STATE_COMMAND
+    session.username = 'tester'
+    session.prompt = server.COMMAND_PROMPT
+    return session
+
+
+def test_unsent_counts_queued_bytes():
+    output = server.OutputBuffer(limit=4)
+    output.write(b'a' * 10)
+    output.put(b'b' * 5)
+    assert output.unsent == 15
+    assert not output.flush(FakeSocket(capacity=12))
+    assert output.unsent == 3
+    assert output.flush(FakeSocket(capacity=100))
+    assert output.unsent == 0
+
+
+def test_asyncio_stops_reading_a_client_that_does_not_read():
+    conn = server.AsyncioConnection()
+    conn.transport = transport = FakeTransport(window=64 * 1024)
+    transport.protocol = conn
+    session = logged_in(conn)
+    try:
+        for _ in range(1000):
+            if transport.reading_paused:
+                break
+            conn.data_received(ECHO_LINES)
+        assert transport.reading_paused
+        assert session.output.unsent <= server.OUTPUT_HIGH_WATER + 2 * len(ECHO_LINES)
+        # The client catches up: everything is handed over and reading resumes
+        transport.window = float('inf')
+        conn.resume_writing()
+        assert session.output.unsent == 0 and not transport.reading_paused
+    finally:
+        server.unregister_client(conn)
+
+
+def test_threaded_waits_until_output_drains():
+    sock = FakeSocket()
+    session = logged_in(sock)
+    try:
+        session.output.write(b'x' * (server.OUTPUT_HIGH_WATER + 1))
+        result = []
+        reader = threading.Thread(target=lambda: result.append(server.wait_for_output_room(sock)))
+        reader.start()
+        reader.join(0.2)
+        assert reader.is_alive()  # Not reading while the backlog is above the high-water mark
+        sock.capacity = server.OUTPUT_HIGH_WATER - server.OUTPUT_LOW_WATER
+        session.output.flush(sock)
+        reader.join(0.2)
+        assert reader.is_alive()  # Above the low-water mark still
+        sock.capacity = 64
+        session.output.flush(sock)
+        reader.join(5)
+        assert result == [True]
+    finally:
+        server.unregister_client(sock)
+
+
+def test_threaded_wait_ends_with_the_session():
+    sock = FakeSocket()
+    session = logged_in(sock)
+    session.output.write(b'x' * (server.OUTPUT_HIGH_WATER + 1))
+    session.closing = True
+    assert server.wait_for_output_room(sock) is False
+    server.unregister_client(sock)
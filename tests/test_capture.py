@@ -0,0 +1,33 @@
+import capture
+from capture import CLOSE, DATA, OPEN, OUTPUT, CaptureWriter, read_capture
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / 'telnet.cap')
+    writer = CaptureWriter(path, flush_interval=60)
+    writer.record(OPEN, 1, b'127.0.0.1:4000')
+    writer.record(DATA, 1, b'look\r\n')
+    writer.record(OUTPUT, 1, 42)
+    writer.record(CLOSE, 1)
+    writer.close()
+    assert [(kind, sid, payload) for kind, sid, _, payload in read_capture(path)] == [
+        (OPEN, 1, b'127.0.0.1:4000'), (DATA, 1, b'look\r\n'), (OUTPUT, 1, 42), (CLOSE, 1, 0)]
+
+
+def test_two_writers_share_a_file(tmp_path, monkeypatch):
+    # Small batches force many appends from both writers, as during a reload
+    monkeypatch.setattr(capture, 'WRITE_BUFFER', 4096)
+    path = str(tmp_path / 'telnet.cap')
+    old, new = CaptureWriter(path, flush_interval=60), CaptureWriter(path, flush_interval=60)
+    for i in range(200):
+        for sid, writer in ((1, old), (2, new)):
+            writer.record(DATA, sid, bytes([sid]) * (i * 37 % 3000))
+        if i % 10 == 0:
+            old._write_pending()
+            new._write_pending()
+    old.close()
+    new.close()
+    records = list(read_capture(path))
+    assert len(records) == 400
+    for kind, sid, _, payload in records:
+        assert kind == DATA and set(payload) <= {sid}
@@ -0,0 +1,92 @@
+import socket
+import threading
+import zlib
+
+import pytest
+
+from client import BatchSession, ReplyMismatchError, compression_summary
+from protocol import COMPRESS2, IAC, SB, SE, TelnetParser
+
+
+def test_compression_summary_without_compression():
+    assert compression_summary(None) is None
+    assert compression_summary(TelnetParser(decompress=True)) is None
+
+
+def test_compression_summary_before_anything_inflated():
+    parser = TelnetParser(decompress=True)
+    parser.feed(bytes([IAC, SB, COMPRESS2, IAC, SE]) + b'\x78\x9c')  # zlib header only
+    assert parser.stream_bytes == 0 and parser.wire_bytes == 2
+    assert compression_summary(parser) == "Compression: 2 compressed bytes received, none inflated yet"
+
+
+def test_compression_summary_ratio():
+    parser = TelnetParser(decompress=True)
+    deflate = zlib.compressobj()
+    parser.feed(bytes([IAC, SB, COMPRESS2, IAC, SE]) + deflate.compress(b'a' * 1000)
+                + deflate.flush(zlib.Z_SYNC_FLUSH))
+    assert compression_summary(parser).startswith("Compression: 1000 bytes received as ")
+
+
+class FakeServer(threading.Thread):
+    """Answers each line on one end of a socket pair: echo repeats its text, others use canned output."""
+
+    def __init__(self, sock, outputs):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.outputs = outputs
+
+    def run(self):
+        pending = b''
+        with self.sock:
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    return
+                pending += data
+                *lines, pending = pending.split(b'\r\n')
+                for line in lines:
+                    text = line.decode()
+                    if text.startswith('echo '):
+                        output = text[5:] + '\r\n'
+                    else:
+                        output = self.outputs.get(text, '')
+                    self.sock.sendall(output.encode() + b'> ')
+
+
+def batch_session(outputs):
+    ours, theirs = socket.socketpair()
+    ours.setblocking(False)
+    FakeServer(theirs, outputs).start()
+    session = BatchSession(timeout=5)
+    session.sock = ours
+    return session
+
+
+OUTPUTS = {'whoami': 'You are admin\r\n', 'cat': 'a > b\r\n'}
+
+
+@pytest.mark.parametrize('marker', [None, '--batch-test--'])
+def test_batch_replies_in_order(marker):
+    session = batch_session(OUTPUTS)
+    try:
+        assert session.run(['whoami', 'echo hi', ''], marker) == [b'You are admin\r\n', b'hi\r\n', b'']
+    finally:
+        session.close()
+
+
+def test_prompt_in_output_is_detected():
+    session = batch_session(OUTPUTS)
+    try:
+        with pytest.raises(ReplyMismatchError):
+            session.run(['cat', 'whoami'])
+    finally:
+        session.close()
+
+
+def test_prompt_in_output_with_marker_split():
+    session = batch_session(OUTPUTS)
+    try:
+        assert session.run(['cat', 'whoami'], '--batch-test--') == [b'a > b\r\n', b'You are admin\r\n']
+    finally:
+        session.close()
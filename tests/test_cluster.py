@@ -0,0 +1,45 @@
+import json
+import socket
+import threading
+
+from cluster import Broker, BrokerClient
+
+
+def test_broker_skips_bad_lines(tmp_path):
+    broker = Broker(str(tmp_path / 'broker.sock'))
+    broker.start()
+    worker = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        worker.connect(broker.path)
+        worker.sendall(b'not json\n[1, 2]\n{"op": "claim"}\n{"op": "users", "id": 7}\n')
+        worker.setblocking(False)
+        reply = b''
+        for _ in range(50):
+            if reply.endswith(b'\n'):
+                break
+            broker.poll(0.1)
+            try:
+                reply += worker.recv(4096)
+            except BlockingIOError:
+                pass
+        assert json.loads(reply) == {'id': 7, 'users': []}
+        assert len(broker.buffers) == 1  # The worker is still connected
+    finally:
+        worker.close()
+        broker.close()
+
+
+def test_client_skips_bad_lines():
+    delivered = []
+    done = threading.Event()
+    ours, broker_side = socket.socketpair()
+    client = BrokerClient('unused', lambda data, channel: (delivered.append((data, channel)), done.set()))
+    client.sock = ours
+    reader = threading.Thread(target=client._read_loop, daemon=True)
+    reader.start()
+    with broker_side:
+        broker_side.sendall(b'{broken\n"just a string"\n'
+                            b'{"op": "deliver", "data": "hello\\r\\n", "channel": "news"}\n')
+        assert done.wait(5)
+    reader.join(5)
+    assert delivered == [(b'hello\r\n', 'news')]
@@ -0,0 +1,40 @@
+import threading
+
+from credentials import (AUTH_BUSY, AUTH_FAILED, AUTH_OK, AUTH_THROTTLED, MAX_FAILURES_PER_USER,
+                         Authenticator, MemoryCredentialStore)
+
+
+class BlockingStore(MemoryCredentialStore):
+    """Holds every lookup until `release` is set."""
+
+    def __init__(self, passwords):
+        super().__init__(passwords)
+        self.release = threading.Event()
+
+    def get(self, username):
+        self.release.wait(10)
+        return super().get(username)
+
+
+def test_full_queue_is_busy_not_throttled():
+    store = BlockingStore({'alice': 'secret'})
+    authenticator = Authenticator(store, workers=1, max_pending=1)
+    try:
+        pending = authenticator.submit('alice', 'secret')
+        assert authenticator.submit('alice', 'secret').result() == AUTH_BUSY
+        store.release.set()
+        assert pending.result(10) == AUTH_OK
+        assert authenticator.stats['busy'] == 1 and authenticator.stats['throttled'] == 0
+        # A busy refusal is not a failure: the user is not throttled by it
+        assert authenticator.verify('alice', 'secret') == AUTH_OK
+    finally:
+        authenticator.shutdown()
+
+
+def test_repeated_failures_are_throttled():
+    authenticator = Authenticator(MemoryCredentialStore({'alice': 'secret'}))
+    try:
+        results = [authenticator.verify('alice', 'wrong') for _ in range(MAX_FAILURES_PER_USER + 1)]
+        assert results == [AUTH_FAILED] * MAX_FAILURES_PER_USER + [AUTH_THROTTLED]
+    finally:
+        authenticator.shutdown()
@@ -0,0 +1,69 @@
+import pytest
+
+import server
+from sessions import Session
+
+
+@pytest.fixture
+def lines(monkeypatch):
+    """Run process_input for one registered session and record what it frames."""
+    received = []
+    monkeypatch.setattr(server, 'handle_line',
+                        lambda sock, session, line: received.append(bytes(line)) or True)
+    monkeypatch.setattr(server, 'reject_long_line',
+                        lambda sock, session: received.append('too long'))
+    monkeypatch.setattr(server, 'sessions', server.SessionRegistry())
+    session = Session('sock', ('127.0.0.1', 4000))
+    server.sessions.add(session)
+
+    def feed(*chunks):
+        for chunk in chunks:
+            assert server.process_input('sock', bytearray(chunk))
+        return received
+
+    feed.session = session
+    return feed
+
+
+@pytest.mark.parametrize('ending', [b'\r\n', b'\r\0', b'\n'])
+def test_line_endings(lines, ending):
+    assert lines(b'one' + ending + b'two' + ending) == [b'one', b'two']
+    assert lines.session.buffer == b''
+
+
+def test_bare_cr_ends_a_line_when_followed_by_text(lines):
+    assert lines(b'one\rtwo\n') == [b'one', b'two']
+
+
+def test_cr_at_end_of_chunk_waits_for_the_next_read(lines):
+    assert lines(b'one\r') == []
+    assert lines.session.buffer == b'one\r'
+    # Its LF arrives next: one line, not a line and an empty one
+    assert lines(b'\ntwo\r', b'\0') == [b'one', b'two']
+    assert lines.session.buffer == b''
+
+
+def test_line_split_across_reads(lines):
+    assert lines(b'lo', b'ok', b' north\r\nsay') == [b'look north']
+    assert lines.session.buffer == b'say'
+
+
+def test_empty_lines_are_framed(lines):
+    assert lines(b'\r\n\r\n') == [b'', b'']
+
+
+def test_complete_long_line_is_rejected(lines):
+    long_line = b'x' * (server.MAX_LINE_LENGTH + 1)
+    assert lines(long_line + b'\r\nok\r\n') == ['too long', b'ok']
+
+
+def test_unterminated_long_line_is_discarded_up_to_its_end(lines):
+    assert lines(b'x' * (server.MAX_LINE_LENGTH + 1)) == ['too long']
+    assert lines.session.buffer == b'' and lines.session.discarding
+    assert lines(b'xxxx\r\nok\r\n') == ['too long', b'ok']
+    assert not lines.session.discarding
+
+
+def test_line_of_maximum_length_is_accepted(lines):
+    line = b'y' * server.MAX_LINE_LENGTH
+    assert lines(line[:100], line[100:] + b'\n') == [line]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import server
+from credentials import AUTH_ERROR, Authenticator, MemoryCredentialStore
+
+
+class BrokenStore(MemoryCredentialStore):
+    def get(self, username):
+        raise OSError("credential store unavailable")
+
+
+class FakeTransport:
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def writelines(self, buffers):
+        for buffer in buffers:
+            self.data += buffer
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name):
+        return None
+
+
+@pytest.fixture
+def broken_store(monkeypatch):
+    monkeypatch.setattr(server, 'sessions', server.SessionRegistry())
+    authenticator = Authenticator(BrokenStore())
+    monkeypatch.setattr(server, 'authenticator', authenticator)
+    yield
+    authenticator.shutdown()
+
+
+def test_verification_error_is_a_result(broken_store):
+    assert server.check_login('admin', 'admin').result(5) == AUTH_ERROR
+
+
+def test_verification_after_pool_shutdown(broken_store):
+    server.authenticator.shutdown()
+    assert server.check_login('admin', 'admin').result(5) == AUTH_ERROR
+
+
+def test_asyncio_login_ends_when_verification_fails(broken_store):
+    async def log_in():
+        conn = server.AsyncioConnection()
+        conn.transport = FakeTransport()
+        server.register_client(conn, ('127.0.0.1', 4000))
+        conn.data_received(b'admin\r\nadmin\r\n')
+        assert server.sessions.get(conn).auth_pending
+        for _ in range(100):
+            if conn not in server.sessions:
+                break
+            await asyncio.sleep(0.05)
+        return conn
+
+    conn = asyncio.run(log_in())
+    assert conn not in server.sessions
+    assert b"Could not verify the password" in conn.transport.data
@@ -0,0 +1,135 @@
+import collections
+
+from protocol import (COMPRESS2, DO, DONT, ECHO, LOCAL, NAWS, NO, REMOTE, WANTNO,
+                      WANTNO_OPPOSITE, WANTYES, WANTYES_OPPOSITE, WILL, WONT, YES,
+                      OptionRegistry, OptionTable)
+
+
+def make_table(**options):
+    """An OptionTable whose sent commands and on_change calls are recorded."""
+    sent = []
+    changes = []
+    registry = OptionRegistry(lambda conn, command, option: sent.append((command, option)))
+    for option, (local, remote) in options.items():
+        registry.register(int(option), local=local, remote=remote,
+                          on_change=lambda conn, side, enabled, option=int(option):
+                          changes.append((option, side, enabled)))
+    return OptionTable(registry, 'conn'), sent, changes
+
+
+def test_unregistered_option_is_refused():
+    table, sent, changes = make_table()
+    table.receive(DO, ECHO)
+    table.receive(WILL, NAWS)
+    assert sent == [(WONT, ECHO), (DONT, NAWS)]
+    assert table.states == {} and changes == []
+
+
+def test_registered_option_is_agreed_once():
+    table, sent, changes = make_table(**{str(NAWS): (False, True)})
+    table.receive(WILL, NAWS)
+    table.receive(WILL, NAWS)  # Already on: no second answer
+    assert sent == [(DO, NAWS)]
+    assert table.enabled(NAWS, REMOTE)
+    assert changes == [(NAWS, REMOTE, True)]
+
+
+def test_setting_checked_on_every_request():
+    allowed = [False]
+    table, sent, _ = make_table(**{str(COMPRESS2): (lambda: allowed[0], False)})
+    table.receive(DO, COMPRESS2)
+    allowed[0] = True
+    table.receive(DO, COMPRESS2)
+    assert sent == [(WONT, COMPRESS2), (WILL, COMPRESS2)]
+
+
+def test_request_is_not_repeated_while_pending():
+    table, sent, _ = make_table(**{str(ECHO): (True, False)})
+    assert table.request(WILL, ECHO)
+    assert not table.request(WILL, ECHO)
+    assert table.state(ECHO, LOCAL) == WANTYES and table.pending()
+    table.receive(DO, ECHO)
+    assert table.enabled(ECHO, LOCAL) and not table.pending()
+    assert sent == [(WILL, ECHO)]
+
+
+def test_refused_request_goes_back_to_no():
+    table, sent, changes = make_table(**{str(ECHO): (True, False)})
+    table.request(WILL, ECHO)
+    table.receive(DONT, ECHO)
+    assert table.state(ECHO, LOCAL) == NO and table.states == {}
+    assert sent == [(WILL, ECHO)]
+    assert changes == []
+
+
+def test_queue_bit_sends_the_opposite_once_answered():
+    table, sent, changes = make_table(**{str(ECHO): (True, False)})
+    table.request(WILL, ECHO)
+    assert not table.request(WONT, ECHO)
+    assert table.state(ECHO, LOCAL) == WANTYES_OPPOSITE
+    table.receive(DO, ECHO)
+    assert table.state(ECHO, LOCAL) == WANTNO
+    assert sent == [(WILL, ECHO), (WONT, ECHO)]
+    table.receive(DONT, ECHO)
+    assert table.state(ECHO, LOCAL) == NO
+    assert changes == [(ECHO, LOCAL, True), (ECHO, LOCAL, False)]
+
+
+def test_queue_bit_cancelled_by_asking_again():
+    table, sent, _ = make_table(**{str(ECHO): (True, False)})
+    table.request(WILL, ECHO)
+    table.receive(DO, ECHO)
+    table.request(WONT, ECHO)
+    table.request(WILL, ECHO)
+    assert table.state(ECHO, LOCAL) == WANTNO_OPPOSITE
+    table.request(WONT, ECHO)
+    assert table.state(ECHO, LOCAL) == WANTNO
+    assert sent == [(WILL, ECHO), (WONT, ECHO)]
+
+
+def test_disable_request_of_enabled_option():
+    table, sent, changes = make_table(**{str(NAWS): (False, True)})
+    table.receive(WILL, NAWS)
+    assert table.request(DONT, NAWS)
+    table.receive(WONT, NAWS)
+    assert not table.enabled(NAWS, REMOTE)
+    assert sent == [(DO, NAWS), (DONT, NAWS)]
+    assert changes == [(NAWS, REMOTE, True), (NAWS, REMOTE, False)]
+
+
+def test_crossing_offers_settle_without_looping():
+    # Both peers offer the same options at once: every command each sends is
+    # delivered to the other until nothing is left in flight.
+    options = {str(ECHO): (True, True), str(NAWS): (True, True)}
+    left, left_sent, _ = make_table(**options)
+    right, right_sent, _ = make_table(**options)
+    for table in (left, right):
+        for option in (ECHO, NAWS):
+            table.request(WILL, option)
+            table.request(DO, option)
+    in_flight = collections.deque()
+    delivered = 0
+    while left_sent or right_sent or in_flight:
+        in_flight.extend((right, command) for command in left_sent)
+        in_flight.extend((left, command) for command in right_sent)
+        left_sent.clear()
+        right_sent.clear()
+        target, (command, option) = in_flight.popleft()
+        target.receive(command, option)
+        delivered += 1
+        assert delivered < 100
+    assert delivered == 8
+    for table in (left, right):
+        assert not table.pending()
+        for option in (ECHO, NAWS):
+            assert table.state(option, LOCAL) == table.state(option, REMOTE) == YES
+
+
+def test_subnegotiation_reaches_handler():
+    payloads = []
+    registry = OptionRegistry(lambda *args: None)
+    registry.register(NAWS, remote=True, on_subnegotiation=lambda conn, payload: payloads.append(payload))
+    table = OptionTable(registry, 'conn')
+    table.subnegotiation(NAWS, b'\x00\x50\x00\x18')
+    table.subnegotiation(ECHO, b'ignored')
+    assert payloads == [b'\x00\x50\x00\x18']
@@ -0,0 +1,77 @@
+import pytest
+
+from server import OutputBuffer
+
+
+class FakeSocket:
+    """Accepts at most `capacity` bytes per sendmsg call."""
+
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.sent = bytearray()
+
+    def sendmsg(self, buffers, ancdata, flags):
+        data = b''.join(bytes(buffer) for buffer in buffers)[:self.capacity]
+        self.sent += data
+        return len(data)
+
+
+def own_output(buffer):
+    for data in (b'IAC reply', b'command reply\r\n', b'> '):
+        buffer.write(data)
+
+
+def test_drop_keeps_own_output_and_discards_new_broadcasts():
+    buffer = OutputBuffer(limit=2, policy='drop')
+    own_output(buffer)
+    assert buffer.put(b'one\r\n')
+    assert buffer.put(b'two\r\n')
+    assert buffer.put(b'three\r\n')
+    assert list(buffer.chunks) == [b'IAC reply', b'command reply\r\n', b'> ', b'one\r\n', b'two\r\n']
+    assert buffer.dropped == 1
+
+
+def test_disconnect_only_counts_broadcasts():
+    buffer = OutputBuffer(limit=2, policy='disconnect')
+    for _ in range(10):
+        buffer.write(b'large reply\r\n')
+    assert buffer.put(b'one\r\n')
+    assert buffer.put(b'two\r\n')
+    assert not buffer.put(b'three\r\n')
+
+
+def test_coalesce_replaces_only_broadcasts():
+    buffer = OutputBuffer(limit=3, policy='coalesce')
+    own_output(buffer)
+    for message in (b'a\r\n', b'b\r\n', b'c\r\n'):
+        assert buffer.put(message)
+    buffer.write(b'late reply\r\n')
+    assert buffer.put(b'bcast\r\n')
+    assert list(buffer.chunks) == [b'IAC reply', b'command reply\r\n', b'> ', b'late reply\r\n',
+                                   b'[3 messages skipped]\r\n', b'bcast\r\n']
+    assert buffer.broadcasts == 2
+    assert buffer.dropped == 3
+
+
+@pytest.mark.parametrize('policy', ['drop', 'coalesce', 'disconnect'])
+def test_partly_sent_broadcast_is_kept(policy):
+    buffer = OutputBuffer(limit=1, policy=policy)
+    assert buffer.put(b'first broadcast\r\n')
+    sock = FakeSocket(capacity=5)
+    assert not buffer.flush(sock)
+    # The rest of the partly sent entry no longer counts and is never dropped
+    assert buffer.broadcasts == 0
+    assert buffer.put(b'second\r\n')
+    sock.capacity = 1 << 20
+    assert buffer.flush(sock)
+    assert bytes(sock.sent) == b'first broadcast\r\nsecond\r\n'
+
+
+def test_flush_sends_everything_in_order():
+    buffer = OutputBuffer(limit=4, policy='drop')
+    own_output(buffer)
+    buffer.put(b'x\r\n')
+    sock = FakeSocket()
+    assert buffer.flush(sock)
+    assert bytes(sock.sent) == b'IAC replycommand reply\r\n> x\r\n'
+    assert len(buffer) == 0 and buffer.broadcasts == 0
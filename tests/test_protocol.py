@@ -0,0 +1,95 @@
+import zlib
+
+import pytest
+
+from protocol import (COMPRESS2, DO, IAC, NAWS, SB, SE, TERMINAL_TYPE, WILL,
+                      TelnetParser)
+
+
+class Recorder:
+    """Collects everything a TelnetParser reports through its callbacks."""
+
+    def __init__(self, decompress=False):
+        self.negotiations = []
+        self.subnegotiations = []
+        self.commands = []
+        self.parser = TelnetParser(on_negotiate=lambda *args: self.negotiations.append(args),
+                                   on_subnegotiation=lambda *args: self.subnegotiations.append(args),
+                                   on_command=self.commands.append,
+                                   decompress=decompress)
+
+    def feed_all(self, chunks):
+        return b''.join(self.parser.feed(chunk) for chunk in chunks)
+
+
+def split_everywhere(data):
+    """Every way of cutting data into two chunks."""
+    return [(data[:i], data[i:]) for i in range(len(data) + 1)]
+
+
+STREAM = (b'hello ' + bytes([IAC, DO, NAWS]) + b'wor' + bytes([IAC, IAC]) + b'ld'
+          + bytes([IAC, SB, TERMINAL_TYPE, 0]) + b'xterm' + bytes([IAC, SE])
+          + bytes([IAC, 241]) + b'!\r\n')
+
+
+def test_plain_data_passes_through():
+    recorder = Recorder()
+    assert recorder.parser.feed(b'look\r\n') == b'look\r\n'
+    assert recorder.negotiations == recorder.subnegotiations == recorder.commands == []
+
+
+@pytest.mark.parametrize('chunks', split_everywhere(STREAM))
+def test_sequences_split_across_chunks(chunks):
+    recorder = Recorder()
+    assert recorder.feed_all(chunks) == b'hello wor\xffld!\r\n'
+    assert recorder.negotiations == [(DO, NAWS)]
+    assert recorder.subnegotiations == [(TERMINAL_TYPE, b'\x00xterm')]
+    assert recorder.commands == [241]
+
+
+def test_one_byte_at_a_time():
+    recorder = Recorder()
+    assert recorder.feed_all([bytes([b]) for b in STREAM]) == b'hello wor\xffld!\r\n'
+    assert recorder.subnegotiations == [(TERMINAL_TYPE, b'\x00xterm')]
+
+
+def test_escaped_iac_inside_subnegotiation():
+    recorder = Recorder()
+    recorder.parser.feed(bytes([IAC, SB, NAWS, 0, IAC, IAC, 0, 24, IAC, SE]))
+    assert recorder.subnegotiations == [(NAWS, bytes([0, IAC, 0, 24]))]
+
+
+def test_unterminated_subnegotiation_ends_at_next_command():
+    recorder = Recorder()
+    assert recorder.parser.feed(bytes([IAC, SB, NAWS, 1, 2, IAC, WILL, 1]) + b'ok') == b'ok'
+    assert recorder.subnegotiations == [(NAWS, b'\x01\x02')]
+    assert recorder.negotiations == [(WILL, 1)]
+
+
+def compressed_stream(text):
+    deflate = zlib.compressobj()
+    return deflate.compress(text) + deflate.flush(zlib.Z_FINISH)
+
+
+def test_mccp2_starts_in_the_middle_of_a_chunk():
+    recorder = Recorder(decompress=True)
+    start = bytes([IAC, SB, COMPRESS2, IAC, SE])
+    payload = b'compressed ' + bytes([IAC, WILL, NAWS]) + b'text'
+    data = b'before' + start + compressed_stream(payload) + b'after'
+    assert recorder.parser.feed(data) == b'beforecompressed textafter'
+    assert recorder.negotiations == [(WILL, NAWS)]
+    assert recorder.parser.inflate is None
+    assert recorder.parser.stream_bytes == len(payload)
+
+
+@pytest.mark.parametrize('cut', range(1, 12))
+def test_mccp2_stream_split_across_chunks(cut):
+    recorder = Recorder(decompress=True)
+    data = bytes([IAC, SB, COMPRESS2, IAC, SE]) + compressed_stream(b'x' * 200 + b'\r\n')
+    assert recorder.feed_all([data[:cut], data[cut:]]) == b'x' * 200 + b'\r\n'
+
+
+def test_mccp2_ignored_without_decompress():
+    recorder = Recorder()
+    assert recorder.parser.feed(bytes([IAC, SB, COMPRESS2, IAC, SE]) + b'raw') == b'raw'
+    assert recorder.parser.inflate is None
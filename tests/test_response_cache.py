@@ -0,0 +1,71 @@
+import types
+
+import pytest
+
+import commands
+from commands import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock ResponseCache reads; set clock.now to move time."""
+    fake = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(commands, 'time', types.SimpleNamespace(monotonic=lambda: fake.now))
+    return fake
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResponseCache(size=4)
+    cache.put('help', b'reply', ttl=5)
+    clock.now += 4.9
+    assert cache.get('help') == b'reply'
+    clock.now += 0.1
+    assert cache.get('help') is None
+    assert len(cache) == 0
+
+
+def test_put_refreshes_ttl(clock):
+    cache = ResponseCache(size=4)
+    cache.put('who', b'old', ttl=5)
+    clock.now += 4
+    cache.put('who', b'new', ttl=5)
+    clock.now += 4
+    assert cache.get('who') == b'new'
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = ResponseCache(size=2)
+    cache.put('a', b'A', ttl=60)
+    cache.put('b', b'B', ttl=60)
+    assert cache.get('a') == b'A'  # b is now the least recently used
+    cache.put('c', b'C', ttl=60)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'A' and cache.get('c') == b'C'
+    assert len(cache) == 2
+
+
+def test_zero_size_disables_caching(clock):
+    cache = ResponseCache(size=0)
+    cache.put('a', b'A', ttl=60)
+    assert cache.get('a') is None
+
+
+def test_registering_a_command_clears_the_cache(clock):
+    registry = commands.CommandRegistry()
+    registry.cache.put('help', b'old help', ttl=60)
+    registry.register('wave', lambda *args: None)
+    assert registry.cache.get('help') is None
+
+
+def test_help_is_cached_per_topic_only():
+    import server
+
+    server.registry.cache.clear()
+    for text in ('', '  ', 'WHOAMI', 'whoami'):
+        assert server.command_reply(server.registry.lookup('help'), None, text)
+    assert set(server.registry.cache.entries) == {('help', ''), ('help', 'whoami')}
+    for junk in ('x1', 'x2', 'x3'):
+        with pytest.raises(commands.CommandError):
+            server.command_reply(server.registry.lookup('help'), None, junk)
+    assert len(server.registry.cache) == 2
+    server.registry.cache.clear()
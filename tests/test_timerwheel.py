@@ -0,0 +1,65 @@
+from timerwheel import TimerWheel
+
+
+def make_wheel(tick=1.0, slots=8):
+    wheel = TimerWheel(tick=tick, slots=slots)
+    return wheel, wheel.current * tick  # Explicit clock starting at the wheel's position
+
+
+def test_expires_once_deadline_passes():
+    wheel, now = make_wheel()
+    wheel.schedule('a', 3, now=now)
+    assert wheel.advance(now + 2) == []
+    assert wheel.advance(now + 3) == ['a']
+    assert 'a' not in wheel and len(wheel) == 0
+    assert wheel.advance(now + 10) == []
+
+
+def test_rearm_later_postpones_expiry():
+    wheel, now = make_wheel()
+    wheel.schedule('a', 3, now=now)
+    wheel.schedule('a', 3, now=now + 2)  # Activity: deadline moves to now + 5
+    assert wheel.advance(now + 4) == []
+    assert 'a' in wheel
+    assert wheel.advance(now + 5) == ['a']
+
+
+def test_rearm_earlier_moves_the_key():
+    wheel, now = make_wheel()
+    wheel.schedule('a', 6, now=now)
+    wheel.schedule('a', 1, now=now)
+    assert wheel.advance(now + 1) == ['a']
+    assert wheel.advance(now + 7) == []
+
+
+def test_deadline_beyond_one_turn():
+    wheel, now = make_wheel(slots=4)
+    wheel.schedule('a', 10, now=now)
+    for step in range(1, 10):
+        assert wheel.advance(now + step) == []
+    assert wheel.advance(now + 10) == ['a']
+
+
+def test_large_jump_expires_everything_due():
+    wheel, now = make_wheel(slots=4)
+    for i in range(10):
+        wheel.schedule(i, i + 1, now=now)
+    wheel.schedule('later', 100, now=now)
+    assert sorted(wheel.advance(now + 50)) == list(range(10))
+    assert list(wheel.entries) == ['later']
+
+
+def test_cancel():
+    wheel, now = make_wheel()
+    wheel.schedule('a', 1, now=now)
+    wheel.cancel('a')
+    wheel.cancel('unknown')
+    assert wheel.advance(now + 5) == []
+    assert len(wheel) == 0
+
+
+def test_fractional_tick():
+    wheel, now = make_wheel(tick=0.25)
+    wheel.schedule('a', 0.6, now=now)
+    assert wheel.advance(now + 0.5) == []
+    assert wheel.advance(now + 0.75) == ['a']
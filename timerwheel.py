@@ -0,0 +1,78 @@
+"""Hashed timing wheel for cheap per-session timeouts."""
+
+import math
+import threading
+import time
+
+
+class TimerWheel:
+    """Hashed timing wheel: arming, re-arming and expiring a key are O(1).
+
+    Keys are hashed into `slots` buckets by the tick their deadline falls in.
+    Pushing a deadline later (the common case: a session saw activity) only
+    updates the entry; the key is moved to its new bucket when the wheel
+    reaches the old one. advance() visits the buckets between the previous
+    call and now and returns the keys whose deadline has passed.
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.entries = {}  # key -> [deadline, slot index]
+        self.current = int(time.monotonic() / tick)  # Last tick processed
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _place(self, key, entry):
+        tick = max(math.ceil(entry[0] / self.tick), self.current + 1)
+        index = tick % len(self.slots)
+        entry[1] = index
+        self.slots[index][key] = entry
+
+    def schedule(self, key, timeout, now=None):
+        """Arm (or re-arm) key to expire `timeout` seconds from now."""
+        deadline = (time.monotonic() if now is None else now) + timeout
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [deadline, None]
+                self._place(key, entry)
+            elif deadline >= entry[0]:
+                entry[0] = deadline  # Lazily moved when its old bucket comes up
+            else:
+                del self.slots[entry[1]][key]
+                entry[0] = deadline
+                self._place(key, entry)
+
+    def cancel(self, key):
+        """Disarm key; unknown keys are ignored."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                del self.slots[entry[1]][key]
+
+    def advance(self, now=None):
+        """Move the wheel to now and return the keys that expired."""
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        with self.lock:
+            # A full turn visits every bucket, so never walk more than that
+            first = max(self.current + 1, target - len(self.slots) + 1)
+            self.current = target
+            for tick in range(first, target + 1):
+                bucket = self.slots[tick % len(self.slots)]
+                for key, entry in list(bucket.items()):
+                    if entry[0] <= now:
+                        del bucket[key]
+                        del self.entries[key]
+                        expired.append(key)
+                    else:
+                        del bucket[key]
+                        self._place(key, entry)
+        return expired